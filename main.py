@@ -1,6 +1,11 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from tell_stories_api.routes import script, voice, book
+from tell_stories_api.voice_handler.service import VoiceService, VOICE_AUTO_RESUME
+from tell_stories_api.voice_handler.preview import PREVIEW_PREWARM, start_prewarm_previews
+from tell_stories_api.jobs.job_queue import get_job_queue
+from tell_stories_api.jobs.worker import JobWorker, JOB_WORKER_IN_PROCESS
 from tell_stories_api.logs import logger
 from tell_stories_api.webui import mount_webui
 import uvicorn
@@ -8,8 +13,21 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Voice jobs started before the job queue do not survive a restart; pick them up where they stopped
+    if VOICE_AUTO_RESUME:
+        VoiceService().resume_interrupted_jobs()
+    # Run queued jobs in this process too, unless they are left to separate workers
+    worker = JobWorker(get_job_queue()).start() if JOB_WORKER_IN_PROCESS else None
+    if PREVIEW_PREWARM:
+        start_prewarm_previews()
+    yield
+    if worker:
+        worker.stop()
+
 def create_app() -> FastAPI:
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
     
     # Set all CORS enabled origins
     app.add_middleware(
@@ -0,0 +1,121 @@
+import os
+from typing import Dict, Any, List
+from tell_stories_api.logs import logger
+from tell_stories_api.script_handler.utils import count_tokens
+
+# Token cap of the rolling summary pasted into new chapter prompts
+BOOK_CONTEXT_MAX_TOKENS = int(os.getenv("BOOK_CONTEXT_MAX_TOKENS", 2000))
+# Number of newest chapters kept with their detailed plot; older ones keep only the main plot
+BOOK_CONTEXT_DETAILED_CHAPTERS = int(os.getenv("BOOK_CONTEXT_DETAILED_CHAPTERS", 2))
+# Characters seen within this many chapters count as recently active
+BOOK_CONTEXT_RECENT_CHAPTERS = int(os.getenv("BOOK_CONTEXT_RECENT_CHAPTERS", 3))
+# Upper bound of characters listed in a prompt
+BOOK_CONTEXT_MAX_CHARACTERS = int(os.getenv("BOOK_CONTEXT_MAX_CHARACTERS", 40))
+
+
+def empty_context() -> Dict[str, Any]:
+    """Return an empty rolling context"""
+    return {"entries": [], "tokens": 0, "character_last_seen": {}}
+
+
+def _make_entry(chapter_no: int, plot: Dict[str, Any], detailed: bool) -> Dict[str, Any]:
+    text = plot.get("detailed_main_plot", "") if detailed else plot.get("main_plot", "")
+    text = f"Chapter {chapter_no}: {text}"
+    return {"chapter": chapter_no, "text": text, "detailed": detailed, "tokens": count_tokens(text)}
+
+
+def merge_chapter_into_context(context: Dict[str, Any], chapters: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Fold the newest chapter into the rolling context.
+
+    Only the entries that fall out of the detailed window are rewritten, and the
+    oldest entries are dropped until the summary fits BOOK_CONTEXT_MAX_TOKENS, so
+    the work per merge does not grow with the number of chapters.
+
+    Args:
+        context (Dict): The current rolling context (as stored in book.json)
+        chapters (List[Dict]): All chapters of the book; the last one is the new chapter
+
+    Returns:
+        Dict: The updated rolling context
+    """
+    if not chapters:
+        return context
+
+    chapter_no = len(chapters)
+    new_chapter = chapters[-1]
+    entries = context.get("entries", [])
+
+    # Demote entries that left the detailed window to their short main plot
+    for entry in entries:
+        if entry["detailed"] and chapter_no - entry["chapter"] >= BOOK_CONTEXT_DETAILED_CHAPTERS:
+            entry.update(_make_entry(entry["chapter"], chapters[entry["chapter"] - 1]["plot"], detailed=False))
+
+    entries.append(_make_entry(chapter_no, new_chapter["plot"], detailed=BOOK_CONTEXT_DETAILED_CHAPTERS > 0))
+
+    # Drop the oldest entries until the summary fits the token cap; always keep the newest one
+    total_tokens = sum(entry["tokens"] for entry in entries)
+    while len(entries) > 1 and total_tokens > BOOK_CONTEXT_MAX_TOKENS:
+        total_tokens -= entries.pop(0)["tokens"]
+
+    last_seen = context.get("character_last_seen", {})
+    for name in new_chapter.get("characters", {}).get("dict", {}):
+        last_seen[name] = chapter_no
+
+    logger.info(f"Book context updated: {len(entries)} entries, {total_tokens} tokens")
+    return {"entries": entries, "tokens": total_tokens, "character_last_seen": last_seen}
+
+
+def get_book_context(book_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the rolling context of a book, replaying its chapters for books created before it existed"""
+    if book_data.get("context"):
+        return book_data["context"]
+
+    context = empty_context()
+    chapters = (book_data.get("chapters") or {}).get("chapters", [])
+    for idx in range(len(chapters)):
+        context = merge_chapter_into_context(context, chapters[:idx + 1])
+    return context
+
+
+def render_book_summary(context: Dict[str, Any]) -> str:
+    """Render the rolling summary as prompt text"""
+    return "\n\n".join(entry["text"] for entry in context.get("entries", []))
+
+
+def _is_mentioned(name: str, details: Dict[str, Any], text: str) -> bool:
+    names = [name] + (details.get("alternativeNames") or [])
+    return any(n and n.lower() in text for n in names)
+
+
+def select_relevant_characters(book_data: Dict[str, Any], text: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Select the book characters worth showing in a new chapter's prompt.
+
+    A character is kept if it was active in the last BOOK_CONTEXT_RECENT_CHAPTERS
+    chapters or if its name (or an alternative name) is mentioned in the text.
+
+    Args:
+        book_data (Dict): The book data
+        text (str): The new chapter text (or anything naming its characters)
+
+    Returns:
+        Dict[str, Dict]: Map of character names to their details, most recent first
+    """
+    characters = (book_data.get("characters") or {}).get("dict", {})
+    if not characters:
+        return {}
+
+    context = get_book_context(book_data)
+    last_seen = context.get("character_last_seen", {})
+    chapter_count = (book_data.get("chapters") or {}).get("count", 0)
+    lowered_text = text.lower()
+
+    relevant = [
+        name for name, details in characters.items()
+        if name.lower() == "narrator"
+        or chapter_count - last_seen.get(name, 0) < BOOK_CONTEXT_RECENT_CHAPTERS
+        or _is_mentioned(name, details, lowered_text)
+    ]
+    relevant.sort(key=lambda name: last_seen.get(name, 0), reverse=True)
+    return {name: characters[name] for name in relevant[:BOOK_CONTEXT_MAX_CHARACTERS]}
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 from tell_stories_api.common.models import Plot, CharactersDict, CastEntry
 
 class Chapter(BaseModel):
@@ -18,6 +18,20 @@ class CastList(BaseModel):
     cast: List[CastEntry] = Field(..., description="List of character to voice actor mappings")
 
 
+class ContextEntry(BaseModel):
+    """Model for one chapter's entry in the rolling book summary"""
+    chapter: int = Field(..., description="1-based chapter number")
+    text: str = Field(..., description="Summary text kept for this chapter")
+    detailed: bool = Field(False, description="Whether the text is the detailed plot or the short main plot")
+    tokens: int = Field(0, description="Token count of the text")
+
+class BookContext(BaseModel):
+    """Model for the bounded rolling context used when prompting new chapters"""
+    entries: List[ContextEntry] = Field(default_factory=list, description="Rolling summary entries, oldest first")
+    tokens: int = Field(0, description="Total token count of the rolling summary")
+    character_last_seen: Dict[str, int] = Field(default_factory=dict, description="Map of character names to the last chapter they appeared in")
+
+
 class BookCreate(BaseModel):
     """Model for creating a new book"""
     name: str = Field(..., description="Name of the book")
@@ -38,4 +52,5 @@ class Book(BaseModel):
     plot: Optional[Plot] = Field(None, description="Book plot")
     chapters: Optional[ChapterList] = Field(None, description="List of chapters")
     characters: Optional[CharactersDict] = Field(None, description="List of characters")
-    cast: Optional[CastList] = Field(None, description="List of cast entries") 
\ No newline at end of file
+    cast: Optional[CastList] = Field(None, description="List of cast entries")
+    context: Optional[BookContext] = Field(None, description="Bounded rolling context for prompting new chapters")
@@ -1,6 +1,6 @@
 from pathlib import Path
 import json
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from tell_stories_api.logs import logger
 # Constants
 BOOK_DATA_DIR = Path("data/book")
@@ -18,6 +18,15 @@ def get_book_path(book_id: str) -> Path:
     """Get the full path for a book's JSON file"""
     return get_book_dir(book_id) / "book.json"
 
+def get_book_signature(book_id: Optional[str]) -> Optional[int]:
+    """Get a cheap signature (mtime) of a book's JSON file to detect changes to its chapters, context or cast"""
+    if not book_id:
+        return None
+    try:
+        return get_book_path(book_id).stat().st_mtime_ns
+    except OSError:
+        return None
+
 def get_process_dir(project_id: str) -> Path:
     """Get the directory path for a specific project's process data"""
     return PROCESS_DATA_DIR / project_id
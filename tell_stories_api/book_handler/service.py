@@ -1,5 +1,6 @@
 from fastapi import HTTPException, status
 from . import processor
+from .context import get_book_context, merge_chapter_into_context
 from tell_stories_api.book_handler.models import Book, BookCreate, BookUpdate, ChapterList, CastList, Chapter
 from tell_stories_api.common.models import Plot, CharactersDict, CastEntry, CharacterDetails
 from tell_stories_api.logs import logger
@@ -84,6 +85,7 @@ async def update_book(book_id: str, book_update: BookUpdate) -> Book:
             "count": book_update.chapters.count,
             "chapters": [chapter.model_dump() for chapter in book_update.chapters.chapters]
         }
+        book_data["context"] = None  # Rebuilt from the new chapters on next use
         
     # Update characters if provided
     if book_update.characters is not None:
@@ -115,6 +117,7 @@ async def update_chapters(book_id: str, chapters: ChapterList) -> Book:
         "count": chapters.count,
         "chapters": [chapter.model_dump() for chapter in chapters.chapters]
     }
+    book_data["context"] = None  # Rebuilt from the new chapters on next use
     
     processor.write_book_file(book_id, book_data)
     return Book(**book_data)
@@ -252,6 +255,12 @@ async def process_new_chapter(book_id: str, project_id: str) -> Book:
     
     logger.info(f'book_data["plot"]: {book_data["plot"]}')
     
+    # 5. Fold the new chapter into the bounded rolling context used by the prompts
+    if book_data.get("context"):
+        book_data["context"] = merge_chapter_into_context(book_data["context"], book_data["chapters"]["chapters"])
+    else:
+        book_data["context"] = get_book_context(book_data)
+    
     # Save updated book data
     processor.write_book_file(book_id, book_data)
     return Book(**book_data) 
\ No newline at end of file
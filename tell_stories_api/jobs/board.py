@@ -0,0 +1,309 @@
+import json
+import os
+import shutil
+import socket
+import time
+import uuid
+from pathlib import Path
+from threading import Event, Semaphore, Thread
+from typing import Any, Callable, Dict, List, Optional
+from tell_stories_api.logs import logger
+
+# Shared by every node: it must be on the same storage as data/process and output/
+WORK_BOARD_DIR = os.getenv("WORK_BOARD_DIR", "data/work")
+# A unit whose lease file is not touched for this long is stolen by the next worker looking for work.
+# Lease expiry compares file times with the local clock, so the nodes' clocks must be in sync.
+WORK_LEASE_SECONDS = float(os.getenv("WORK_LEASE_SECONDS", 60))
+# Failed attempts (errors or expired leases) of a unit before it is given up
+WORK_MAX_ATTEMPTS = int(os.getenv("WORK_MAX_ATTEMPTS", 3))
+WORK_POLL_INTERVAL = float(os.getenv("WORK_POLL_INTERVAL", 1.0))
+# A batch whose coordinator has not touched it for this long is removed by the next worker looking for work.
+# Long enough for the retry of a dead coordinator's job to reattach to it and keep the results done so far.
+WORK_BATCH_ORPHAN_SECONDS = float(os.getenv("WORK_BATCH_ORPHAN_SECONDS", 600))
+
+
+def _write_json_atomic(path: Path, data: Any) -> None:
+    """Write a file other nodes may read at any time: to a temporary name, then renamed over"""
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "w", encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def get_worker_id() -> str:
+    """A worker ID unique across the nodes sharing the board"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class WorkBoard:
+    """
+    Work units (story parts, batches of TTS lines) shared through a directory, so that processes on
+    any node mounting it can claim them. Each batch of units is a directory:
+
+        <batch_id>/batch.json           kind, process_id and the context shared by its units, touched by the coordinator
+        <batch_id>/units/<unit>.json    the unit payloads
+        <batch_id>/leases/<unit>.lease  created exclusively by the claiming worker, touched as heartbeat
+        <batch_id>/failures/<unit>.*    one file per failed attempt
+        <batch_id>/results/<unit>.json  written once the unit is done (or given up, with an error)
+
+    A lease not touched for WORK_LEASE_SECONDS is stolen: renamed away by exactly one worker, which
+    then claims the unit. The unit may then run twice if its first worker was only stalled; results
+    are written atomically, so either complete result is kept. A batch not touched by its coordinator for
+    WORK_BATCH_ORPHAN_SECONDS is removed, so no node keeps working on results nobody collects.
+    """
+
+    def __init__(self, root: str = WORK_BOARD_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._batches: Dict[str, Dict[str, Any]] = {}
+
+    def create_batch(self, kind: str, process_id: str, payloads: List[Dict[str, Any]], context: Dict[str, Any]) -> str:
+        """
+        Publish a batch of units. The batch is written to a hidden directory and renamed into place,
+        so workers never see it half written.
+
+        Returns:
+            str: The batch ID; batch IDs sort in creation order
+        """
+        batch_id = f"{time.time_ns()}-{kind}-{process_id}-{uuid.uuid4().hex[:6]}"
+        tmp_dir = self.root / f".{batch_id}"
+        for name in ("units", "leases", "failures", "results"):
+            (tmp_dir / name).mkdir(parents=True)
+        with open(tmp_dir / "batch.json", "w", encoding='utf-8') as f:
+            json.dump({"kind": kind, "process_id": process_id, "context": context, "units": len(payloads)}, f, ensure_ascii=False)
+        for index, payload in enumerate(payloads):
+            with open(tmp_dir / "units" / f"{index:05d}.json", "w", encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False)
+        os.rename(tmp_dir, self.root / batch_id)
+        logger.info(f"Published {len(payloads)} {kind} units of {process_id} as batch {batch_id}")
+        return batch_id
+
+    def _get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        if batch_id not in self._batches:
+            try:
+                with open(self.root / batch_id / "batch.json", encoding='utf-8') as f:
+                    self._batches[batch_id] = json.load(f)
+            except FileNotFoundError:
+                # Closed by its coordinator
+                return None
+        return self._batches[batch_id]
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Get a published batch (kind, process_id, context, units), None if it was closed"""
+        return self._get_batch(batch_id)
+
+    def touch_batch(self, batch_id: str) -> bool:
+        """Mark a batch as still collected by its coordinator. Returns False if it was removed."""
+        try:
+            os.utime(self.root / batch_id / "batch.json")
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _is_orphaned(self, batch_id: str) -> bool:
+        try:
+            return time.time() - (self.root / batch_id / "batch.json").stat().st_mtime > WORK_BATCH_ORPHAN_SECONDS
+        except FileNotFoundError:
+            return False
+
+    def _get_attempts(self, batch_dir: Path, unit_id: str) -> int:
+        return sum(1 for _ in (batch_dir / "failures").glob(f"{unit_id}.*"))
+
+    def _record_failure(self, batch_dir: Path, unit_id: str, error: str) -> None:
+        """Count a failed attempt, and give the unit up with an error result after WORK_MAX_ATTEMPTS"""
+        (batch_dir / "failures" / f"{unit_id}.{uuid.uuid4().hex}").write_text(error, encoding='utf-8')
+        if self._get_attempts(batch_dir, unit_id) >= WORK_MAX_ATTEMPTS:
+            logger.error(f"Unit {unit_id} of {batch_dir.name} failed {WORK_MAX_ATTEMPTS} times: {error}")
+            _write_json_atomic(batch_dir / "results" / f"{unit_id}.json", {"error": error})
+
+    def _try_lease(self, batch_dir: Path, unit_id: str, worker_id: str) -> bool:
+        """Create the unit's lease, stealing it first if it expired"""
+        lease_path = batch_dir / "leases" / f"{unit_id}.lease"
+        for _ in range(2):
+            try:
+                fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    lease_stat = lease_path.stat()
+                except FileNotFoundError:
+                    # Released meanwhile: try again
+                    continue
+                if time.time() - lease_stat.st_mtime <= WORK_LEASE_SECONDS:
+                    return False
+                stolen_path = lease_path.with_name(f"{unit_id}.stolen-{uuid.uuid4().hex}")
+                try:
+                    # Only one worker can rename the expired lease away
+                    os.rename(lease_path, stolen_path)
+                except FileNotFoundError:
+                    return False
+                stolen_stat = stolen_path.stat()
+                if (stolen_stat.st_ino, stolen_stat.st_mtime) != (lease_stat.st_ino, lease_stat.st_mtime):
+                    # Between the check and the rename, another worker stole the expired lease and created
+                    # a fresh one, or the owner renewed it: that is what was renamed, so put it back
+                    self._restore_lease(stolen_path, lease_path)
+                    return False
+                previous_owner = stolen_path.read_text(encoding='utf-8')
+                stolen_path.unlink()
+                logger.warning(f"Stealing unit {unit_id} of {batch_dir.name}: lease of {previous_owner} expired")
+                self._record_failure(batch_dir, unit_id, f"Lease of {previous_owner} expired")
+                if (batch_dir / "results" / f"{unit_id}.json").exists():
+                    return False
+                continue
+            with os.fdopen(fd, "w", encoding='utf-8') as f:
+                f.write(worker_id)
+            return True
+        return False
+
+    def _restore_lease(self, stolen_path: Path, lease_path: Path) -> None:
+        try:
+            # Linked rather than renamed, so a lease created meanwhile is never overwritten
+            os.link(stolen_path, lease_path)
+        except FileExistsError:
+            logger.warning(f"Could not restore {lease_path.name} of {lease_path.parent.parent.name}: a new lease exists")
+        stolen_path.unlink()
+
+    def claim(self, worker_id: str, kinds: Optional[List[str]] = None, batch_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Lease the next unit without a result, oldest batch first.
+
+        Args:
+            worker_id (str): Unique ID of the claiming worker
+            kinds (Optional[List[str]]): Only claim units of these kinds; all kinds if None
+            batch_id (Optional[str]): Only claim units of this batch
+
+        Returns:
+            Optional[Dict[str, Any]]: The unit (batch_id, unit_id, kind, process_id, payload, context), or None
+        """
+        batch_ids = [batch_id] if batch_id else sorted(p.name for p in self.root.iterdir() if not p.name.startswith("."))
+        for current_batch_id in batch_ids:
+            batch = self._get_batch(current_batch_id)
+            if batch is None or (kinds and batch["kind"] not in kinds):
+                continue
+            if self._is_orphaned(current_batch_id):
+                logger.warning(f"Removing batch {current_batch_id}: its coordinator stopped collecting results")
+                self.close_batch(current_batch_id)
+                continue
+            batch_dir = self.root / current_batch_id
+            try:
+                unit_paths = sorted((batch_dir / "units").iterdir())
+                done = {p.stem for p in (batch_dir / "results").iterdir()}
+            except FileNotFoundError:
+                continue
+            for unit_path in unit_paths:
+                unit_id = unit_path.stem
+                if unit_id in done or not self._try_lease(batch_dir, unit_id, worker_id):
+                    continue
+                with open(unit_path, encoding='utf-8') as f:
+                    payload = json.load(f)
+                return {
+                    "batch_id": current_batch_id,
+                    "unit_id": unit_id,
+                    "kind": batch["kind"],
+                    "process_id": batch["process_id"],
+                    "payload": payload,
+                    "context": batch["context"],
+                    "attempts": self._get_attempts(batch_dir, unit_id) + 1,
+                }
+        return None
+
+    def _owns_lease(self, unit: Dict[str, Any], worker_id: str) -> bool:
+        lease_path = self.root / unit["batch_id"] / "leases" / f"{unit['unit_id']}.lease"
+        try:
+            return lease_path.read_text(encoding='utf-8') == worker_id
+        except FileNotFoundError:
+            return False
+
+    def heartbeat(self, unit: Dict[str, Any], worker_id: str) -> bool:
+        """Renew a unit's lease. Returns False if it was stolen."""
+        if not self._owns_lease(unit, worker_id):
+            return False
+        os.utime(self.root / unit["batch_id"] / "leases" / f"{unit['unit_id']}.lease")
+        return True
+
+    def _release(self, unit: Dict[str, Any], worker_id: str) -> None:
+        if self._owns_lease(unit, worker_id):
+            (self.root / unit["batch_id"] / "leases" / f"{unit['unit_id']}.lease").unlink(missing_ok=True)
+
+    def complete(self, unit: Dict[str, Any], worker_id: str, result: Dict[str, Any]) -> None:
+        batch_dir = self.root / unit["batch_id"]
+        try:
+            _write_json_atomic(batch_dir / "results" / f"{unit['unit_id']}.json", {"worker_id": worker_id, "result": result})
+        except FileNotFoundError:
+            # The batch was closed, its coordinator got the result from another worker
+            return
+        self._release(unit, worker_id)
+
+    def fail(self, unit: Dict[str, Any], worker_id: str, error: str) -> None:
+        batch_dir = self.root / unit["batch_id"]
+        try:
+            self._record_failure(batch_dir, unit["unit_id"], error)
+        except FileNotFoundError:
+            return
+        self._release(unit, worker_id)
+
+    def get_results(self, batch_id: str) -> Dict[int, Dict[str, Any]]:
+        """Get the results written so far, by unit index"""
+        results = {}
+        for path in (self.root / batch_id / "results").glob("*.json"):
+            with open(path, encoding='utf-8') as f:
+                results[int(path.stem)] = json.load(f)
+        return results
+
+    def close_batch(self, batch_id: str) -> None:
+        """Remove a batch once its coordinator has collected the results"""
+        self._batches.pop(batch_id, None)
+        shutil.rmtree(self.root / batch_id, ignore_errors=True)
+
+
+class UnitWorker:
+    """Claims units from the board and runs up to `concurrency` of them at once, each on its own thread"""
+
+    def __init__(self, board: WorkBoard, handlers: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]],
+                 concurrency: int, batch_id: Optional[str] = None):
+        self.board = board
+        self.handlers = handlers
+        self.batch_id = batch_id
+        self.worker_id = get_worker_id()
+        self._slots = Semaphore(concurrency)
+        self._stopped = Event()
+
+    def start(self) -> "UnitWorker":
+        Thread(target=self.run, name="unit-worker", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def run(self) -> None:
+        logger.info(f"Unit worker {self.worker_id} started for {', '.join(self.handlers)}")
+        while not self._stopped.is_set():
+            self._slots.acquire()
+            try:
+                unit = self.board.claim(self.worker_id, list(self.handlers), self.batch_id)
+            except Exception as e:
+                logger.error(f"Unit worker {self.worker_id} failed to claim a unit: {e}")
+                unit = None
+            if unit is None:
+                self._slots.release()
+                self._stopped.wait(WORK_POLL_INTERVAL)
+                continue
+            Thread(target=self._run_unit, args=(unit,), name=f"unit-{unit['unit_id']}", daemon=True).start()
+
+    def _heartbeat(self, unit: Dict[str, Any], done: Event) -> None:
+        while not done.wait(WORK_LEASE_SECONDS / 3):
+            if not self.board.heartbeat(unit, self.worker_id):
+                logger.warning(f"Unit {unit['unit_id']} of {unit['batch_id']} was stolen from {self.worker_id}")
+                return
+
+    def _run_unit(self, unit: Dict[str, Any]) -> None:
+        done = Event()
+        Thread(target=self._heartbeat, args=(unit, done), daemon=True).start()
+        try:
+            result = self.handlers[unit["kind"]](unit)
+            self.board.complete(unit, self.worker_id, result)
+        except Exception as e:
+            logger.error(f"Unit {unit['unit_id']} of {unit['batch_id']} failed: {e}")
+            self.board.fail(unit, self.worker_id, str(e))
+        finally:
+            done.set()
+            self._slots.release()
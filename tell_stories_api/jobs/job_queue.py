@@ -0,0 +1,257 @@
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional
+from tell_stories_api.logs import logger
+
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "data/jobs.sqlite3")
+# A running job whose worker stops heartbeating for this long is handed to another worker
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 60))
+# Attempts of a job before it is marked failed, with an exponential backoff between them
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", 30))
+
+# Job states: queued -> running -> completed | failed; a failed attempt with attempts left goes back to queued
+ACTIVE_STATES = ("queued", "running")
+
+
+class JobCancelledError(Exception):
+    """Raised by a job handler that stopped because its worker lost the job's lease"""
+    pass
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    process_id TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker_id TEXT,
+    lease_expires_at REAL,
+    run_after REAL NOT NULL,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (state, priority DESC, id);
+CREATE INDEX IF NOT EXISTS jobs_process ON jobs (process_id, kind, id DESC);
+"""
+
+
+def _to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    return job
+
+
+class JobQueue:
+    """
+    Persistent job queue in a local sqlite database, shared by the API and any number of worker
+    processes on the same machine.
+
+    Workers claim the queued job with the highest priority (oldest first) under a lease they renew
+    with heartbeats. A job whose lease expires, because its worker died or was reloaded, is retried
+    like a failed attempt.
+    """
+
+    def __init__(self, path: str = JOB_QUEUE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # A connection per call: safe across threads and processes, sqlite serializes the writers
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, kind: str, process_id: str, payload: Dict[str, Any], priority: int = 0,
+                max_attempts: int = JOB_MAX_ATTEMPTS) -> int:
+        """
+        Add a job, unless the process already has a queued or running job of this kind.
+
+        Returns:
+            int: The ID of the new job, or of the active one
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            active = conn.execute(
+                f"SELECT id FROM jobs WHERE process_id = ? AND kind = ? AND state IN {ACTIVE_STATES}",
+                (process_id, kind)
+            ).fetchone()
+            if active:
+                logger.info(f"{kind} job {active['id']} of {process_id} is already active")
+                return active["id"]
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, process_id, payload, state, priority, max_attempts, run_after, created_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (kind, process_id, json.dumps(payload, ensure_ascii=False), priority, max_attempts, now, now)
+            )
+            return cursor.lastrowid
+
+    def _expire_leases(self, conn: sqlite3.Connection, now: float) -> None:
+        """Treat running jobs with an expired lease as failed attempts. Must be in a transaction."""
+        for job in conn.execute(
+            "SELECT id, attempts, max_attempts, worker_id FROM jobs WHERE state = 'running' AND lease_expires_at < ?", (now,)
+        ).fetchall():
+            logger.warning(f"Lease of job {job['id']} held by {job['worker_id']} expired")
+            self._finish_attempt(conn, job["id"], job["attempts"], job["max_attempts"], "Lease expired", now)
+
+    def _finish_attempt(self, conn: sqlite3.Connection, job_id: int, attempts: int, max_attempts: int,
+                        error: str, now: float) -> None:
+        if attempts < max_attempts:
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', worker_id = NULL, lease_expires_at = NULL, error = ?, run_after = ? WHERE id = ?",
+                (error, now + JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1), job_id)
+            )
+        else:
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', worker_id = NULL, lease_expires_at = NULL, error = ?, finished_at = ? WHERE id = ?",
+                (error, now, job_id)
+            )
+
+    def claim(self, worker_id: str, kinds: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """
+        Lease the next runnable job to a worker.
+
+        Args:
+            worker_id (str): Unique ID of the claiming worker
+            kinds (Optional[List[str]]): Only claim jobs of these kinds; all kinds if None
+
+        Returns:
+            Optional[Dict[str, Any]]: The claimed job, or None if no job is runnable
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire_leases(conn, now)
+            query = "SELECT * FROM jobs WHERE state = 'queued' AND run_after <= ?"
+            params: List[Any] = [now]
+            if kinds:
+                query += f" AND kind IN ({', '.join('?' for _ in kinds)})"
+                params.extend(kinds)
+            row = conn.execute(query + " ORDER BY priority DESC, id LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = 'running', worker_id = ?, lease_expires_at = ?, attempts = attempts + 1, "
+                "started_at = ?, error = NULL WHERE id = ?",
+                (worker_id, now + JOB_LEASE_SECONDS, now, row["id"])
+            )
+            return _to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+    def heartbeat(self, job_id: int, worker_id: str) -> bool:
+        """Renew a job's lease. Returns False if the worker no longer holds it."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND state = 'running' AND worker_id = ?",
+                (time.time() + JOB_LEASE_SECONDS, job_id, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id: int, worker_id: str) -> bool:
+        """Mark a job completed. Returns False if the worker no longer holds it."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET state = 'completed', worker_id = NULL, lease_expires_at = NULL, finished_at = ? "
+                "WHERE id = ? AND state = 'running' AND worker_id = ?",
+                (time.time(), job_id, worker_id)
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id: int, worker_id: str, error: str, retry: bool = True) -> bool:
+        """
+        Record a failed attempt: the job is queued again after a backoff while it has attempts left,
+        or marked failed. Returns False if the worker no longer holds it.
+        """
+        with self._transaction() as conn:
+            job = conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ? AND state = 'running' AND worker_id = ?",
+                (job_id, worker_id)
+            ).fetchone()
+            if job is None:
+                return False
+            max_attempts = job["max_attempts"] if retry else job["attempts"]
+            self._finish_attempt(conn, job_id, job["attempts"], max_attempts, error, time.time())
+            return True
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _to_job(row) if row else None
+
+    def get_latest(self, process_id: str, kinds: List[str]) -> Optional[Dict[str, Any]]:
+        """Get the most recent job of a process among the given kinds"""
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT * FROM jobs WHERE process_id = ? AND kind IN ({', '.join('?' for _ in kinds)}) ORDER BY id DESC LIMIT 1",
+                (process_id, *kinds)
+            ).fetchone()
+        return _to_job(row) if row else None
+
+    def get_active(self, process_id: str, kinds: List[str]) -> Optional[Dict[str, Any]]:
+        """Get the queued or running job of a process among the given kinds, if any"""
+        job = self.get_latest(process_id, kinds)
+        return job if job and job["state"] in ACTIVE_STATES else None
+
+    def list_jobs(self, state: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            if state:
+                rows = conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id DESC LIMIT ?", (state, limit)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [_to_job(row) for row in rows]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Number of jobs per kind and state"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT kind, state, COUNT(*) AS count FROM jobs GROUP BY kind, state").fetchall()
+        stats: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            stats.setdefault(row["kind"], {})[row["state"]] = row["count"]
+        return stats
+
+
+def get_job_summary(job: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """The queue state of a job as reported by the progress endpoints"""
+    if job is None:
+        return None
+    return {key: job[key] for key in ("id", "kind", "state", "priority", "attempts", "max_attempts",
+                                      "worker_id", "error", "created_at", "started_at", "finished_at")}
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Get the process-wide job queue"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue()
+        return _job_queue
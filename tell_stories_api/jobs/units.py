@@ -0,0 +1,302 @@
+"""
+Lines and voice jobs split into work units on the shared board, so that worker nodes fronting other
+LLM and TTS capacity take part. The node running the job publishes the units, works on them too,
+and reassembles lines.json or the final audio from the results.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Event
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+from tell_stories_api.logs import logger
+from .board import WORK_POLL_INTERVAL, UnitWorker, WorkBoard
+from .job_queue import JobCancelledError
+
+if TYPE_CHECKING:
+    from tell_stories_api.voice_handler.models import ProgressData
+
+# Lines per TTS unit: large enough to keep a node's TTS requests concurrent, small enough to spread
+WORK_TTS_BATCH_LINES = int(os.getenv("WORK_TTS_BATCH_LINES", 20))
+# Units the coordinating node runs itself while waiting for the others
+WORK_COORDINATOR_CONCURRENCY = int(os.getenv("WORK_COORDINATOR_CONCURRENCY", 2))
+
+
+def run_lines_part(unit: Dict[str, Any]) -> Dict[str, Any]:
+    """Generate the lines of one story part"""
+    from tell_stories_api.script_handler.instruct import normalize_lines_instructs
+    from tell_stories_api.script_handler.service import ScriptService
+
+    process_dir = Path("data/process") / unit["process_id"]
+    options = unit["context"]
+    with open(process_dir / "plot.json", encoding='utf-8') as f:
+        json_plot = json.load(f)
+    with open(process_dir / "story_parts.json", encoding='utf-8') as f:
+        part = json.load(f)["parts"][unit["payload"]["index"]]
+
+    part_lines, latency, provider = ScriptService._process_part_timed(part, json_plot, unit["process_id"])
+    lines = ScriptService._postprocess_part_lines(part_lines, options["split_dialogue"], options["all_caps_to_proper"])
+    raw_instructs = None
+    if options["normalize_instructs"]:
+        lines, raw_instructs = normalize_lines_instructs(lines)
+    return {"lines": lines, "raw_instructs": raw_instructs, "latency": latency, "provider": provider}
+
+
+def run_tts_batch(unit: Dict[str, Any]) -> Dict[str, Any]:
+    """Synthesize a batch of lines on the TTS backends of this node"""
+    import soundfile as sf
+    from tell_stories_api.voice_handler.backends import get_backend_pool, get_env_endpoints
+    from tell_stories_api.voice_handler.models import VoiceRequest
+    from tell_stories_api.voice_handler.processor import VoiceProcessor, get_output_dir
+
+    request = VoiceRequest(**unit["context"]["request"])
+    cast_dict = unit["context"]["cast"]
+    # Each node uses the CosyVoice servers it fronts, falling back to those of the request
+    pool = get_backend_pool(get_env_endpoints() or request.get_endpoints())
+    output_dir = get_output_dir(unit["process_id"])
+    processor = VoiceProcessor()
+
+    def synthesize(index: int, line: dict) -> Dict[str, Any]:
+        output_path = output_dir / f"{index:05d}.wav"
+        started_at = time.monotonic()
+        try:
+            result = processor.synthesize_line(request, cast_dict, line, output_path, pool)
+        except Exception as e:
+            logger.error(f"Error generating audio for line {index}: {e}")
+            return {"index": index, "success": False, "character": line["character"], "is_fallback": False}
+        duration = result.duration
+        if result.success and duration is None:
+            duration = sf.info(output_path).duration
+        return {
+            "index": index,
+            "success": result.success,
+            "character": result.character,
+            "is_fallback": result.is_fallback,
+            "endpoint": result.endpoint,
+            "cache_hit": result.cache_hit,
+            "seconds": round(time.monotonic() - started_at, 3),
+            "duration": duration,
+        }
+
+    with ThreadPoolExecutor(max_workers=request.concurrency) as executor:
+        lines = list(executor.map(lambda item: synthesize(*item), unit["payload"]["lines"]))
+    return {"lines": lines}
+
+
+UNIT_HANDLERS = {
+    "lines_part": run_lines_part,
+    "tts_batch": run_tts_batch,
+}
+
+
+def _get_batch_file(process_id: str, kind: str) -> Path:
+    return Path("data/process") / process_id / f"work_batch_{kind}.json"
+
+
+def _open_batch(board: WorkBoard, kind: str, process_id: str, payloads: List[Dict[str, Any]], context: Dict[str, Any]) -> str:
+    """
+    Publish a batch and save its ID with the process. The retry of a job whose coordinator died
+    reattaches to the batch it published, keeping the results the nodes have written since.
+    """
+    batch_file = _get_batch_file(process_id, kind)
+    if batch_file.exists():
+        with open(batch_file, encoding='utf-8') as f:
+            batch_id = json.load(f)["batch_id"]
+        batch = board.get_batch(batch_id)
+        # Only the same units with the same context: a new request publishes a new batch
+        if batch and batch["units"] == len(payloads) and batch["context"] == json.loads(json.dumps(context)):
+            logger.info(f"Reattaching to batch {batch_id} of {process_id}")
+            return batch_id
+        if batch:
+            board.close_batch(batch_id)
+    batch_id = board.create_batch(kind, process_id, payloads, context)
+    with open(batch_file, "w", encoding='utf-8') as f:
+        json.dump({"batch_id": batch_id}, f)
+    return batch_id
+
+
+def _close_batch(board: WorkBoard, kind: str, process_id: str, batch_id: str) -> None:
+    board.close_batch(batch_id)
+    _get_batch_file(process_id, kind).unlink(missing_ok=True)
+
+
+def _run_batch(board: WorkBoard, batch_id: str, total: int, on_results, cancel: Optional[Event] = None) -> Dict[int, Dict[str, Any]]:
+    """
+    Work on a batch alongside the other nodes until every unit has a result.
+    on_results(results) is called whenever new results came in. Once cancel is set, stops with
+    JobCancelledError and leaves the batch to the job's next attempt.
+    """
+    worker = UnitWorker(board, UNIT_HANDLERS, WORK_COORDINATOR_CONCURRENCY, batch_id=batch_id).start()
+    seen = 0
+    try:
+        while True:
+            if cancel is not None and cancel.is_set():
+                raise JobCancelledError(f"Stopped collecting batch {batch_id}")
+            # Keeps the batch from being removed as orphaned
+            if not board.touch_batch(batch_id):
+                raise Exception(f"Batch {batch_id} was removed before all its results were collected")
+            results = board.get_results(batch_id)
+            if len(results) != seen:
+                seen = len(results)
+                on_results(results)
+            if seen >= total:
+                return results
+            time.sleep(WORK_POLL_INTERVAL)
+    finally:
+        worker.stop()
+
+
+def _get_errors(results: Dict[int, Dict[str, Any]]) -> List[str]:
+    return [f"unit {index}: {result['error']}" for index, result in sorted(results.items()) if "error" in result]
+
+
+def run_distributed_lines(process_id: str, options: Dict[str, Any], cancel: Optional[Event] = None) -> None:
+    """Generate the lines of a process with story parts as units, then write lines.json"""
+    from tell_stories_api.script_handler.service import ScriptService
+
+    process_dir = Path("data/process") / process_id
+    progress_path = process_dir / "script_progress.json"
+    board = WorkBoard()
+    batch_id = None
+    try:
+        with open(progress_path, "w", encoding='utf-8') as f:
+            json.dump({"state": "splitting_story", "process_id": process_id}, f)
+        story_parts_path = process_dir / "story_parts.json"
+        if story_parts_path.exists():
+            with open(story_parts_path, encoding='utf-8') as f:
+                story_parts = json.load(f)["parts"]
+        else:
+            story_parts = ScriptService.split_story(process_id)
+
+        ScriptService._write_lines_progress(progress_path, process_id, 0, len(story_parts))
+        batch_id = _open_batch(board, "lines_part", process_id, [{"index": i} for i in range(len(story_parts))], options)
+        node_stats = {}
+
+        def on_results(results: Dict[int, Dict[str, Any]]) -> None:
+            node_stats.clear()
+            for result in results.values():
+                if "error" in result:
+                    continue
+                stats = node_stats.setdefault(result["worker_id"], {"parts": 0, "total_latency": 0.0, "providers": {}})
+                stats["parts"] += 1
+                provider = result["result"]["provider"]
+                stats["providers"][provider] = stats["providers"].get(provider, 0) + 1
+                stats["total_latency"] = round(stats["total_latency"] + result["result"]["latency"], 2)
+                stats["avg_latency"] = round(stats["total_latency"] / stats["parts"], 2)
+            ScriptService._write_lines_progress(progress_path, process_id, len(results), len(story_parts), node_stats)
+
+        results = _run_batch(board, batch_id, len(story_parts), on_results, cancel)
+        errors = _get_errors(results)
+        if errors:
+            raise Exception(f"{len(errors)} of {len(story_parts)} story parts failed: {'; '.join(errors)}")
+        parts = [results[i]["result"] for i in range(len(story_parts))]
+        raw_instructs = [part["raw_instructs"] for part in parts] if options["normalize_instructs"] else None
+        ScriptService.save_lines(process_id, [part["lines"] for part in parts], node_stats, raw_instructs)
+        _close_batch(board, "lines_part", process_id, batch_id)
+    except JobCancelledError:
+        raise
+    except Exception as e:
+        if batch_id:
+            _close_batch(board, "lines_part", process_id, batch_id)
+        with open(progress_path, "w", encoding='utf-8') as f:
+            json.dump({"state": "error", "process_id": process_id, "error": str(e)}, f)
+        logger.error(f"Error in distributed lines generation: {str(e)}")
+        raise
+
+
+def run_distributed_voice(process_id: str, request, cancel: Optional[Event] = None) -> "ProgressData":
+    """Voice the lines of a process with batches of lines as units, then build the final audio in story order"""
+    from tell_stories_api.voice_handler.models import ProgressData
+    from tell_stories_api.voice_handler.processor import VoiceProcessor, get_output_dir
+
+    process_dir = Path("data/process") / process_id
+    progress_file = process_dir / "voice_progress.json"
+    started_at = time.monotonic()
+    progress_data = ProgressData(
+        total_lines=0,
+        processed_lines=0,
+        success_count=0,
+        failed_count=0,
+        narrator_success_count=0,
+        narrator_failed_count=0,
+        status="processing",
+        metrics={"mode": "distributed"}
+    )
+    board = WorkBoard()
+    batch_id = None
+    try:
+        with open(process_dir / "voice_cast.json", encoding='utf-8') as f:
+            cast_dict = json.load(f)
+        with open(process_dir / "lines.json", encoding='utf-8') as f:
+            lines = json.load(f)["lines"]
+        progress_data.total_lines = len(lines)
+        output_dir = get_output_dir(process_id)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        progress_data.output_path = str(output_dir)
+        with open(progress_file, 'w', encoding='utf-8') as f:
+            json.dump(progress_data.model_dump(), f)
+
+        indexed_lines = list(enumerate(lines))
+        payloads = [
+            {"lines": indexed_lines[start:start + WORK_TTS_BATCH_LINES]}
+            for start in range(0, len(indexed_lines), WORK_TTS_BATCH_LINES)
+        ]
+        # resume differs on the retry of the job, and the nodes synthesize their lines from scratch anyway
+        context = {"request": request.model_dump(exclude={"resume"}), "cast": cast_dict}
+        batch_id = _open_batch(board, "tts_batch", process_id, payloads, context)
+        progress_data.metrics["units"] = len(payloads)
+
+        def on_results(results: Dict[int, Dict[str, Any]]) -> None:
+            line_results = [line for result in results.values() if "error" not in result for line in result["result"]["lines"]]
+            progress_data.processed_lines = len(line_results)
+            progress_data.success_count = sum(r["success"] and not r["is_fallback"] for r in line_results)
+            progress_data.failed_count = sum(not r["success"] and not r["is_fallback"] for r in line_results)
+            progress_data.narrator_success_count = sum(r["success"] and r["is_fallback"] for r in line_results)
+            progress_data.narrator_failed_count = sum(not r["success"] and r["is_fallback"] for r in line_results)
+            nodes = {}
+            for result in results.values():
+                if "error" not in result:
+                    nodes[result["worker_id"]] = nodes.get(result["worker_id"], 0) + len(result["result"]["lines"])
+            progress_data.metrics["nodes"] = nodes
+            progress_data.metrics["tts_seconds"] = round(sum(r.get("seconds", 0.0) for r in line_results), 2)
+            with open(progress_file, 'w', encoding='utf-8') as f:
+                json.dump(progress_data.model_dump(), f)
+
+        results = _run_batch(board, batch_id, len(payloads), on_results, cancel)
+        errors = _get_errors(results)
+        if errors:
+            raise Exception(f"{len(errors)} of {len(payloads)} TTS units failed: {'; '.join(errors)}")
+
+        # Reassemble in story order
+        file_list, subtitle_data, current_time = [], [], 0.0
+        line_results = sorted((line for result in results.values() for line in result["result"]["lines"]), key=lambda r: r["index"])
+        for line_result in line_results:
+            output_path = output_dir / f"{line_result['index']:05d}.wav"
+            file_list.append(output_path)
+            if not line_result["success"]:
+                continue
+            subtitle_data.append({
+                'index': len(subtitle_data) + 1,
+                'start': current_time,
+                'end': current_time + line_result["duration"],
+                'character': line_result["character"],
+                'text': lines[line_result["index"]]["line"]
+            })
+            current_time += line_result["duration"]
+        VoiceProcessor()._create_final_output(output_dir, file_list, subtitle_data, request)
+        _close_batch(board, "tts_batch", process_id, batch_id)
+        progress_data.metrics["wall_clock_seconds"] = round(time.monotonic() - started_at, 2)
+        progress_data.status = "completed"
+    except JobCancelledError:
+        raise
+    except Exception as e:
+        if batch_id:
+            _close_batch(board, "tts_batch", process_id, batch_id)
+        progress_data.status = "failed"
+        progress_data.error = str(e)
+        logger.error(f"Error in distributed voice generation: {str(e)}")
+
+    with open(progress_file, 'w', encoding='utf-8') as f:
+        json.dump(progress_data.model_dump(), f)
+    return progress_data
@@ -0,0 +1,205 @@
+"""
+Worker consuming the job queue. The API runs one in-process unless JOB_WORKER_IN_PROCESS is false;
+more can run as separate processes against the same data directory:
+
+    python -m tell_stories_api.jobs.worker --concurrency 2 --kinds voice voice_stream
+
+With --units, the worker instead takes work units (story parts, batches of TTS lines) of distributed
+jobs from the shared work board, on this or any node mounting the same data and output directories:
+
+    python -m tell_stories_api.jobs.worker --units --concurrency 4
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+from threading import Event, Semaphore, Thread
+from typing import Any, Callable, Dict, List, Optional
+from tell_stories_api.logs import logger
+from .job_queue import JOB_LEASE_SECONDS, JobCancelledError, JobQueue, get_job_queue
+from .board import UnitWorker, WorkBoard, get_worker_id
+from .units import UNIT_HANDLERS, run_distributed_lines, run_distributed_voice
+
+# Jobs run at once by a worker; each voice job also runs its own TTS requests concurrently
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 2))
+JOB_WORKER_IN_PROCESS = os.getenv("JOB_WORKER_IN_PROCESS", "true").lower() == "true"
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+# Delay before retrying a heartbeat that failed, e.g. on a locked database
+JOB_HEARTBEAT_RETRY_SECONDS = float(os.getenv("JOB_HEARTBEAT_RETRY_SECONDS", 2.0))
+
+
+class JobError(Exception):
+    """Raised by a job handler when the job failed"""
+
+    def __init__(self, message: str, retry: bool = True):
+        super().__init__(message)
+        self.retry = retry
+
+
+def _require_files(process_id: str, files: List[str]) -> None:
+    """Fail a job for good when an input is missing: a retry cannot find it either"""
+    process_dir = Path("data/process") / process_id
+    for file in files:
+        if not (process_dir / file).exists():
+            raise JobError(f"{file} not found for {process_id}", retry=False)
+
+
+def run_lines_job(job: Dict[str, Any], cancel: Event) -> None:
+    from tell_stories_api.script_handler.service import ScriptService
+
+    payload = job["payload"]
+    _require_files(job["process_id"], ["plot.json", "story.txt"])
+    if payload.get("distributed"):
+        run_distributed_lines(job["process_id"], payload, cancel)
+        return
+    ScriptService.process_lines_background(
+        job["process_id"],
+        payload["split_dialogue"],
+        payload["all_caps_to_proper"],
+        payload["throughput_mode"],
+        payload["max_tokens_budget"],
+        normalize_instructs=payload["normalize_instructs"],
+        cancel=cancel,
+        start_tokens=payload.get("start_tokens")
+    )
+
+
+def run_voice_job(job: Dict[str, Any], cancel: Event) -> None:
+    from tell_stories_api.voice_handler.models import VoiceRequest
+    from tell_stories_api.voice_handler.processor import VoiceProcessor
+
+    _require_files(job["process_id"], ["voice_cast.json", "lines.json"])
+    request = VoiceRequest(**job["payload"])
+    if job["attempts"] > 1:
+        # Keep the segments synthesized by the previous attempt
+        request.resume = True
+    if request.distributed:
+        progress_data = run_distributed_voice(job["process_id"], request, cancel)
+    else:
+        progress_data = VoiceProcessor().process_voice_generation(request, Path("data/process") / job["process_id"], cancel)
+    if progress_data.status == "failed":
+        raise JobError(progress_data.error)
+
+
+def run_voice_stream_job(job: Dict[str, Any], cancel: Event) -> None:
+    from tell_stories_api.voice_handler.models import StreamRequest
+    from tell_stories_api.voice_handler.processor import VoiceProcessor
+
+    _require_files(job["process_id"], ["plot.json", "story.txt", "voice_cast.json"])
+    request = StreamRequest(**job["payload"])
+    if job["attempts"] > 1:
+        request.resume = True
+    progress_data = VoiceProcessor().process_streaming_generation(
+        request, job["process_id"], Path("data/process") / job["process_id"], cancel, job["payload"].get("start_tokens")
+    )
+    if progress_data.status == "failed":
+        raise JobError(progress_data.error)
+
+
+# Handlers get the job and an event set once the worker lost the job's lease: they then stop with
+# JobCancelledError, without writing anything further, as another worker may be running the job
+JOB_HANDLERS: Dict[str, Callable[[Dict[str, Any], Event], None]] = {
+    "lines": run_lines_job,
+    "voice": run_voice_job,
+    "voice_stream": run_voice_stream_job,
+}
+
+
+class JobWorker:
+    """Claims jobs from the queue and runs up to `concurrency` of them at once, each on its own thread"""
+
+    def __init__(self, queue: JobQueue, concurrency: int = JOB_WORKER_CONCURRENCY, kinds: Optional[List[str]] = None):
+        self.queue = queue
+        self.kinds = kinds or list(JOB_HANDLERS)
+        self.worker_id = get_worker_id()
+        self._slots = Semaphore(concurrency)
+        self._stopped = Event()
+
+    def start(self) -> "JobWorker":
+        Thread(target=self.run, name="job-worker", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def run(self) -> None:
+        logger.info(f"Job worker {self.worker_id} started for {', '.join(self.kinds)}")
+        while not self._stopped.is_set():
+            self._slots.acquire()
+            try:
+                job = self.queue.claim(self.worker_id, self.kinds)
+            except Exception as e:
+                logger.error(f"Job worker {self.worker_id} failed to claim a job: {e}")
+                job = None
+            if job is None:
+                self._slots.release()
+                self._stopped.wait(JOB_POLL_INTERVAL)
+                continue
+            Thread(target=self._run_job, args=(job,), name=f"job-{job['id']}", daemon=True).start()
+
+    def _heartbeat(self, job_id: int, done: Event, cancel: Event) -> None:
+        """
+        Renew the job's lease, retrying failed renewals. The handler is cancelled once the lease is lost,
+        or could not be renewed for 2/3 of its duration, before another worker may claim the job.
+        """
+        renewed_at = time.monotonic()
+        interval = JOB_LEASE_SECONDS / 3
+        while not done.wait(interval):
+            try:
+                held = self.queue.heartbeat(job_id, self.worker_id)
+            except Exception as e:
+                logger.warning(f"Heartbeat of job {job_id} failed: {e}")
+                held = None
+            if held:
+                renewed_at = time.monotonic()
+                interval = JOB_LEASE_SECONDS / 3
+                continue
+            if held is False or time.monotonic() - renewed_at >= JOB_LEASE_SECONDS * 2 / 3:
+                logger.warning(f"Job {job_id} lease lost by {self.worker_id}, cancelling it")
+                cancel.set()
+                return
+            interval = JOB_HEARTBEAT_RETRY_SECONDS
+
+    def _run_job(self, job: Dict[str, Any]) -> None:
+        done = Event()
+        cancel = Event()
+        Thread(target=self._heartbeat, args=(job["id"], done, cancel), daemon=True).start()
+        started_at = time.monotonic()
+        logger.info(f"Running {job['kind']} job {job['id']} of {job['process_id']} (attempt {job['attempts']})")
+        try:
+            JOB_HANDLERS[job["kind"]](job, cancel)
+            if not self.queue.complete(job["id"], self.worker_id):
+                logger.warning(f"{job['kind']} job {job['id']} finished after its lease was lost, another attempt owns it")
+            else:
+                logger.info(f"{job['kind']} job {job['id']} completed in {time.monotonic() - started_at:.1f}s")
+        except JobCancelledError:
+            logger.warning(f"{job['kind']} job {job['id']} cancelled: its lease was lost")
+        except Exception as e:
+            retry = getattr(e, "retry", True)
+            logger.error(f"{job['kind']} job {job['id']} failed: {e}")
+            self.queue.fail(job["id"], self.worker_id, str(e), retry=retry)
+        finally:
+            done.set()
+            self._slots.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKER_CONCURRENCY, help="Jobs run at once")
+    parser.add_argument("--kinds", nargs="+", choices=list(JOB_HANDLERS), help="Only run these kinds of jobs")
+    parser.add_argument("--units", action="store_true", help="Run work units of distributed jobs instead of jobs")
+    args = parser.parse_args()
+
+    if args.units:
+        worker = UnitWorker(WorkBoard(), UNIT_HANDLERS, args.concurrency)
+    else:
+        worker = JobWorker(get_job_queue(), args.concurrency, args.kinds)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        # Running jobs are abandoned; their leases expire and another worker retries them
+        logger.info(f"Worker {worker.worker_id} stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 
-from openai import OpenAI
+from openai import OpenAI, NOT_GIVEN
 
 import os
 from dotenv import load_dotenv
 from tell_stories_api.logs import logger
+from tell_stories_api.provider.retry import call_with_retry
+from tell_stories_api.provider.usage import record_llm_usage
 
 
 class DeepSeekAPI:
@@ -13,7 +15,9 @@ class DeepSeekAPI:
         # Get the value of the API key from the environment variable
         api_key = os.getenv("DEEPSEEK_API_KEY")
         base_url = os.getenv("DEEPSEEK_BASE_URL")
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        # Retries are handled by call_with_retry so throttling is visible to the LLM executor
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.name = "deepseek"
 
     def format_history(self, history):
         """
@@ -33,6 +37,7 @@ class DeepSeekAPI:
         logger.info(f"prompt_tokens usage: {usage.prompt_tokens}")
         logger.info(f"completion_tokens usage: {usage.completion_tokens}")
         logger.info(f"total_tokens usage: {usage.total_tokens}")
+        record_llm_usage(usage)
 
     def predict_with_history(self, message, history=[]):
         """
@@ -41,19 +46,14 @@ class DeepSeekAPI:
         history.append({"role": "user", "content": message})
         logger.debug(f"history: {history}")
 
-        # Retry 3 times if bumped into Error; if exceeds, then throw error
-        for i in range(3):
-            try:
-                response = self.client.chat.completions.create(
-                    model='deepseek-chat',
-                    messages=history,
-                    stream=False
-                )
-                break
-            except Exception as e:
-                logger.error(f"Error: {e}")
-                if i == 2:
-                    raise e
+        response = call_with_retry(
+            lambda: self.client.chat.completions.create(
+                model='deepseek-chat',
+                messages=history,
+                stream=False
+            ),
+            provider=self.name
+        )
 
         self.record_usage(response=response)
         total_tokens = response.usage.total_tokens
@@ -66,48 +66,40 @@ class DeepSeekAPI:
         history_zhipuai_format = self.format_history(history)
         history_zhipuai_format.append({"role": "user", "content": message})
 
-        # Retry 3 times if bumped into Error; if exceeds, then throw error
-        for i in range(3):
-            try:
-                response = self.client.chat.completions.create(
-                    model='deepseek-chat',
-                    messages=history_zhipuai_format,
-                    stream=False
-                )
-                break
-            except Exception as e:
-                logger.error(f"Error: {e}")
-                if i == 2:
-                    raise e
+        response = call_with_retry(
+            lambda: self.client.chat.completions.create(
+                model='deepseek-chat',
+                messages=history_zhipuai_format,
+                stream=False
+            ),
+            provider=self.name
+        )
 
         self.record_usage(response=response)
         total_tokens = response.usage.total_tokens
         return response.choices[0].message, total_tokens
     
-    def predict_v3(self, message, history=[]):
+    def predict_v3(self, message, history=[], model=None, temperature=None, max_tokens=8192, timeout=None):
         """
-        Predict using sse and stream is true
+        Predict with finish reason. model, temperature, max_tokens and timeout override the defaults when given.
         """
         history_zhipuai_format = self.format_history(history)
         history_zhipuai_format.append({"role": "user", "content": message})
 
         logger.info(f"history_zhipuai_format: {history_zhipuai_format}")
-        # Retry 3 times if bumped into Error; if exceeds, then throw error
-        for i in range(3):
-            try:
-                # 不知道为啥加了这个参数 max_tokens=8192, deepseek经常返回错误的信息，所以暂时去掉了。
-                response = self.client.chat.completions.create(
-                    model='deepseek-chat',
-                    messages=history_zhipuai_format,
-                    max_tokens=8192,
-                    stream=False
-                )
-                logger.info(f"response: {response}")
-                break
-            except Exception as e:
-                logger.error(f"Error: {e}")
-                if i == 2:
-                    raise e
+        # 不知道为啥加了这个参数 max_tokens=8192, deepseek经常返回错误的信息，所以暂时去掉了。
+        response = call_with_retry(
+            lambda: self.client.chat.completions.create(
+                model=model or 'deepseek-chat',
+                messages=history_zhipuai_format,
+                max_tokens=max_tokens if max_tokens is not None else NOT_GIVEN,
+                temperature=temperature if temperature is not None else NOT_GIVEN,
+                timeout=timeout if timeout is not None else NOT_GIVEN,
+                stream=False
+            ),
+            provider=self.name
+        )
+        logger.info(f"response: {response}")
 
         self.record_usage(response=response)
         total_tokens = response.usage.total_tokens
@@ -0,0 +1,275 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Lock, Thread
+from typing import Any, Callable, Dict, Optional
+from tell_stories_api.logs import logger
+
+# Default number of concurrent requests per provider; override per provider with LLM_CONCURRENCY_<PROVIDER>
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+# Default tokens-per-minute budget per provider (0 = unlimited); override with LLM_TPM_<PROVIDER>
+LLM_TPM_BUDGET = int(os.getenv("LLM_TPM_BUDGET", 0))
+TPM_WINDOW_SECONDS = 60
+
+# AIMD adaptive concurrency: start low, add ~1 slot per window of healthy calls, halve on 429/5xx
+LLM_ADAPTIVE_CONCURRENCY = os.getenv("LLM_ADAPTIVE_CONCURRENCY", "true").lower() == "true"
+LLM_INITIAL_CONCURRENCY = int(os.getenv("LLM_INITIAL_CONCURRENCY", 4))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", 1))
+AIMD_DECREASE_FACTOR = 0.5
+# A call is healthy if its latency is within this factor of the recent average latency
+AIMD_LATENCY_TOLERANCE = 2.0
+# Several 429s of the same burst only cut the limit once
+AIMD_DECREASE_COOLDOWN_SECONDS = 5.0
+# A provider whose last calls all failed is unhealthy until this long after its last failure
+UNHEALTHY_AFTER_FAILURES = 3
+UNHEALTHY_COOLDOWN_SECONDS = 60.0
+
+
+def get_provider_concurrency(provider: str) -> int:
+    """Get the configured max concurrent requests for a provider"""
+    return max(1, int(os.getenv(f"LLM_CONCURRENCY_{provider.upper()}", LLM_MAX_CONCURRENCY)))
+
+
+def get_provider_tpm(provider: str) -> int:
+    """Get the configured tokens-per-minute budget for a provider (0 = unlimited)"""
+    return int(os.getenv(f"LLM_TPM_{provider.upper()}", LLM_TPM_BUDGET))
+
+
+def _result_tokens(result: Any) -> Optional[int]:
+    """Get total_tokens from a provider result tuple (message, total_tokens, ...)"""
+    if isinstance(result, tuple) and len(result) > 1 and isinstance(result[1], int):
+        return result[1]
+    return None
+
+
+class _LLMJob:
+    def __init__(self, fn: Callable[[], Any], process_id: str, est_tokens: int):
+        self.fn = fn
+        self.process_id = process_id
+        self.est_tokens = est_tokens
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class _ProviderLane:
+    """Request queue and workers of a single provider, shared by every job in the process"""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.max_concurrency = get_provider_concurrency(provider)
+        self.min_limit = min(LLM_MIN_CONCURRENCY, self.max_concurrency)
+        self.limit = float(
+            min(max(LLM_INITIAL_CONCURRENCY, self.min_limit), self.max_concurrency)
+            if LLM_ADAPTIVE_CONCURRENCY else self.max_concurrency
+        )
+        self.latency_ewma: Optional[float] = None
+        self.last_decrease = 0.0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.tpm_budget = get_provider_tpm(provider)
+        self.cond = Condition()
+        # Pending jobs per process_id, served round-robin so one large job cannot starve the others
+        self.queues: Dict[str, deque] = {}
+        self.order: deque = deque()
+        self.active = 0
+        self.active_by_process: Dict[str, int] = {}
+        self.token_window: deque = deque()  # (timestamp, tokens)
+        self.completed = 0
+        self.failed = 0
+        self.consecutive_failures = 0
+        self.last_failure_at = 0.0
+        for i in range(self.max_concurrency):
+            Thread(target=self._worker, name=f"llm-{provider}-{i}", daemon=True).start()
+
+    def submit(self, job: _LLMJob) -> None:
+        with self.cond:
+            if job.process_id not in self.queues:
+                self.queues[job.process_id] = deque()
+                self.order.append(job.process_id)
+            self.queues[job.process_id].append(job)
+            self.cond.notify()
+
+    def _tokens_last_minute(self, now: float) -> int:
+        while self.token_window and now - self.token_window[0][0] > TPM_WINDOW_SECONDS:
+            self.token_window.popleft()
+        return sum(tokens for _, tokens in self.token_window)
+
+    def _next_job(self) -> Optional[_LLMJob]:
+        """Pop the next job if concurrency and the TPM budget allow it. Must hold self.cond."""
+        if not self.order or self.active >= int(self.limit):
+            return None
+
+        process_id = self.order[0]
+        job = self.queues[process_id][0]
+        now = time.monotonic()
+        if now < self.paused_until:
+            return None
+        if self.tpm_budget and self.token_window and \
+                self._tokens_last_minute(now) + job.est_tokens > self.tpm_budget:
+            return None
+
+        self.order.popleft()
+        self.queues[process_id].popleft()
+        if self.queues[process_id]:
+            self.order.append(process_id)
+        else:
+            del self.queues[process_id]
+        return job
+
+    def _wait_timeout(self) -> Optional[float]:
+        """Wake up when a Retry-After pause ends or the oldest token window entry expires"""
+        now = time.monotonic()
+        timeouts = []
+        if self.paused_until > now:
+            timeouts.append(self.paused_until - now)
+        if self.tpm_budget and self.token_window:
+            timeouts.append(TPM_WINDOW_SECONDS - (now - self.token_window[0][0]))
+        return max(0.1, min(timeouts)) if timeouts else None
+
+    def _on_success(self, latency: float) -> None:
+        """Additive increase while calls succeed with a healthy latency. Must hold self.cond."""
+        is_healthy = self.latency_ewma is None or latency <= self.latency_ewma * AIMD_LATENCY_TOLERANCE
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        if LLM_ADAPTIVE_CONCURRENCY and is_healthy and self.limit < self.max_concurrency:
+            # Roughly +1 slot once every slot has completed a healthy call
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        """Multiplicative decrease on 429/5xx, and pause dispatching for Retry-After seconds"""
+        with self.cond:
+            self.throttled += 1
+            now = time.monotonic()
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if LLM_ADAPTIVE_CONCURRENCY and now - self.last_decrease >= AIMD_DECREASE_COOLDOWN_SECONDS:
+                self.limit = max(self.min_limit, self.limit * AIMD_DECREASE_FACTOR)
+                self.last_decrease = now
+                logger.warning(f"LLM lane {self.provider} throttled; concurrency limit cut to {int(self.limit)}")
+
+    def _worker(self) -> None:
+        while True:
+            with self.cond:
+                job = self._next_job()
+                while job is None:
+                    self.cond.wait(timeout=self._wait_timeout())
+                    job = self._next_job()
+                self.active += 1
+                self.active_by_process[job.process_id] = self.active_by_process.get(job.process_id, 0) + 1
+                self.token_window.append((time.monotonic(), job.est_tokens))
+
+            started_at = time.monotonic()
+            if not job.future.set_running_or_notify_cancel():
+                result, error = None, None
+            else:
+                try:
+                    result, error = job.fn(), None
+                except Exception as e:
+                    result, error = None, e
+
+            with self.cond:
+                self.active -= 1
+                self.active_by_process[job.process_id] -= 1
+                if not self.active_by_process[job.process_id]:
+                    del self.active_by_process[job.process_id]
+                actual_tokens = _result_tokens(result)
+                if actual_tokens is not None:
+                    # Correct the estimate booked at dispatch time with the real usage
+                    self.token_window.append((time.monotonic(), actual_tokens - job.est_tokens))
+                if error is None:
+                    self.completed += 1
+                    self.consecutive_failures = 0
+                    self._on_success(time.monotonic() - started_at)
+                else:
+                    self.failed += 1
+                    self.consecutive_failures += 1
+                    self.last_failure_at = time.monotonic()
+                self.cond.notify_all()
+
+            if error is not None:
+                job.future.set_exception(error)
+            elif not job.future.cancelled():
+                job.future.set_result(result)
+
+    def is_healthy(self) -> bool:
+        with self.cond:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return False
+            return self.consecutive_failures < UNHEALTHY_AFTER_FAILURES or \
+                now - self.last_failure_at > UNHEALTHY_COOLDOWN_SECONDS
+
+    def stats(self) -> Dict[str, Any]:
+        is_healthy = self.is_healthy()
+        with self.cond:
+            return {
+                "healthy": is_healthy,
+                "max_concurrency": self.max_concurrency,
+                "limit": int(self.limit),
+                "active": self.active,
+                "queued": sum(len(queue) for queue in self.queues.values()),
+                "active_by_process": dict(self.active_by_process),
+                "queued_by_process": {pid: len(queue) for pid, queue in self.queues.items()},
+                "tpm_budget": self.tpm_budget,
+                "tokens_last_minute": self._tokens_last_minute(time.monotonic()),
+                "completed": self.completed,
+                "failed": self.failed,
+                "throttled": self.throttled,
+                "latency_ewma": round(self.latency_ewma, 2) if self.latency_ewma is not None else None,
+            }
+
+
+class LLMExecutor:
+    """
+    Process-wide execution service for LLM calls.
+
+    Every provider gets one lane with a bounded number of workers and an optional
+    tokens-per-minute budget, shared by all jobs. Pending requests are served
+    round-robin across process_ids. The number of concurrent requests adapts
+    (AIMD) between LLM_MIN_CONCURRENCY and the configured max.
+    """
+
+    def __init__(self):
+        self._lanes: Dict[str, _ProviderLane] = {}
+        self._lock = Lock()
+
+    def _get_lane(self, provider: str) -> _ProviderLane:
+        with self._lock:
+            if provider not in self._lanes:
+                self._lanes[provider] = _ProviderLane(provider)
+                logger.info(
+                    f"LLM lane for {provider}: concurrency={self._lanes[provider].max_concurrency}, "
+                    f"tpm_budget={self._lanes[provider].tpm_budget or 'unlimited'}"
+                )
+            return self._lanes[provider]
+
+    def submit(self, provider: str, fn: Callable[[], Any], process_id: str = "", est_tokens: int = 0) -> Future:
+        """Queue an LLM call on the provider's lane and return its future"""
+        job = _LLMJob(fn, process_id or "", est_tokens)
+        self._get_lane(provider).submit(job)
+        return job.future
+
+    def run(self, provider: str, fn: Callable[[], Any], process_id: str = "", est_tokens: int = 0) -> Any:
+        """Queue an LLM call on the provider's lane and wait for its result"""
+        return self.submit(provider, fn, process_id, est_tokens).result()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and active requests of every provider lane"""
+        with self._lock:
+            lanes = dict(self._lanes)
+        return {provider: lane.stats() for provider, lane in lanes.items()}
+
+    def report_throttle(self, provider: str, retry_after: Optional[float] = None) -> None:
+        """Report a 429/5xx from a provider so its lane backs off"""
+        self._get_lane(provider).on_throttle(retry_after)
+
+    def is_healthy(self, provider: str) -> bool:
+        """Whether a provider is neither paused by Retry-After nor failing repeatedly"""
+        return self._get_lane(provider).is_healthy()
+
+    def get_limit(self, provider: str) -> int:
+        """Get the current concurrency limit of a provider"""
+        return int(self._get_lane(provider).limit)
+
+
+llm_executor = LLMExecutor()
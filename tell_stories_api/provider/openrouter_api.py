@@ -1,7 +1,9 @@
-from openai import OpenAI
+from openai import OpenAI, NOT_GIVEN
 import os
 from dotenv import load_dotenv
 from tell_stories_api.logs import logger
+from tell_stories_api.provider.retry import call_with_retry
+from tell_stories_api.provider.usage import record_llm_usage
 
 
 class OpenRouterAPI:
@@ -11,7 +13,9 @@ class OpenRouterAPI:
         # Get API credentials from environment variables
         api_key = os.getenv("OPENROUTER_API_KEY")
         base_url = os.getenv("OPENROUTER_BASE_URL")
-        self.client = OpenAI(base_url=base_url, api_key=api_key)
+        # Retries are handled by call_with_retry so throttling is visible to the LLM executor
+        self.client = OpenAI(base_url=base_url, api_key=api_key, max_retries=0)
+        self.name = "openrouter"
         self.model = "deepseek/deepseek-chat"  # Default model
 
     def format_history(self, history):
@@ -32,6 +36,7 @@ class OpenRouterAPI:
         logger.info(f"prompt_tokens usage: {usage.prompt_tokens}")
         logger.info(f"completion_tokens usage: {usage.completion_tokens}")
         logger.info(f"total_tokens usage: {usage.total_tokens}")
+        record_llm_usage(usage)
 
     def predict_with_history(self, message, history=[]):
         """
@@ -40,18 +45,14 @@ class OpenRouterAPI:
         history.append({"role": "user", "content": message})
         logger.debug(f"history: {history}")
 
-        for i in range(3):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=history,
-                    stream=False
-                )
-                break
-            except Exception as e:
-                logger.error(f"Error: {e}")
-                if i == 2:
-                    raise e
+        response = call_with_retry(
+            lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=history,
+                stream=False
+            ),
+            provider=self.name
+        )
 
         self.record_usage(response=response)
         total_tokens = response.usage.total_tokens
@@ -64,46 +65,40 @@ class OpenRouterAPI:
         formatted_history = self.format_history(history)
         formatted_history.append({"role": "user", "content": message})
 
-        for i in range(3):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=formatted_history,
-                    stream=False
-                )
-                break
-            except Exception as e:
-                logger.error(f"Error: {e}")
-                if i == 2:
-                    raise e
+        response = call_with_retry(
+            lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=formatted_history,
+                stream=False
+            ),
+            provider=self.name
+        )
 
         self.record_usage(response=response)
         total_tokens = response.usage.total_tokens
         return response.choices[0].message, total_tokens
 
-    def predict_v3(self, message, history=[]):
+    def predict_v3(self, message, history=[], model=None, temperature=None, max_tokens=8192, timeout=None):
         """
-        Predict with finish reason
+        Predict with finish reason. model, temperature, max_tokens and timeout override the defaults when given.
         """
         formatted_history = self.format_history(history)
         formatted_history.append({"role": "user", "content": message})
         
         logger.info(f"formatted_history: {formatted_history}")
         
-        for i in range(3):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=formatted_history,
-                    max_tokens=8192,
-                    stream=False
-                )
-                logger.info(f"response: {response}")
-                break
-            except Exception as e:
-                logger.error(f"Error: {e}")
-                if i == 2:
-                    raise e
+        response = call_with_retry(
+            lambda: self.client.chat.completions.create(
+                model=model or self.model,
+                messages=formatted_history,
+                max_tokens=max_tokens if max_tokens is not None else NOT_GIVEN,
+                temperature=temperature if temperature is not None else NOT_GIVEN,
+                timeout=timeout if timeout is not None else NOT_GIVEN,
+                stream=False
+            ),
+            provider=self.name
+        )
+        logger.info(f"response: {response}")
 
         self.record_usage(response=response)
         total_tokens = response.usage.total_tokens
@@ -1,9 +1,11 @@
 
-from openai import OpenAI
+from openai import OpenAI, NOT_GIVEN
 
 import os
 from dotenv import load_dotenv
 from tell_stories_api.logs import logger
+from tell_stories_api.provider.retry import call_with_retry
+from tell_stories_api.provider.usage import record_llm_usage
 
 
 class QwenAPI:
@@ -13,7 +15,9 @@ class QwenAPI:
         # Get the value of the API key from the environment variable
         api_key = os.getenv("DASHSCOPE_API_KEY")
         base_url = os.getenv("DASHSCOPE_BASE_URL")
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        # Retries are handled by call_with_retry so throttling is visible to the LLM executor
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.name = "qwen"
         self.model = model
 
     def format_history(self, history):
@@ -31,6 +35,7 @@ class QwenAPI:
         logger.info(f"prompt_tokens usage: {usage.prompt_tokens}")
         logger.info(f"completion_tokens usage: {usage.completion_tokens}")
         logger.info(f"total_tokens usage: {usage.total_tokens}")
+        record_llm_usage(usage)
 
     def predict_with_history(self, message, history=[]):
         """
@@ -39,45 +44,38 @@ class QwenAPI:
         history.append({"role": "user", "content": message})
         logger.debug(f"history: {history}")
 
-        # Retry 3 times if bumped into Error; if exceeds, then throw error
-        for i in range(3):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=history,
-                    stream=False
-                )
-                break
-            except Exception as e:
-                logger.error(f"Error: {e}")
-                if i == 2:
-                    raise e
+        response = call_with_retry(
+            lambda: self.client.chat.completions.create(
+                model=self.model,
+                messages=history,
+                stream=False
+            ),
+            provider=self.name
+        )
 
         self.record_usage(response=response)
         total_tokens = response.usage.total_tokens
         return response.choices[0].message, total_tokens
     
-    def predict(self, message, history=[]):
+    def predict(self, message, history=[], model=None, temperature=None, max_tokens=None, timeout=None):
         """
-        Predict using sse and stream is true
+        Predict with finish reason. model, temperature, max_tokens and timeout override the defaults when given.
         """
         history = self.format_history(history)
         history.append({"role": "user", "content": message})
         logger.debug(f"history: {history}")
 
-        # Retry 3 times if bumped into Error; if exceeds, then throw error
-        for i in range(3):
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=history,
-                    stream=False
-                )
-                break
-            except Exception as e:
-                logger.error(f"Error: {e}")
-                if i == 2:
-                    raise e
+        response = call_with_retry(
+            lambda: self.client.chat.completions.create(
+                model=model or self.model,
+                messages=history,
+                max_tokens=max_tokens if max_tokens is not None else NOT_GIVEN,
+                temperature=temperature if temperature is not None else NOT_GIVEN,
+                timeout=timeout if timeout is not None else NOT_GIVEN,
+                stream=False
+            ),
+            provider=self.name
+        )
 
         self.record_usage(response=response)
         total_tokens = response.usage.total_tokens
@@ -0,0 +1,87 @@
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Optional
+from tell_stories_api.logs import logger
+from tell_stories_api.provider.executor import llm_executor
+
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", 3))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 1.0))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 60.0))
+
+# Status codes that mean the provider is overloaded and we should back off
+THROTTLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def get_status_code(error: Exception) -> Optional[int]:
+    """Get the HTTP status code of an OpenAI client error, if any"""
+    return getattr(error, "status_code", None)
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Get the Retry-After delay in seconds of an OpenAI client error, if the server sent one"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Jittered exponential backoff, never shorter than the server's Retry-After"""
+    delay = random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt))
+    if retry_after is not None:
+        delay = retry_after + random.uniform(0, LLM_BACKOFF_BASE_SECONDS)
+    return delay
+
+
+def call_with_retry(fn: Callable[[], Any], provider: str, attempts: int = LLM_MAX_ATTEMPTS) -> Any:
+    """
+    Call a provider request with retries.
+
+    429/5xx responses are reported to the shared LLM executor so it can cut the
+    provider's concurrency, and every retry waits for Retry-After (when sent) or
+    a jittered exponential backoff instead of retrying immediately.
+
+    Args:
+        fn (Callable): The request to perform
+        provider (str): The provider name, as used by the LLM executor
+        attempts (int): Max number of attempts
+
+    Returns:
+        Any: The response of the request
+    """
+    for attempt in range(attempts):
+        try:
+            return fn()
+        except Exception as e:
+            status_code = get_status_code(e)
+            retry_after = get_retry_after(e)
+            logger.error(f"Error from {provider} (status {status_code}, attempt {attempt + 1}/{attempts}): {e}")
+            if status_code in THROTTLE_STATUS_CODES:
+                llm_executor.report_throttle(provider, retry_after)
+            if attempt == attempts - 1:
+                raise e
+
+            delay = get_backoff_delay(attempt, retry_after)
+            logger.warning(f"Retrying {provider} in {delay:.1f}s")
+            time.sleep(delay)
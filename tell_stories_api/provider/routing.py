@@ -0,0 +1,108 @@
+import os
+from collections import deque
+from threading import Lock
+from typing import Any, Dict, Optional
+from pydantic import BaseModel, Field
+from tell_stories_api.logs import logger
+
+# Call types of the script pipeline
+LLM_TASKS = ("plot", "cast", "split", "lines")
+# Number of recent latencies kept per task for percentiles
+TASK_LATENCY_WINDOW = 200
+
+
+class TaskRoute(BaseModel):
+    """Model for the provider/model settings of one LLM call type"""
+    task: str = Field(..., description="The call type: plot, cast, split or lines")
+    provider: Optional[str] = Field(None, description="deepseek, openrouter or qwen. Defaults to PRIMARY_MODEL")
+    model: Optional[str] = Field(None, description="Model name. Defaults to the provider's default model")
+    temperature: Optional[float] = Field(None, description="Sampling temperature. Defaults to the provider's default")
+    max_tokens: Optional[int] = Field(None, description="Max completion tokens. Defaults to the provider's default")
+    timeout: Optional[float] = Field(None, description="Request timeout in seconds. Defaults to the client's default")
+
+    def options(self) -> Dict[str, Any]:
+        """Keyword arguments for the provider's predict call, without unset values"""
+        return {
+            key: value for key, value in {
+                "model": self.model,
+                "temperature": self.temperature,
+                "max_tokens": self.max_tokens,
+                "timeout": self.timeout,
+            }.items() if value is not None
+        }
+
+
+def _get_env(task: str, key: str) -> Optional[str]:
+    return os.getenv(f"LLM_ROUTE_{task.upper()}_{key}") or None
+
+
+def get_task_route(task: str) -> TaskRoute:
+    """
+    Get the route of an LLM call type from LLM_ROUTE_<TASK>_<SETTING> environment variables,
+    e.g. LLM_ROUTE_SPLIT_PROVIDER=qwen, LLM_ROUTE_SPLIT_MODEL=qwen-turbo, LLM_ROUTE_SPLIT_MAX_TOKENS=200.
+    """
+    temperature = _get_env(task, "TEMPERATURE")
+    max_tokens = _get_env(task, "MAX_TOKENS")
+    timeout = _get_env(task, "TIMEOUT")
+    provider = _get_env(task, "PROVIDER")
+    return TaskRoute(
+        task=task,
+        provider=provider.lower() if provider else None,
+        model=_get_env(task, "MODEL"),
+        temperature=float(temperature) if temperature else None,
+        max_tokens=int(max_tokens) if max_tokens else None,
+        timeout=float(timeout) if timeout else None,
+    )
+
+
+_task_stats: Dict[str, Dict[str, Any]] = {}
+_task_stats_lock = Lock()
+
+
+def record_task_stats(task: str, provider: str, latency: float, total_tokens: Optional[int], success: bool) -> None:
+    """Record the latency and token usage of one LLM call for routing tuning"""
+    with _task_stats_lock:
+        stats = _task_stats.setdefault(f"{task}/{provider}", {
+            "task": task,
+            "provider": provider,
+            "calls": 0,
+            "errors": 0,
+            "total_tokens": 0,
+            "total_latency": 0.0,
+            "latencies": deque(maxlen=TASK_LATENCY_WINDOW),
+        })
+        stats["calls"] += 1
+        stats["total_latency"] += latency
+        stats["latencies"].append(latency)
+        if not success:
+            stats["errors"] += 1
+        if total_tokens:
+            stats["total_tokens"] += total_tokens
+    logger.info(f"LLM task {task} on {provider}: {latency:.2f}s, {total_tokens} tokens, success={success}")
+
+
+def _percentile(values: list, fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 2)
+
+
+def get_task_stats() -> Dict[str, Dict[str, Any]]:
+    """Get per task and provider call counts, latency percentiles and token usage"""
+    with _task_stats_lock:
+        snapshot = {key: dict(stats, latencies=list(stats["latencies"])) for key, stats in _task_stats.items()}
+    return {
+        key: {
+            "task": stats["task"],
+            "provider": stats["provider"],
+            "calls": stats["calls"],
+            "errors": stats["errors"],
+            "total_tokens": stats["total_tokens"],
+            "avg_tokens": round(stats["total_tokens"] / stats["calls"], 1),
+            "avg_latency": round(stats["total_latency"] / stats["calls"], 2),
+            "p50_latency": _percentile(stats["latencies"], 0.5),
+            "p95_latency": _percentile(stats["latencies"], 0.95),
+        }
+        for key, stats in snapshot.items()
+    }
@@ -0,0 +1,65 @@
+import hashlib
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Callable, Dict
+
+
+def get_fingerprint(*parts: Any) -> str:
+    """Get a stable fingerprint of a request from its parts (task, options, prompt...)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent calls: while a call for a key is in flight,
+    other callers with the same key wait for it and share its result (or error)
+    instead of issuing their own.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls: Dict[str, Future] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._calls[key] = future
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Counters of executed and coalesced (saved) calls"""
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls),
+            }
+
+
+llm_singleflight = SingleFlight()
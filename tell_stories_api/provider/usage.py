@@ -0,0 +1,103 @@
+import json
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict
+from tell_stories_api.logs import logger
+
+PROCESS_DATA_DIR = Path("data/process")
+USAGE_FIELDS = ("calls", "prompt_tokens", "completion_tokens", "cached_tokens", "total_tokens")
+
+_scope = threading.local()
+_usage: Dict[str, Dict[str, Any]] = {}
+_usage_lock = threading.Lock()
+
+
+class BudgetExceededError(Exception):
+    """Raised when a job has spent its max token budget"""
+    pass
+
+
+@contextmanager
+def usage_scope(process_id: str, stage: str):
+    """Account the LLM usage recorded in this thread to a process_id and stage (plot, cast, split, lines)"""
+    previous = getattr(_scope, "value", None)
+    _scope.value = (process_id, stage)
+    try:
+        yield
+    finally:
+        _scope.value = previous
+
+
+def _empty_counters() -> Dict[str, int]:
+    return {field: 0 for field in USAGE_FIELDS}
+
+
+def _get_usage_path(process_id: str) -> Path:
+    return PROCESS_DATA_DIR / process_id / "usage.json"
+
+
+def _load_job_usage(process_id: str) -> Dict[str, Any]:
+    """Get the usage of a job, loading it from usage.json the first time. Must hold _usage_lock."""
+    if process_id not in _usage:
+        usage_path = _get_usage_path(process_id)
+        job_usage = {"total": _empty_counters(), "stages": {}}
+        if usage_path.exists():
+            try:
+                with open(usage_path, encoding='utf-8') as f:
+                    job_usage = json.load(f)
+            except Exception as e:
+                logger.warning(f"Failed to load {usage_path}: {e}")
+        _usage[process_id] = job_usage
+    return _usage[process_id]
+
+
+def get_cached_tokens(usage: Any) -> int:
+    """Get the cached prompt tokens of an OpenAI compatible usage object (OpenAI or DeepSeek style)"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None)
+    if cached_tokens is None:
+        cached_tokens = getattr(usage, "prompt_cache_hit_tokens", None)
+    return cached_tokens or 0
+
+
+def record_llm_usage(usage: Any) -> None:
+    """Add a response's usage to the job and stage of the current usage_scope and persist it to usage.json"""
+    scope = getattr(_scope, "value", None)
+    if not scope or not scope[0] or usage is None:
+        return
+
+    process_id, stage = scope
+    counters = {
+        "calls": 1,
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "cached_tokens": get_cached_tokens(usage),
+        "total_tokens": usage.total_tokens or 0,
+    }
+    with _usage_lock:
+        job_usage = _load_job_usage(process_id)
+        stage_usage = job_usage["stages"].setdefault(stage, _empty_counters())
+        for field, value in counters.items():
+            stage_usage[field] += value
+            job_usage["total"][field] += value
+
+        usage_path = _get_usage_path(process_id)
+        try:
+            usage_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(usage_path, "w", encoding='utf-8') as f:
+                json.dump(job_usage, f, indent=4)
+        except Exception as e:
+            logger.warning(f"Failed to save {usage_path}: {e}")
+
+
+def get_job_usage(process_id: str) -> Dict[str, Any]:
+    """Get the token usage of a job, in total and per stage"""
+    with _usage_lock:
+        return json.loads(json.dumps(_load_job_usage(process_id)))
+
+
+def get_job_total_tokens(process_id: str) -> int:
+    """Get the total tokens a job has spent so far"""
+    with _usage_lock:
+        return _load_job_usage(process_id)["total"]["total_tokens"]
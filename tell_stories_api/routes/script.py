@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException
 from tell_stories_api.logs import logger
 
 from tell_stories_api.script_handler.models import (
@@ -6,6 +6,10 @@ from tell_stories_api.script_handler.models import (
     CastRequest, LineRequest
 )
 from tell_stories_api.script_handler.service import ScriptService
+from tell_stories_api.provider.executor import llm_executor
+from tell_stories_api.provider.routing import LLM_TASKS, get_task_route, get_task_stats
+from tell_stories_api.provider.usage import get_job_usage
+from tell_stories_api.provider.singleflight import llm_singleflight
 
 router = APIRouter()
 
@@ -40,22 +44,26 @@ async def generate_cast(process_id: str, request: CastRequest):
 @router.post("/{process_id}/lines", response_model=ScriptResponse)
 async def generate_lines(
     process_id: str, 
-    request: LineRequest, 
-    background_tasks: BackgroundTasks
+    request: LineRequest
 ):
     try:
+        # A repeated request while the lines are generated returns the running job, leaving its progress alone
+        active_job = ScriptService.get_active_lines_job(process_id)
+        if active_job:
+            return ScriptResponse(
+                status=active_job["state"],
+                process_id=process_id,
+                message=f"Lines generation is already {active_job['state']} as job {active_job['id']}.",
+                details={"job_id": active_job["id"]}
+            )
+
         # Initialize the process
         result = await ScriptService.initialize_lines_generation(process_id)
         
-        # Schedule the background processing
-        background_tasks.add_task(
-            ScriptService.process_lines_background,
-            process_id,
-            request.split_dialogue,
-            request.all_caps_to_proper
-        )
+        # Queue the processing for a job worker
+        job_id = ScriptService.enqueue_lines_generation(process_id, request)
         
-        return ScriptResponse(**result)
+        return ScriptResponse(**result, details={"job_id": job_id})
         
     except Exception as e:
         logger.error(f"Error in generate_lines: {str(e)}")
@@ -71,11 +79,26 @@ async def get_script_progress(process_id: str):
         logger.error(f"Error in get_script_progress: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/{process_id}/usage")
+async def get_script_usage(process_id: str):
+    """Get the prompt, completion and cached token usage of a process, in total and per stage"""
+    return {"process_id": process_id, **get_job_usage(process_id)}
+
+@router.get("/llm/stats")
+async def get_llm_stats():
+    """Get queue depth and active requests per provider, the routes and latency/token stats per task,
+    and how many identical requests were coalesced"""
+    return {
+        "providers": llm_executor.stats(),
+        "routes": {task: get_task_route(task).model_dump() for task in LLM_TASKS},
+        "tasks": get_task_stats(),
+        "singleflight": llm_singleflight.stats()
+    }
+
 @router.post("/{process_id}", response_model=ScriptResponse)
 async def generate_script(
     process_id: str, 
-    request: ScriptRequest,
-    background_tasks: BackgroundTasks
+    request: ScriptRequest
 ):
     """Generate complete script by running all three steps(plot, cast, lines) in sequence"""
     try:
@@ -93,15 +116,11 @@ async def generate_script(
             request.book_id
         )
         
-        # Schedule the background processing for lines
-        background_tasks.add_task(
-            ScriptService.process_lines_background,
-            process_id,
-            request.split_dialogue,
-            request.all_caps_to_proper
-        )
+        # Queue the lines processing for a job worker, unless a job is already generating them
+        active_job = ScriptService.get_active_lines_job(process_id)
+        job_id = active_job["id"] if active_job else ScriptService.enqueue_lines_generation(process_id, request)
         
-        return ScriptResponse(**result)
+        return ScriptResponse(**{**result, "details": {**result["details"], "job_id": job_id}})
         
     except Exception as e:
         logger.error(f"Error in generate_script: {str(e)}")
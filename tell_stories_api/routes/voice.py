@@ -1,7 +1,9 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks, Depends
 from pathlib import Path
-from tell_stories_api.voice_handler.models import VoiceRequest, VoiceResponse, VoiceCastResponse, ProgressData
-from tell_stories_api.voice_handler.service import VoiceService
+from tell_stories_api.voice_handler.models import VoiceRequest, StreamRequest, VoiceResponse, VoiceCastResponse, ProgressData
+from tell_stories_api.voice_handler.service import VoiceService, JobConflictError, FileNotFoundError as VoiceFileNotFoundError
+from tell_stories_api.voice_handler.backends import get_tts_stats
+from tell_stories_api.voice_handler.preview import start_prewarm_previews
 from tell_stories_api.logs import logger
 
 router = APIRouter()
@@ -27,6 +29,40 @@ async def generate_voice(process_id: str, request: VoiceRequest):
         logger.error(f"Error in generate_voice: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/{process_id}/stream", response_model=VoiceResponse)
+async def stream_voice(process_id: str, request: StreamRequest):
+    """Generate the lines and voice them in one job, part by part as the LLM completes them"""
+    try:
+        return await get_voice_service().start_streaming_generation(process_id, request)
+    except Exception as e:
+        logger.error(f"Error in stream_voice: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/{process_id}/lines/{index}")
+async def regenerate_line(process_id: str, index: int, request: VoiceRequest):
+    """Synthesize a new take of one line, ahead of bulk synthesis. Run generation with resume to rebuild the final audio."""
+    try:
+        return await get_voice_service().regenerate_line(process_id, index, request)
+    except (IndexError, VoiceFileNotFoundError) as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except JobConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in regenerate_line: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/previews/prewarm")
+async def prewarm_previews():
+    """Render the default preview of every voice actor in the background, at bulk priority"""
+    if not start_prewarm_previews():
+        return {"status": "already_running", "message": "The voice previews are already being pre-warmed."}
+    return {"status": "processing", "message": "Pre-warming the voice previews of every voice actor."}
+
+@router.get("/tts/stats")
+async def get_voice_tts_stats():
+    """Get per TTS backend load and outcomes, and per priority lane (interactive, regen, bulk) queue waits"""
+    return get_tts_stats()
+
 @router.get("/{process_id}/progress", response_model=ProgressData)
 async def get_voice_progress(process_id: str):
     """Get progress of voice generation"""
@@ -0,0 +1,178 @@
+import json
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from tell_stories_api.logs import logger
+
+# Optional JSON file {"canonical instruct": ["alias", ...]} replacing the default vocabulary
+INSTRUCT_VOCABULARY_PATH = os.getenv("INSTRUCT_VOCABULARY_PATH")
+# Typos (insertions, deletions, substitutions, transpositions) tolerated when mapping an unknown instruct onto
+# a known one, and at most one per 4 characters: "angy" -> "angry", but "unhappy" never becomes "happy"
+INSTRUCT_FUZZY_MAX_EDITS = int(os.getenv("INSTRUCT_FUZZY_MAX_EDITS", 2))
+# Map near-neutral instructs ("calm", "plain") to "normal", which is voiced with the faster zero-shot endpoint
+INSTRUCT_COLLAPSE_NEUTRAL = os.getenv("INSTRUCT_COLLAPSE_NEUTRAL", "true").lower() == "true"
+
+NEUTRAL_INSTRUCT = "normal"
+DEFAULT_INSTRUCT_VOCABULARY: Dict[str, List[str]] = {
+    NEUTRAL_INSTRUCT: ["neutral", "neutrally", "normally", "calm", "calmly", "plain", "plainly", "flat", "flatly",
+                       "steady", "steadily", "matter-of-fact", "matter-of-factly", "narrating", "narration", "none"],
+    "trembling": ["trembling", "shaky", "shakily", "shaking", "quivering", "trembling voice"],
+    "fearful": ["fearfully", "afraid", "scared", "frightened", "terrified", "nervous", "nervously", "anxious", "anxiously"],
+    "surprised": ["surprisingly", "surprise", "shocked", "astonished", "amazed", "startled"],
+    "angry": ["angrily", "furious", "furiously", "enraged", "annoyed", "irritated", "irritably"],
+    "sad": ["sadly", "sorrowful", "sorrowfully", "mournful", "melancholy", "tearful", "tearfully", "grieving"],
+    "happy": ["happily", "cheerful", "cheerfully", "joyful", "joyfully", "delighted", "excited", "excitedly"],
+    "whispering": ["whisper", "whispers", "whispered", "hushed", "under breath", "under one's breath"],
+    "soft": ["softly", "quiet", "quietly", "gently", "gentle", "tender", "tenderly", "soothing"],
+    "shouting": ["shout", "shouts", "shouted", "yelling", "yelled", "loudly", "loud", "screaming"],
+    "sarcastic": ["sarcastically", "mocking", "mockingly", "sneering", "ironic", "ironically", "teasing"],
+    "serious": ["seriously", "stern", "sternly", "solemn", "solemnly", "grave", "gravely", "firm", "firmly"],
+    "cold": ["coldly", "icy", "icily", "detached", "distant"],
+    "curious": ["curiously", "inquisitive", "wondering", "puzzled", "confused", "questioning"],
+    "tired": ["tiredly", "weary", "wearily", "exhausted", "sleepy", "sleepily"],
+    "pleading": ["begging", "imploring", "desperate", "desperately", "urgent", "urgently"],
+}
+# Intensity and filler words that do not change which voice style is used ("trembling slightly" -> "trembling")
+MODIFIER_WORDS = {"slightly", "very", "somewhat", "a bit", "a little", "rather", "quite", "extremely", "deeply",
+                  "mildly", "barely", "really", "more", "less", "voice", "tone", "in a", "with a",
+                  "speaking", "speaks", "said", "says", "saying", "talking"}
+# Negations turning an instruct into its opposite; a fuzzy match must not drop them ("unafraid" is not "afraid")
+NEGATION_WORDS = {"not", "no", "never", "without"}
+NEGATION_PREFIXES = ("un", "in", "im", "non", "dis")
+NEGATION_SUFFIXES = ("less",)
+
+
+def _clean(instruct: str) -> str:
+    text = instruct.lower().strip()
+    # Only the first of several comma-separated directions is used
+    text = re.split(r"[,;/]| and ", text)[0]
+    text = re.sub(r"[^\w\s'-]", " ", text)
+    for word in sorted(MODIFIER_WORDS, key=len, reverse=True):
+        text = re.sub(rf"\b{re.escape(word)}\b", " ", text)
+    return " ".join(text.split())
+
+
+def _get_negations(text: str) -> set:
+    negations = set()
+    for word in text.split():
+        if word in NEGATION_WORDS:
+            negations.add(word)
+        negations.update(f"{prefix}-" for prefix in NEGATION_PREFIXES if word.startswith(prefix))
+        negations.update(f"-{suffix}" for suffix in NEGATION_SUFFIXES if word.endswith(suffix))
+    return negations
+
+
+def _edit_distance(a: str, b: str, max_edits: int) -> int:
+    """Optimal string alignment distance of a and b, or max_edits + 1 once it is known to exceed max_edits"""
+    if abs(len(a) - len(b)) > max_edits:
+        return max_edits + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_edits:
+            return max_edits + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _fuzzy_match(cleaned: str, lookup: Dict[str, str]) -> Optional[str]:
+    """The known instruct within typo distance of the whole cleaned instruct, keeping its negations"""
+    max_edits = min(INSTRUCT_FUZZY_MAX_EDITS, len(cleaned) // 4)
+    if max_edits < 1:
+        return None
+    negations = _get_negations(cleaned)
+    best, best_distance = None, max_edits + 1
+    for candidate in lookup:
+        if negations - _get_negations(candidate):
+            continue
+        distance = _edit_distance(cleaned, candidate, max_edits)
+        if distance < best_distance:
+            best, best_distance = candidate, distance
+    return lookup[best] if best else None
+
+
+@lru_cache(maxsize=1)
+def get_instruct_vocabulary() -> Dict[str, List[str]]:
+    """Get the canonical instruct vocabulary from INSTRUCT_VOCABULARY_PATH, or the default one"""
+    if INSTRUCT_VOCABULARY_PATH:
+        try:
+            with open(INSTRUCT_VOCABULARY_PATH, encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Failed to load instruct vocabulary {INSTRUCT_VOCABULARY_PATH}, using the default: {e}")
+    return DEFAULT_INSTRUCT_VOCABULARY
+
+
+@lru_cache(maxsize=1)
+def _get_lookup() -> Dict[str, str]:
+    """Cleaned alias or canonical instruct -> canonical instruct"""
+    lookup = {}
+    for canonical, aliases in get_instruct_vocabulary().items():
+        for alias in [canonical, *aliases]:
+            lookup.setdefault(_clean(alias), canonical)
+    return lookup
+
+
+@lru_cache(maxsize=4096)
+def normalize_instruct(instruct: str, collapse_neutral: bool = INSTRUCT_COLLAPSE_NEUTRAL) -> str:
+    """
+    Map a free-form instruct onto the canonical vocabulary: exact alias first, then a typo-level fuzzy match
+    that keeps negations. Instructs matching nothing are kept as they are, trimmed.
+
+    Args:
+        instruct (str): The instruct from the lines generation
+        collapse_neutral (bool): Whether near-neutral instructs become "normal" (zero-shot)
+
+    Returns:
+        str: The normalized instruct
+    """
+    cleaned = _clean(instruct or "")
+    if not cleaned:
+        return NEUTRAL_INSTRUCT
+    lookup = _get_lookup()
+    canonical = lookup.get(cleaned)
+    if canonical is None:
+        canonical = _fuzzy_match(cleaned, lookup)
+    if canonical is None:
+        return instruct.strip()
+    if canonical == NEUTRAL_INSTRUCT and not collapse_neutral:
+        return NEUTRAL_INSTRUCT if cleaned == NEUTRAL_INSTRUCT else instruct.strip()
+    return canonical
+
+
+def normalize_lines_instructs(lines: List[Dict], collapse_neutral: bool = INSTRUCT_COLLAPSE_NEUTRAL) -> Tuple[List[Dict], List[str]]:
+    """
+    Normalize the instructs of lines.
+
+    Returns:
+        Tuple[List[Dict], List[str]]: The lines with normalized instructs, and their original instructs
+    """
+    raw_instructs = [line.get("instruct", NEUTRAL_INSTRUCT) for line in lines]
+    normalized = [
+        {**line, "instruct": normalize_instruct(raw_instruct, collapse_neutral)}
+        for line, raw_instruct in zip(lines, raw_instructs)
+    ]
+    return normalized, raw_instructs
+
+
+def get_instruct_report(raw_instructs: List[str], lines: List[Dict], top: int = 20) -> Dict:
+    """Distribution of instructs before and after normalization, and how many lines use each TTS endpoint"""
+    before = Counter(raw_instructs)
+    after = Counter(line["instruct"] for line in lines)
+    return {
+        "lines": len(lines),
+        "changed": sum(raw != line["instruct"] for raw, line in zip(raw_instructs, lines)),
+        "distinct_before": len(before),
+        "distinct_after": len(after),
+        # Lines voiced with the slower inference_instruct2 endpoint; the rest use zero-shot
+        "instruct_lines_before": sum(count for instruct, count in before.items() if instruct != NEUTRAL_INSTRUCT),
+        "instruct_lines_after": sum(count for instruct, count in after.items() if instruct != NEUTRAL_INSTRUCT),
+        "top_before": dict(before.most_common(top)),
+        "top_after": dict(after.most_common(top)),
+    }
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, Dict, Any
 
 class ScriptRequest(BaseModel):
     """Model for script processing request"""
@@ -21,6 +21,23 @@ class ScriptRequest(BaseModel):
         True,
         description="Whether to convert all-caps lines to proper capitalization"
     )
+    throughput_mode: bool = Field(
+        False,
+        description="Whether to distribute story parts across all configured healthy providers at once, weighted by their capacity"
+    )
+    max_tokens_budget: Optional[int] = Field(
+        None,
+        description="Optional max tokens the lines job may spend. Once exceeded, no new story part is started.",
+        example=200000
+    )
+    normalize_instructs: bool = Field(
+        True,
+        description="Whether to map line instructs onto a canonical vocabulary so more lines share cached TTS audio"
+    )
+    distributed: bool = Field(
+        False,
+        description="Whether to process the story parts as units on the shared work board, so worker nodes take part. The token budget and throughput mode do not apply."
+    )
     book_id: Optional[str] = Field(
         None,
         description="The ID of the book this chapter belongs to. If provided, previous chapters' plots will be considered.",
@@ -49,6 +66,11 @@ class ScriptResponse(BaseModel):
         description="The path to the output file",
         example="data/process/hem101/plot.json"
     )
+    details: Optional[Dict[str, Any]] = Field(
+        None,
+        description="Optional progress details of a running job",
+        example={"completed_parts": 3, "total_parts": 10, "concurrency_limit": {"deepseek": 6}}
+    )
 
 class PlotRequest(BaseModel):
     """Model for plot generation request"""
@@ -85,4 +107,21 @@ class LineRequest(BaseModel):
     all_caps_to_proper: bool = Field(
         True,
         description="Whether to convert all-caps lines to proper capitalization"
-    ) 
\ No newline at end of file
+    )
+    throughput_mode: bool = Field(
+        False,
+        description="Whether to distribute story parts across all configured healthy providers at once, weighted by their capacity"
+    )
+    max_tokens_budget: Optional[int] = Field(
+        None,
+        description="Optional max tokens the lines job may spend. Once exceeded, no new story part is started.",
+        example=200000
+    )
+    normalize_instructs: bool = Field(
+        True,
+        description="Whether to map line instructs onto a canonical vocabulary so more lines share cached TTS audio"
+    )
+    distributed: bool = Field(
+        False,
+        description="Whether to process the story parts as units on the shared work board, so worker nodes take part. The token budget and throughput mode do not apply."
+    )
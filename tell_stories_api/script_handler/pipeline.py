@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import json
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+from tell_stories_api.logs import logger
+
+
+class Stage:
+    """
+    A stage of the pipeline graph.
+
+    Args:
+        name (str): The stage name
+        run (Callable): Async function producing the stage's output artifacts
+        deps (List[str]): Names of the stages that must finish first
+        input_files (List[str]): Artifacts (relative to the process dir) the stage reads
+        params (Any): Extra JSON-serializable inputs (story text, book_id...)
+        outputs (List[str]): Artifacts (relative to the process dir) the stage writes
+    """
+
+    def __init__(self, name: str, run: Callable[[], Awaitable[Any]], deps: List[str] = None,
+                 input_files: List[str] = None, params: Any = None, outputs: List[str] = None):
+        self.name = name
+        self.run = run
+        self.deps = deps or []
+        self.input_files = input_files or []
+        self.params = params
+        self.outputs = outputs or []
+
+    def get_input_hash(self, process_dir: Path) -> str:
+        """Hash of the stage's input artifacts and params, computed once its dependencies are done"""
+        digest = hashlib.sha256()
+        digest.update(json.dumps(self.params, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        for input_file in self.input_files:
+            path = process_dir / input_file
+            digest.update(input_file.encode("utf-8"))
+            digest.update(path.read_bytes() if path.exists() else b"<missing>")
+        return digest.hexdigest()
+
+
+def _load_pipeline_state(state_path: Path) -> Dict[str, Any]:
+    if state_path.exists():
+        try:
+            with open(state_path, encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load {state_path}: {e}")
+    return {"stages": {}}
+
+
+async def run_pipeline(process_dir: Path, stages: List[Stage]) -> Dict[str, Any]:
+    """
+    Run a stage graph: every stage starts as soon as its dependencies are done, so independent
+    stages run concurrently. A stage whose input hash is unchanged since its last successful
+    run, and whose outputs still exist, is skipped.
+
+    Args:
+        process_dir (Path): The process directory holding the artifacts and pipeline.json
+        stages (List[Stage]): The stages, dependencies listed before their dependents
+
+    Returns:
+        Dict: The per-stage timeline (status, start and end offsets in seconds, duration)
+    """
+    state_path = process_dir / "pipeline.json"
+    state = _load_pipeline_state(state_path)
+    timeline: Dict[str, Dict[str, Any]] = {}
+    pipeline_start = time.monotonic()
+    tasks: Dict[str, asyncio.Task] = {}
+
+    async def run_stage(stage: Stage) -> None:
+        await asyncio.gather(*(tasks[dep] for dep in stage.deps))
+
+        input_hash = stage.get_input_hash(process_dir)
+        previous = state["stages"].get(stage.name, {})
+        start = round(time.monotonic() - pipeline_start, 3)
+        if previous.get("input_hash") == input_hash and previous.get("status") in ("completed", "skipped") \
+                and all((process_dir / output).exists() for output in stage.outputs):
+            logger.info(f"Pipeline stage {stage.name} skipped: inputs unchanged")
+            timeline[stage.name] = {"status": "skipped", "start": start, "end": start, "duration": 0.0}
+            state["stages"][stage.name] = {**previous, "status": "skipped"}
+            return
+
+        logger.info(f"Pipeline stage {stage.name} started")
+        try:
+            await stage.run()
+        except Exception:
+            end = round(time.monotonic() - pipeline_start, 3)
+            timeline[stage.name] = {"status": "failed", "start": start, "end": end, "duration": round(end - start, 3)}
+            state["stages"][stage.name] = {"status": "failed", "input_hash": None}
+            raise
+        end = round(time.monotonic() - pipeline_start, 3)
+        logger.info(f"Pipeline stage {stage.name} completed in {end - start:.2f}s")
+        timeline[stage.name] = {"status": "completed", "start": start, "end": end, "duration": round(end - start, 3)}
+        state["stages"][stage.name] = {"status": "completed", "input_hash": input_hash}
+
+    for stage in stages:
+        tasks[stage.name] = asyncio.ensure_future(run_stage(stage))
+
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        # Let stages still running finish before recording the state
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+        state["timeline"] = timeline
+        state["total_duration"] = round(time.monotonic() - pipeline_start, 3)
+        with open(state_path, "w", encoding='utf-8') as f:
+            json.dump(state, f, indent=4, ensure_ascii=False)
+
+    return {"stages": timeline, "total_duration": state["total_duration"]}
@@ -1,11 +1,17 @@
 import re
 import json
 import os
-from typing import List, Dict
+import asyncio
+import time
+from typing import List, Dict, Tuple
 from tell_stories_api.logs import logger
 from tell_stories_api.provider.deepseek_api import DeepSeekAPI
 from tell_stories_api.provider.qwen_api import QwenAPI
 from tell_stories_api.provider.openrouter_api import OpenRouterAPI
+from tell_stories_api.provider.executor import llm_executor, get_provider_concurrency
+from tell_stories_api.provider.routing import get_task_route, record_task_stats
+from tell_stories_api.provider.usage import usage_scope
+from tell_stories_api.provider.singleflight import llm_singleflight, get_fingerprint
 from tell_stories_api.script_handler.prompt import (
     get_va_match_prompt,
     get_va_and_main_plot_prompt,
@@ -38,26 +44,123 @@ MODEL_CONFIG = {
     "fallback_order": os.getenv("MODEL_FALLBACK_ORDER", "deepseek,openrouter,qwen").lower().split(",")
 }
 
-def predict_with_fallback(prompt: str) -> tuple[str, int, str]:
+# API key variable of each provider, used to tell which providers are configured
+PROVIDER_API_KEY_ENV = {
+    "deepseek": "DEEPSEEK_API_KEY",
+    "openrouter": "OPENROUTER_API_KEY",
+    "qwen": "DASHSCOPE_API_KEY"
+}
+
+def get_healthy_providers() -> List[str]:
+    """
+    Get the configured providers (primary and fallbacks with an API key) that are currently healthy
+    """
+    providers = []
+    for provider in [MODEL_CONFIG["primary"]] + MODEL_CONFIG["fallback_order"]:
+        provider = provider.strip()
+        if provider in providers or not os.getenv(PROVIDER_API_KEY_ENV.get(provider, "")):
+            continue
+        if llm_executor.is_healthy(provider):
+            providers.append(provider)
+    return providers
+
+def assign_parts_to_providers(part_count: int, providers: List[str]) -> List[str]:
+    """
+    Distribute story parts across providers by smooth weighted round-robin, weighted by their configured capacity
+    
+    Args:
+        part_count (int): Number of story parts
+        providers (List[str]): The providers to use
+        
+    Returns:
+        List[str]: The provider of each part, in part order
+    """
+    weights = {provider: get_provider_concurrency(provider) for provider in providers}
+    total_weight = sum(weights.values())
+    current = {provider: 0 for provider in providers}
+    assignments = []
+    for _ in range(part_count):
+        for provider in providers:
+            current[provider] += weights[provider]
+        chosen = max(providers, key=lambda provider: current[provider])
+        current[chosen] -= total_weight
+        assignments.append(chosen)
+    return assignments
+
+def call_provider(model_choice: str, prompt: str, options: dict = None) -> tuple[str, int, str]:
+    """
+    Call a single provider directly. options are the route's model/temperature/max_tokens/timeout overrides.
+    """
+    options = options or {}
+    if model_choice == "qwen":
+        return qwen.predict(prompt, **options)
+    elif model_choice == "openrouter":
+        return openrouter.predict_v3(prompt, **options)
+    else:  # deepseek is default
+        return deepseek.predict_v3(prompt, **options)
+
+def run_on_provider(model_choice: str, prompt: str, process_id: str = "", task: str = "lines", options: dict = None) -> tuple[str, int, str]:
+    """
+    Call a provider through the shared LLM executor, which bounds concurrency and TPM per provider
+    """
+    def call():
+        # Token usage recorded by the provider is accounted to this job and task
+        with usage_scope(process_id, task):
+            return call_provider(model_choice, prompt, options)
+
+    start_time = time.monotonic()
+    try:
+        result = llm_executor.run(
+            model_choice,
+            call,
+            process_id=process_id,
+            est_tokens=count_tokens(prompt)
+        )
+    except Exception:
+        record_task_stats(task, model_choice, time.monotonic() - start_time, None, success=False)
+        raise
+    record_task_stats(task, model_choice, time.monotonic() - start_time, result[1], success=True)
+    return result
+
+def predict_with_fallback(prompt: str, process_id: str = "", task: str = "lines", provider: str = None) -> tuple[str, int, str]:
+    """
+    Predict using the model routed for the task (plot, cast, split, lines) with fallback logic.
+    provider overrides the routed provider, e.g. when parts are fanned out across providers.
+    Identical concurrent requests (e.g. a re-posted plot request) share one in-flight call.
+    """
+    response, total_tokens, finish_reason, _ = predict_with_fallback_provider(prompt, process_id, task, provider)
+    return response, total_tokens, finish_reason
+
+def predict_with_fallback_provider(prompt: str, process_id: str = "", task: str = "lines", provider: str = None) -> tuple[str, int, str, str]:
     """
-    Predict using the primary model with fallback logic
+    Same as predict_with_fallback, also returning the provider that answered, a fallback one if the first failed.
     """
+    route = get_task_route(task)
+    fingerprint = get_fingerprint(task, provider, route.model_dump(), prompt)
+    return llm_singleflight.do(
+        fingerprint,
+        lambda: _predict_with_fallback(prompt, process_id, task, provider)
+    )
+
+def _predict_with_fallback(prompt: str, process_id: str = "", task: str = "lines", provider: str = None) -> tuple[str, int, str, str]:
     # Get initial model choice
-    model_choice = MODEL_CONFIG["primary"]
-    logger.info(f"Selected model: {model_choice}")
+    route = get_task_route(task)
+    route_options = route.options()
+    model_choice = provider or route.provider or MODEL_CONFIG["primary"]
+    # The routed model name only applies to the routed provider, the primary one if the route has none
+    if model_choice != (route.provider or MODEL_CONFIG["primary"]):
+        route_options.pop("model", None)
+    logger.info(f"Selected model for {task}: {model_choice} {route_options}")
     
     # Try primary model first
     try:
-        if model_choice == "qwen":
-            return qwen.predict(prompt)
-        elif model_choice == "openrouter":
-            return openrouter.predict_v3(prompt)
-        else:  # deepseek is default
-            return deepseek.predict_v3(prompt)
+        return (*run_on_provider(model_choice, prompt, process_id, task, route_options), model_choice)
             
     except Exception as e:
         logger.error(f"Error with {model_choice}: {str(e)}")
         
+        # The routed model name only applies to the routed provider
+        fallback_options = {key: value for key, value in route.options().items() if key != "model"}
         # Try fallback models in order
         for fallback_model in MODEL_CONFIG["fallback_order"]:
             if fallback_model == model_choice:
@@ -65,12 +168,7 @@ def predict_with_fallback(prompt: str) -> tuple[str, int, str]:
                 
             try:
                 logger.info(f"Trying fallback model: {fallback_model}")
-                if fallback_model == "qwen":
-                    return qwen.predict(prompt)
-                elif fallback_model == "openrouter":
-                    return openrouter.predict_v3(prompt)
-                else:  # deepseek
-                    return deepseek.predict_v3(prompt)
+                return (*run_on_provider(fallback_model, prompt, process_id, task, fallback_options), fallback_model)
             except Exception as fallback_e:
                 logger.error(f"Error with fallback {fallback_model}: {str(fallback_e)}")
                 continue
@@ -78,27 +176,31 @@ def predict_with_fallback(prompt: str) -> tuple[str, int, str]:
         # If all models fail, raise the original error
         raise e
 
-async def generate_va_and_main_plot(story: str, book_id: str = ""):
+async def generate_va_and_main_plot(story: str, book_id: str = "", process_id: str = ""):
     prompt = await get_va_and_main_plot_prompt(story, book_id)
-    response, total_tokens, finish_reason = predict_with_fallback(prompt)
+    response, total_tokens, finish_reason = await asyncio.to_thread(predict_with_fallback, prompt, process_id, "plot")
     logger.info(f"response.content: {response.content}")
     logger.info(f"prompt: {prompt}")
     logger.info(f"total_tokens: {total_tokens}")
     logger.info(f"finish_reason: {finish_reason}")
     return response.content, total_tokens, finish_reason
 
-async def generate_va_match_from_script(characters: str, book_id: str = ""):
+async def generate_va_match_from_script(characters: str, book_id: str = "", process_id: str = ""):
     prompt = await get_va_match_prompt(characters, book_id)
-    response, total_tokens, finish_reason = predict_with_fallback(prompt)
+    response, total_tokens, finish_reason = await asyncio.to_thread(predict_with_fallback, prompt, process_id, "cast")
     logger.info(f"response.content: {response.content}")
     logger.info(f"prompt: {prompt}")
     logger.info(f"total_tokens: {total_tokens}")
     logger.info(f"finish_reason: {finish_reason}")
     return response.content, total_tokens, finish_reason
 
-def generate_character_lines_from_script(part: str, json_plot: dict):
+def generate_character_lines_from_script(part: str, json_plot: dict, process_id: str = "", provider: str = None):
     """
     Generate character lines from script text, handling large inputs by splitting.
+
+    Returns:
+        tuple: (raw_lines, total_tokens, finish_reason, provider), provider being the one that answered
+        most of the chunks
     """
     MAX_TOKENS_PER_SPLIT = int(os.getenv('MAX_TOKENS_PER_SPLIT', 4000))
     
@@ -106,34 +208,37 @@ def generate_character_lines_from_script(part: str, json_plot: dict):
     token_count = count_tokens(part)
     if token_count <= MAX_TOKENS_PER_SPLIT:
         # ... existing code for single generation ...
-        raw_lines, part_3_tokens, part_3_finish_reason = generate_single_part(part, json_plot)
-        return raw_lines, part_3_tokens, part_3_finish_reason
+        return generate_single_part(part, json_plot, process_id, provider)
     
     # Split text and process each chunk
     text_chunks = split_text_by_tokens(part, MAX_TOKENS_PER_SPLIT)
     all_raw_lines = {"lines": []}
     total_tokens = 0
     final_finish_reason = None
+    chunk_providers = []
     
     for chunk in text_chunks:
-        chunk_lines, chunk_tokens, chunk_finish_reason = generate_single_part(chunk, json_plot)
+        chunk_lines, chunk_tokens, chunk_finish_reason, chunk_provider = generate_single_part(chunk, json_plot, process_id, provider)
         # Extend the lines list with new chunk's lines
         all_raw_lines["lines"].extend(chunk_lines["lines"])
         total_tokens += chunk_tokens
         final_finish_reason = chunk_finish_reason
+        chunk_providers.append(chunk_provider)
     
-    return all_raw_lines, total_tokens, final_finish_reason
+    return all_raw_lines, total_tokens, final_finish_reason, max(set(chunk_providers), key=chunk_providers.count)
 
-def generate_single_part(part: str, json_plot: dict):
+def generate_single_part(part: str, json_plot: dict, process_id: str = "", provider: str = None):
     """
     Generate character lines for a single part that's within token limits.
     
     Args:
         part (str): The text part to process
         json_plot (dict): The plot information
+        process_id (str): The process ID the LLM calls are accounted to
+        provider (str, optional): The provider to try first instead of the routed one
         
     Returns:
-        tuple: (raw_lines, total_tokens, finish_reason)
+        tuple: (raw_lines, total_tokens, finish_reason, provider), provider being the one that answered
     """
     prompt = get_character_lines_prompt_with_attr(json_plot, part)
     
@@ -170,14 +275,14 @@ def generate_single_part(part: str, json_plot: dict):
         return content
 
     # First attempt
-    response, total_tokens, finish_reason = predict_with_fallback(prompt)
+    response, total_tokens, finish_reason, answered_by = predict_with_fallback_provider(prompt, process_id, "lines", provider)
     logger.info(f"First attempt - response.content: {response.content}")
     logger.info(f"First attempt - finish_reason: {finish_reason}")
     
     # If finish_reason is not 'stop', try again
     if finish_reason.lower() != 'stop':
         logger.warning(f"First attempt failed with finish_reason: {finish_reason}. Trying again...")
-        response, total_tokens, finish_reason = predict_with_fallback(prompt)
+        response, total_tokens, finish_reason, answered_by = predict_with_fallback_provider(prompt, process_id, "lines", provider)
         logger.info(f"Second attempt - response.content: {response.content}")
         logger.info(f"Second attempt - finish_reason: {finish_reason}")
     
@@ -222,7 +327,7 @@ def generate_single_part(part: str, json_plot: dict):
         logger.error(f"Unexpected error while processing response: {str(e)}")
         raise
         
-    return json_lines, total_tokens, finish_reason
+    return json_lines, total_tokens, finish_reason, answered_by
 
 def clean_scripts_ticks(input_script: str) -> str:
     return input_script.replace("```json", "").replace("```", "")
@@ -368,7 +473,7 @@ def split_dialogue_and_narration(line_obj: Dict, all_caps_to_proper: bool = Fals
     return result
 
 
-def split_story_into_parts(story: str, main_plot: str, target_length: int = 60) -> List[str]:
+def split_story_into_parts(story: str, main_plot: str, target_length: int = 60, process_id: str = "") -> List[str]:
     parts = []
     current_part = []
     batch_size = 40
@@ -393,7 +498,7 @@ def split_story_into_parts(story: str, main_plot: str, target_length: int = 60)
                 
                 # Ask LLM for split decision
                 prompt = get_split_decision_prompt(context_text, main_plot)
-                response, _, _ = predict_with_fallback(prompt)
+                response, _, _ = predict_with_fallback(prompt, process_id, "split")
                 logger.info(f"response.content: {response.content}")
                 # Parse LLM response
                 split_line = None
@@ -436,17 +541,19 @@ def split_story_into_parts(story: str, main_plot: str, target_length: int = 60)
     
     return parts
 
-def process_story_part(part: str, json_plot: Dict) -> List[Dict]:
+def process_story_part(part: str, json_plot: Dict, process_id: str = "", provider: str = None) -> Tuple[List[Dict], str]:
     """
     Process a story part and return a list of dialogue/narration lines.
     
     Args:
         part (str): The text part to process
         json_plot (Dict): The plot information
+        process_id (str): The process ID the LLM calls are accounted to
+        provider (str, optional): The provider to try first instead of the routed one
         
     Returns:
-        List[Dict]: List of processed lines
+        Tuple[List[Dict], str]: List of processed lines, and the provider that generated them
     """
-    raw_lines, part_3_tokens, part_3_finish_reason = generate_character_lines_from_script(part, json_plot)
+    raw_lines, part_3_tokens, part_3_finish_reason, answered_by = generate_character_lines_from_script(part, json_plot, process_id, provider)
     # raw_lines is already a dict, no need to clean or parse
-    return raw_lines["lines"]
\ No newline at end of file
+    return raw_lines["lines"], answered_by
\ No newline at end of file
@@ -1,12 +1,56 @@
 from pathlib import Path
 import json
+from typing import Iterable, Optional
 from tell_stories_api.logs import logger
-from tell_stories_api.voice_handler.utils import load_va_database
-
-VA_DB = json.dumps([
-    {k: v for k, v in va.items() if k not in ('prompt_text', 'prompt_wav')}
-    for va in load_va_database()
-], indent=2)
+from tell_stories_api.voice_handler.utils import get_va_database_signature, load_va_database_cached
+from tell_stories_api.script_handler.utils import count_tokens
+
+VA_CATALOG_HEADER = "va_name | language | gender | type | age | pitch"
+_va_catalog_cache = {}
+
+def get_va_catalog(languages: Optional[Iterable[str]] = None) -> str:
+    """
+    Get a compact VA catalog for prompts: one line per VA with only the fields the LLM matches on.
+    Results are cached per language set and invalidated whenever a VA's meta.json changes.
+
+    Args:
+        languages (Iterable[str], optional): Only keep VAs in these languages. All VAs if empty.
+
+    Returns:
+        str: The catalog text
+    """
+    language_key = tuple(sorted({lang.lower() for lang in languages or [] if lang}))
+    signature = get_va_database_signature()
+    cache_key = (signature, language_key)
+    if cache_key in _va_catalog_cache:
+        return _va_catalog_cache[cache_key]
+
+    va_database = load_va_database_cached()
+    selected = [va for va in va_database if not language_key or va.get("language", "").lower() in language_key]
+    if not selected:
+        logger.warning(f"No VA found for languages {language_key}. Using the full VA catalog.")
+        selected = va_database
+
+    rows = [
+        " | ".join(str(va.get(field, "")) for field in ("va_name", "language", "gender", "voice_type", "age", "voice_pitch"))
+        for va in sorted(selected, key=lambda va: va.get("va_name", ""))
+    ]
+    catalog = "\n".join([VA_CATALOG_HEADER] + rows)
+    logger.info(f"VA catalog for languages {language_key or 'all'}: {len(rows)} VAs, {count_tokens(catalog)} tokens")
+
+    # Entries of an outdated signature can never be hit again
+    if any(key[0] != signature for key in _va_catalog_cache):
+        _va_catalog_cache.clear()
+    _va_catalog_cache[cache_key] = catalog
+    return catalog
+
+def get_character_languages(characters: str) -> set:
+    """Get the languages of the characters JSON (the "characters" section of plot.json)"""
+    try:
+        characters_dict = json.loads(characters).get("dict", {})
+    except (json.JSONDecodeError, AttributeError):
+        return set()
+    return {details.get("language") for details in characters_dict.values() if isinstance(details, dict)}
 
 async def get_va_match_prompt(characters: str, book_id: str = "") -> str:
     example_output = [
@@ -26,11 +70,16 @@ async def get_va_match_prompt(characters: str, book_id: str = "") -> str:
     previous_cast = ""
     if book_id:
         from tell_stories_api.book_handler.service import get_book
+        from tell_stories_api.book_handler.context import select_relevant_characters
         try:
             book = await get_book(book_id)
             if book.cast and book.cast.cast:
-                # Convert CastEntry objects to dictionaries using model_dump()
-                cast_list = [entry.model_dump() for entry in book.cast.cast]
+                # Only keep the cast of characters in this chapter or recently active ones
+                relevant_characters = select_relevant_characters(book.model_dump(), characters)
+                cast_list = [
+                    entry.model_dump() for entry in book.cast.cast
+                    if entry.character in relevant_characters
+                ]
                 previous_cast = f"""
 Previous chapters cast:
 {json.dumps(cast_list, indent=4, ensure_ascii=False)}
@@ -47,9 +96,9 @@ The above JSON are the character involved in current story. Now we got these cha
 2. Strongly prefer to match in pitch and age.
 3. Optionally match in accent.
 4. Different characters must have different VAs.
-5. We got these VAs in the DB as the following JSON.
+5. We got these VAs in the DB as the following table.
 
-{VA_DB}
+{get_va_catalog(get_character_languages(characters))}
 
 6. If characters cast is provided below, for characters that already appear in the book's cast, you MUST reuse their exact VA assignments:
    - If a character exists in the book's cast, use the SAME va_name that was previously assigned
@@ -96,19 +145,24 @@ async def get_va_and_main_plot_prompt(story: str, book_id: str = "") -> str:
     previous_chapters_context = ""
     if book_id:
         from tell_stories_api.book_handler.service import get_book
+        from tell_stories_api.book_handler.context import (
+            get_book_context,
+            render_book_summary,
+            select_relevant_characters
+        )
         try:
             book = await get_book(book_id)
-            if book.plot and book.plot.detailed_main_plot:
+            book_data = book.model_dump()
+            # Token-capped rolling summary instead of every chapter's detailed plot
+            book_summary = render_book_summary(get_book_context(book_data))
+            if book_summary:
                 previous_chapters_context = f"""
 Previous chapters context:
-{book.plot.detailed_main_plot}
+{book_summary}
 """
-            if book.characters and book.characters.dict:
-                # Convert CharacterDetails objects to dictionaries
-                characters_dict = {
-                    char_name: char_details.model_dump()
-                    for char_name, char_details in book.characters.dict.items()
-                }
+            # Only characters recently active or mentioned in this chapter
+            characters_dict = select_relevant_characters(book_data, story)
+            if characters_dict:
                 previous_chapters_context += f"""
 Previous chapters characters:
 {json.dumps(characters_dict, indent=4, ensure_ascii=False)}
@@ -1,10 +1,22 @@
 from pathlib import Path
+import asyncio
 import json
+import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List
+from threading import Event
+from typing import Callable, Dict, List, Optional
+from tell_stories_api.jobs.job_queue import JobCancelledError, get_job_queue, get_job_summary
 from tell_stories_api.logs import logger
 from tqdm import tqdm
+from tell_stories_api.provider.executor import llm_executor, get_provider_concurrency
+from tell_stories_api.provider.routing import get_task_route
+from tell_stories_api.provider.usage import BudgetExceededError, get_job_usage, get_job_total_tokens
+from .instruct import get_instruct_report, normalize_lines_instructs
+from .pipeline import Stage, run_pipeline
 from .processor import (
+    MODEL_CONFIG,
+    get_healthy_providers,
+    assign_parts_to_providers,
     clean_scripts_ticks,
     generate_va_and_main_plot,
     generate_va_match_from_script,
@@ -13,6 +25,12 @@ from .processor import (
     split_dialogue_and_narration
 )
 
+# Kinds of jobs writing script_progress.json: a process runs at most one of them at a time
+LINES_JOB_KINDS = ["lines", "voice_stream"]
+# Options of a lines request passed to process_lines_background by the job worker
+LINES_JOB_FIELDS = {"split_dialogue", "all_caps_to_proper", "throughput_mode", "max_tokens_budget", "normalize_instructs",
+                    "distributed"}
+
 
 class ScriptService:
     @staticmethod
@@ -29,7 +47,7 @@ class ScriptService:
             raise ValueError("Either story_path or text_input must be provided")
         
         # Generate main plot and characters
-        raw_plot, _, _ = await generate_va_and_main_plot(story, book_id)
+        raw_plot, _, _ = await generate_va_and_main_plot(story, book_id, process_id)
         clean_plot = clean_scripts_ticks(raw_plot)
         json_plot = json.loads(clean_plot)
         
@@ -63,7 +81,7 @@ class ScriptService:
         
         # Generate cast
         characters_str = json.dumps(json_plot["characters"], indent=4, ensure_ascii=False)
-        raw_va_match, _, _ = await generate_va_match_from_script(characters_str, book_id)
+        raw_va_match, _, _ = await generate_va_match_from_script(characters_str, book_id, process_id)
         clean_va_match = clean_scripts_ticks(raw_va_match)
         va_match = json.loads(clean_va_match)
         
@@ -101,9 +119,44 @@ class ScriptService:
         }
 
     @staticmethod
-    def process_lines_background(process_id: str, split_dialogue: bool, all_caps_to_proper: bool):
-        """Process the lines in background"""
+    def get_active_lines_job(process_id: str) -> Optional[Dict]:
+        """Get the queued or running job generating the lines of a process, if any"""
+        return get_job_queue().get_active(process_id, LINES_JOB_KINDS)
+
+    @staticmethod
+    def enqueue_lines_generation(process_id: str, request) -> int:
+        """
+        Queue the lines generation for a job worker. The job's token usage so far is stored with it as the
+        baseline of max_tokens_budget, so the budget covers all its attempts.
+
+        Args:
+            process_id (str): The process ID
+            request (LineRequest | ScriptRequest): The request with the lines options
+
+        Returns:
+            int: The job ID
+        """
+        payload = {**request.model_dump(include=LINES_JOB_FIELDS), "start_tokens": get_job_total_tokens(process_id)}
+        return get_job_queue().enqueue("lines", process_id, payload)
+
+    @staticmethod
+    def process_lines_background(process_id: str, split_dialogue: bool, all_caps_to_proper: bool, throughput_mode: bool = False,
+                                 max_tokens_budget: int = None, on_part: Callable[[int, List[Dict]], None] = None,
+                                 normalize_instructs: bool = True, cancel: Event = None, start_tokens: int = None):
+        """
+        Process the lines in background. In throughput mode story parts are spread across all healthy providers.
+        Once the tokens spent by this job since start_tokens (by default, its usage when this call starts)
+        exceed max_tokens_budget, no new story part is started.
+        With normalize_instructs, instructs are mapped onto the canonical vocabulary so more lines share
+        TTS cache entries, and the instruct distribution before and after is added to the progress.
+        on_part(index, lines) is called with the final lines of each story part as soon as it completes
+        (in completion order), so voice generation can start before lines.json is written.
+        Once cancel is set, no new story part is started and JobCancelledError is raised without writing the progress.
+        """
         try:
+            if start_tokens is None:
+                start_tokens = get_job_total_tokens(process_id)
+            budget = {"limit": max_tokens_budget, "start_tokens": start_tokens}
             process_dir = Path("data/process") / process_id
             progress_path = process_dir / "script_progress.json"
             story_parts_path = process_dir / "story_parts.json"
@@ -125,60 +178,86 @@ class ScriptService:
                 with open(story_parts_path, encoding='utf-8') as f:
                     story_parts = json.load(f)["parts"]
             else:
-                # Load story and split into parts
-                with open(process_dir / "story.txt", encoding='utf-8') as f:
-                    story = f.read()
-                story_parts = split_story_into_parts(story, json_plot["plot"]["main_plot"])
-                # Cache story parts
-                with open(story_parts_path, "w", encoding='utf-8') as f:
-                    json.dump({"parts": story_parts}, f, indent=4, ensure_ascii=False)
+                story_parts = ScriptService.split_story(process_id)
             
+            # Assign providers to parts: all healthy providers weighted by capacity in throughput mode
+            part_providers = [None] * len(story_parts)
+            lines_providers = [get_task_route("lines").provider or MODEL_CONFIG["primary"]]
+            max_workers = 16
+            if throughput_mode:
+                providers = get_healthy_providers() or [MODEL_CONFIG["primary"]]
+                part_providers = assign_parts_to_providers(len(story_parts), providers)
+                lines_providers = list(providers)
+                max_workers = max(max_workers, sum(get_provider_concurrency(p) for p in providers))
+                logger.info(f"Throughput mode: distributing {len(story_parts)} parts across {providers}")
+            if max_tokens_budget:
+                # The budget is checked as each part starts, so only as many parts as the providers run at once
+                # are in flight; otherwise every part would start before any usage is recorded
+                max_workers = sum(llm_executor.get_limit(provider) for provider in lines_providers)
+            provider_stats = {}
+
             # Update progress - processing lines
-            with open(progress_path, "w", encoding='utf-8') as f:
-                json.dump({
-                    "state": "processing_lines",
-                    "process_id": process_id
-                }, f)
+            ScriptService._write_lines_progress(progress_path, process_id, 0, len(story_parts), providers=lines_providers)
                 
-            # Process parts in parallel
-            with ThreadPoolExecutor(max_workers=16) as executor:
+            # Process parts in parallel; the shared LLM executor bounds the actual provider concurrency
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
                 future_to_index = {
-                    executor.submit(process_story_part, part, json_plot): idx 
+                    executor.submit(ScriptService._process_part_timed, part, json_plot, process_id, part_providers[idx], budget, cancel): idx 
                     for idx, part in enumerate(story_parts)
                 }
                 
                 results = [None] * len(story_parts)
+                raw_instructs = [[] for _ in story_parts]
+                skipped_parts = 0
                 with tqdm(total=len(story_parts), desc="Processing story parts") as pbar:
-                    for future in as_completed(future_to_index):
+                    for completed, future in enumerate(as_completed(future_to_index), start=1):
                         idx = future_to_index[future]
-                        results[idx] = future.result()
+                        if cancel is not None and cancel.is_set():
+                            raise JobCancelledError(f"Lines generation of {process_id} cancelled")
+                        try:
+                            part_lines, latency, answered_by = future.result()
+                        except BudgetExceededError:
+                            skipped_parts += 1
+                            pbar.update(1)
+                            continue
+                        results[idx] = ScriptService._postprocess_part_lines(part_lines, split_dialogue, all_caps_to_proper)
+                        if normalize_instructs:
+                            results[idx], raw_instructs[idx] = normalize_lines_instructs(results[idx])
+                        if on_part:
+                            on_part(idx, results[idx])
+                        # Credited to the provider that answered, which may be a fallback of the assigned one
+                        stats = provider_stats.setdefault(answered_by, {"parts": 0, "total_latency": 0.0})
+                        stats["parts"] += 1
+                        stats["total_latency"] = round(stats["total_latency"] + latency, 2)
+                        stats["avg_latency"] = round(stats["total_latency"] / stats["parts"], 2)
+                        if answered_by not in lines_providers:
+                            lines_providers.append(answered_by)
+                        concurrency_limit = ScriptService._write_lines_progress(
+                            progress_path, process_id, completed, len(story_parts), provider_stats, lines_providers
+                        )
+                        pbar.set_postfix(concurrency_limit=concurrency_limit)
                         pbar.update(1)
             
-            # Process results
-            processed_lines = []
-            for part_lines in results:
-                if split_dialogue:
-                    for line in part_lines:
-                        processed_lines.extend(split_dialogue_and_narration(
-                            line, 
-                            all_caps_to_proper=all_caps_to_proper
-                        ))
-                else:
-                    processed_lines.extend(part_lines)
-            
-            # Save lines data
-            lines_path = process_dir / "lines.json"
-            with open(lines_path, "w", encoding='utf-8') as f:
-                json.dump({"lines": processed_lines}, f, indent=4, ensure_ascii=False)
-                
-            # Update progress - completed
-            with open(progress_path, "w", encoding='utf-8') as f:
-                json.dump({
-                    "state": "completed",
-                    "process_id": process_id,
-                    "output_path": str(lines_path)
-                }, f)
+            if skipped_parts:
+                spent_tokens = get_job_total_tokens(process_id) - budget["start_tokens"]
+                error = (f"Token budget of {max_tokens_budget} exceeded ({spent_tokens} tokens spent). "
+                         f"{skipped_parts} of {len(story_parts)} story parts were not processed.")
+                logger.warning(f"{process_id}: {error}")
+                with open(progress_path, "w", encoding='utf-8') as f:
+                    json.dump({
+                        "state": "budget_exceeded",
+                        "process_id": process_id,
+                        "error": error,
+                        "completed_parts": len(story_parts) - skipped_parts,
+                        "total_parts": len(story_parts),
+                        "provider_stats": provider_stats
+                    }, f)
+                return
+
+            ScriptService.save_lines(process_id, results, provider_stats, raw_instructs if normalize_instructs else None)
                 
+        except JobCancelledError:
+            raise
         except Exception as e:
             # Update progress - error
             with open(progress_path, "w", encoding='utf-8') as f:
@@ -190,6 +269,101 @@ class ScriptService:
             logger.error(f"Error in process_lines_background: {str(e)}")
             raise
 
+    @staticmethod
+    def save_lines(process_id: str, results: List[List[Dict]], provider_stats: Dict,
+                   raw_instructs: List[List[str]] = None) -> None:
+        """
+        Write lines.json from the lines of every story part and mark the lines progress completed.
+
+        Args:
+            process_id (str): The process ID
+            results (List[List[Dict]]): The final lines of each story part, in story order
+            provider_stats (Dict): The parts and latency per provider (or worker node)
+            raw_instructs (List[List[str]]): The instructs of each part before normalization, if normalized
+        """
+        process_dir = Path("data/process") / process_id
+        processed_lines = []
+        for part_lines in results:
+            processed_lines.extend(part_lines)
+        instruct_report = None
+        if raw_instructs is not None:
+            instruct_report = get_instruct_report([i for part in raw_instructs for i in part], processed_lines)
+            logger.info(f"{process_id}: instructs normalized from {instruct_report['distinct_before']} to "
+                        f"{instruct_report['distinct_after']} distinct, {instruct_report['changed']} lines changed")
+        
+        # Save lines data
+        lines_path = process_dir / "lines.json"
+        with open(lines_path, "w", encoding='utf-8') as f:
+            json.dump({"lines": processed_lines}, f, indent=4, ensure_ascii=False)
+            
+        # Update progress - completed
+        with open(process_dir / "script_progress.json", "w", encoding='utf-8') as f:
+            json.dump({
+                "state": "completed",
+                "process_id": process_id,
+                "output_path": str(lines_path),
+                "provider_stats": provider_stats,
+                "instruct_report": instruct_report
+            }, f)
+
+    @staticmethod
+    def split_story(process_id: str) -> List[str]:
+        """Split story.txt into parts and cache them in story_parts.json"""
+        process_dir = Path("data/process") / process_id
+        with open(process_dir / "plot.json", encoding='utf-8') as f:
+            json_plot = json.load(f)
+        with open(process_dir / "story.txt", encoding='utf-8') as f:
+            story = f.read()
+        story_parts = split_story_into_parts(story, json_plot["plot"]["main_plot"], process_id=process_id)
+        with open(process_dir / "story_parts.json", "w", encoding='utf-8') as f:
+            json.dump({"parts": story_parts}, f, indent=4, ensure_ascii=False)
+        return story_parts
+
+    @staticmethod
+    def _postprocess_part_lines(part_lines: List[Dict], split_dialogue: bool, all_caps_to_proper: bool) -> List[Dict]:
+        """Split the dialogue and narration of a story part's lines if requested"""
+        if not split_dialogue:
+            return part_lines
+        processed_lines = []
+        for line in part_lines:
+            processed_lines.extend(split_dialogue_and_narration(
+                line, 
+                all_caps_to_proper=all_caps_to_proper
+            ))
+        return processed_lines
+
+    @staticmethod
+    def _process_part_timed(part: str, json_plot: Dict, process_id: str, provider: str = None, budget: Dict = None,
+                            cancel: Event = None):
+        """Process a story part and return its lines with the wall-clock latency and the provider that answered"""
+        if cancel is not None and cancel.is_set():
+            raise JobCancelledError(f"Lines generation of {process_id} cancelled")
+        if budget and budget["limit"] and get_job_total_tokens(process_id) - budget["start_tokens"] >= budget["limit"]:
+            raise BudgetExceededError(f"Token budget of {budget['limit']} exceeded")
+        start_time = time.monotonic()
+        part_lines, answered_by = process_story_part(part, json_plot, process_id, provider)
+        return part_lines, time.monotonic() - start_time, answered_by
+
+    @staticmethod
+    def _write_lines_progress(progress_path: Path, process_id: str, completed_parts: int, total_parts: int,
+                              provider_stats: Dict = None, providers: List[str] = None) -> Dict[str, int]:
+        """
+        Write the processing_lines progress including the current adaptive LLM concurrency limit of each
+        provider running the lines, the routed lines provider by default
+        """
+        providers = providers or [get_task_route("lines").provider or MODEL_CONFIG["primary"]]
+        concurrency_limit = {provider: llm_executor.get_limit(provider) for provider in providers}
+        with open(progress_path, "w", encoding='utf-8') as f:
+            json.dump({
+                "state": "processing_lines",
+                "process_id": process_id,
+                "completed_parts": completed_parts,
+                "total_parts": total_parts,
+                "concurrency_limit": concurrency_limit,
+                "provider_stats": provider_stats or {}
+            }, f)
+        return concurrency_limit
+
     @staticmethod
     async def get_script_progress(process_id: str) -> Dict:
         process_dir = Path("data/process") / process_id
@@ -200,34 +374,95 @@ class ScriptService:
             
         with open(progress_path, encoding='utf-8') as f:
             progress = json.load(f)
+
+        # The queue knows whether the job waits for a worker, and whether its last attempt died with the worker
+        job = get_job_queue().get_latest(process_id, ["lines"])
+        if job is not None:
+            if job["state"] == "queued":
+                progress["state"] = "queued"
+            elif job["state"] == "failed" and progress.get("state") not in ("error", "budget_exceeded"):
+                progress["state"] = "error"
+                progress["error"] = job["error"]
             
         # Convert progress data to match ScriptResponse format
         return {
             "status": progress.get("state", "unknown"),
             "process_id": process_id,
-            "message": progress.get("error") if progress.get("state") == "error" else None,
-            "output_path": progress.get("output_path")
+            "message": progress.get("error"),
+            "output_path": progress.get("output_path"),
+            "details": {
+                **{
+                    key: value for key, value in progress.items()
+                    if key not in ("state", "process_id", "error", "output_path")
+                },
+                "usage": get_job_usage(process_id),
+                "job": get_job_summary(job)
+            }
         }
 
     @staticmethod
     async def generate_complete_script(process_id: str, story_path: str = None, split_dialogue: bool = True, all_caps_to_proper: bool = True, text_input: str = None, book_id: str = None) -> Dict:
-        """Generate complete script by running all three steps(plot, cast, lines) in sequence"""
+        """
+        Generate the complete script. Plot runs first; cast, story splitting and voice casting then run
+        as a stage graph, concurrently where possible, skipping stages whose inputs are unchanged.
+        Lines are processed in background afterwards.
+        """
         try:
-            # Generate plot
-            await ScriptService.generate_plot(process_id, story_path, text_input, book_id)
-            
-            # Generate cast
-            await ScriptService.generate_cast(process_id)
+            process_dir = Path("data/process") / process_id
+            process_dir.mkdir(parents=True, exist_ok=True)
+            story = Path(story_path).read_text(encoding='utf-8') if story_path else text_input
+            if not story:
+                raise ValueError("Either story_path or text_input must be provided")
+
+            # Imported here to keep the script handler importable without the voice dependencies
+            from tell_stories_api.voice_handler.service import VoiceService
+            from tell_stories_api.voice_handler.utils import get_va_database_signature
+            from tell_stories_api.book_handler.processor import get_book_signature
+            book_signature = get_book_signature(book_id)
+
+            timeline = await run_pipeline(process_dir, [
+                Stage(
+                    "plot",
+                    lambda: ScriptService.generate_plot(process_id, None, story, book_id),
+                    params={"story": story, "book_id": book_id, "book": book_signature},
+                    outputs=["plot.json", "story.txt"]
+                ),
+                Stage(
+                    "cast",
+                    lambda: ScriptService.generate_cast(process_id, book_id),
+                    deps=["plot"],
+                    input_files=["plot.json"],
+                    params={"book_id": book_id, "book": book_signature},
+                    outputs=["cast.json"]
+                ),
+                Stage(
+                    "split",
+                    lambda: asyncio.to_thread(ScriptService.split_story, process_id),
+                    deps=["plot"],
+                    input_files=["plot.json", "story.txt"],
+                    outputs=["story_parts.json"]
+                ),
+                Stage(
+                    "voice_casting",
+                    lambda: VoiceService().perform_voice_casting(process_id),
+                    deps=["cast"],
+                    input_files=["cast.json"],
+                    params={"va_database": get_va_database_signature()},
+                    outputs=["voice_cast.json"]
+                ),
+            ])
             
-            # Generate lines
-            result = await ScriptService.initialize_lines_generation(process_id)
+            # Generate lines, unless a job is already generating them
+            if not ScriptService.get_active_lines_job(process_id):
+                await ScriptService.initialize_lines_generation(process_id)
             
             return {
                 "status": "success",
                 "process_id": process_id,
-                "message": "Script generation started. Use /script/{process_id}/lines/progress to check lines processing status."
+                "message": "Script generation started. Use /script/{process_id}/lines/progress to check lines processing status.",
+                "details": {"timeline": timeline}
             }
             
         except Exception as e:
             logger.error(f"Error in generate_complete_script: {str(e)}")
-            raise
\ No newline at end of file
+            raise
@@ -0,0 +1,142 @@
+import os
+import subprocess
+from pathlib import Path
+from typing import List, Optional
+import numpy as np
+import soundfile as sf
+from tell_stories_api.logs import logger
+from .utils import TTS_SAMPLE_RATE
+
+# Frames read per block when appending a segment
+ASSEMBLER_BLOCK_FRAMES = 65536
+# Video track of the MP4: a still black frame. Soft subtitles are drawn by the player, so a tiny
+# 1 fps frame is enough; burned-in subtitles need a readable size and a frame rate fine enough for their timing
+MP4_SOFT_SUBTITLES_VIDEO = "color=c=black:s=640x360:r=1"
+MP4_BURNED_SUBTITLES_VIDEO = "color=c=black:s=1280x720:r=10"
+
+
+class AudioAssembler:
+    """
+    Encode the final audio while the segments are produced: each segment's PCM is piped, in story
+    order, into one long-lived ffmpeg encoder, so the file is ready right after the last line.
+    """
+
+    def __init__(self, output_path: Path, sample_rate: int = TTS_SAMPLE_RATE):
+        self.output_path = output_path
+        # Encode to a temporary name so an aborted job never leaves a truncated final file
+        self.partial_path = output_path.with_name(f"{output_path.stem}.partial{output_path.suffix}")
+        self.sample_rate = sample_rate
+        self.samples = 0
+        self.failed = False
+        self.process: Optional[subprocess.Popen] = subprocess.Popen([
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+            "-c:a", "aac", "-b:a", "256k",
+            str(self.partial_path)
+        ], stdin=subprocess.PIPE)
+
+    @property
+    def duration(self) -> float:
+        """Duration of the audio appended so far, in seconds"""
+        return self.samples / self.sample_rate
+
+    def append(self, wav_path: Path) -> None:
+        """Append a segment's samples to the stream"""
+        if self.failed:
+            return
+        try:
+            with sf.SoundFile(wav_path) as wav:
+                if wav.samplerate != self.sample_rate or wav.channels != 1:
+                    raise ValueError(f"{wav_path} is {wav.samplerate} Hz x{wav.channels}, expected {self.sample_rate} Hz mono")
+                for block in wav.blocks(blocksize=ASSEMBLER_BLOCK_FRAMES, dtype='int16'):
+                    self.process.stdin.write(block.tobytes())
+                    self.samples += len(block)
+        except Exception as e:
+            logger.error(f"Audio assembler failed on {wav_path}: {e}")
+            self.abort()
+
+    def close(self) -> bool:
+        """Finish encoding. Returns whether the final file was written."""
+        if self.failed:
+            return False
+        try:
+            self.process.stdin.close()
+            if self.process.wait() != 0:
+                raise RuntimeError(f"ffmpeg exited with code {self.process.returncode}")
+            os.replace(self.partial_path, self.output_path)
+            return True
+        except Exception as e:
+            logger.error(f"Audio assembler failed to finish {self.output_path}: {e}")
+            self.abort()
+            return False
+
+    def abort(self) -> None:
+        """Stop the encoder and drop the partial file"""
+        self.failed = True
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.partial_path.unlink(missing_ok=True)
+
+
+def start_assembler(output_path: Path) -> Optional[AudioAssembler]:
+    """Start an assembler, or return None when ffmpeg cannot be started"""
+    try:
+        return AudioAssembler(output_path)
+    except OSError as e:
+        logger.warning(f"Cannot start ffmpeg for in-process assembly, falling back to concat: {e}")
+        return None
+
+
+def stitch_segments(segment_paths: List[Path], output_path: Path, gap_seconds: float,
+                    sample_rate: int = TTS_SAMPLE_RATE) -> int:
+    """
+    Join segments into one WAV with a short silence between them.
+
+    Returns:
+        int: The number of samples written
+    """
+    # Never write into a file hard-linked from the segment cache
+    output_path.unlink(missing_ok=True)
+    gap = np.zeros(int(gap_seconds * sample_rate), dtype=np.int16)
+    samples = 0
+    with sf.SoundFile(output_path, mode='w', samplerate=sample_rate, channels=1, subtype='PCM_16') as output:
+        for i, segment_path in enumerate(segment_paths):
+            if i and len(gap):
+                output.write(gap)
+                samples += len(gap)
+            with sf.SoundFile(segment_path) as segment:
+                for block in segment.blocks(blocksize=ASSEMBLER_BLOCK_FRAMES, dtype='int16'):
+                    output.write(block)
+                    samples += len(block)
+    return samples
+
+
+def render_mp4(audio_path: Path, subtitles_path: Path, output_path: Path, burn_subtitles: bool = False) -> None:
+    """
+    Render the MP4 in a single ffmpeg pass: a generated still video cut to the audio with -shortest,
+    the audio copied as is, and the subtitles as a soft mov_text track, or burned into the video.
+    """
+    if burn_subtitles:
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", MP4_BURNED_SUBTITLES_VIDEO,
+            "-i", str(audio_path),
+            "-map", "0:v", "-map", "1:a",
+            "-vf", f"subtitles={subtitles_path}",
+            "-c:v", "libx264", "-tune", "stillimage", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+            "-c:a", "copy", "-shortest",
+            str(output_path)
+        ]
+    else:
+        command = [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", MP4_SOFT_SUBTITLES_VIDEO,
+            "-i", str(audio_path),
+            "-i", str(subtitles_path),
+            "-map", "0:v", "-map", "1:a", "-map", "2:s",
+            "-c:v", "libx264", "-tune", "stillimage", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+            "-c:a", "copy", "-c:s", "mov_text", "-shortest",
+            str(output_path)
+        ]
+    subprocess.run(command, check=True)
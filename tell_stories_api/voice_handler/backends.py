@@ -0,0 +1,236 @@
+import itertools
+import os
+import time
+from threading import Condition, Lock, Thread
+from typing import Any, Dict, List, Optional, Set, Tuple
+import requests
+from tell_stories_api.logs import logger
+
+# A backend failing this many lines in a row is ejected from the pool
+TTS_EJECT_AFTER_FAILURES = int(os.getenv("TTS_EJECT_AFTER_FAILURES", 3))
+# Ejected backends are left alone this long, then probed again by the health check
+TTS_EJECT_SECONDS = float(os.getenv("TTS_EJECT_SECONDS", 30))
+TTS_HEALTH_CHECK_INTERVAL = float(os.getenv("TTS_HEALTH_CHECK_INTERVAL", 15))
+TTS_HEALTH_CHECK_TIMEOUT = 3.0
+# A failed line is retried on another backend, at most this many backends per line
+TTS_MAX_ATTEMPTS = int(os.getenv("TTS_MAX_ATTEMPTS", 3))
+# Requests in flight per backend, across all jobs; further requests wait in their lane
+TTS_BACKEND_SLOTS = int(os.getenv("TTS_BACKEND_SLOTS", 5))
+# Slots per backend only the interactive lane may use, so previews never wait behind bulk synthesis
+TTS_INTERACTIVE_RESERVED_SLOTS = int(os.getenv("TTS_INTERACTIVE_RESERVED_SLOTS", 1))
+# Priority lanes, highest first: voice previews, single-line regeneration, chapter synthesis
+TTS_LANES = ("interactive", "regen", "bulk")
+
+
+def to_base_url(endpoint: str) -> str:
+    """Normalize host:port or a URL to a base URL without trailing slash"""
+    endpoint = endpoint.strip().rstrip("/")
+    return endpoint if endpoint.startswith(("http://", "https://")) else f"http://{endpoint}"
+
+
+def get_env_endpoints() -> List[str]:
+    """Get the CosyVoice endpoints from COSYVOICE2_ENDPOINTS (comma-separated host:port or URLs)"""
+    return [endpoint.strip() for endpoint in os.getenv("COSYVOICE2_ENDPOINTS", "").split(",") if endpoint.strip()]
+
+
+class _Backend:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.base_url = to_base_url(endpoint)
+        self.outstanding = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+
+class BackendPool:
+    """
+    Pool of CosyVoice backends shared by every voice job, preview and regeneration using the same endpoints.
+
+    Each request goes to the healthy backend with the fewest outstanding requests, up to
+    TTS_BACKEND_SLOTS per backend. When every backend is busy, requests wait by lane: a waiting
+    interactive request is served before any regen or bulk one, and a regen before any bulk.
+    Backends failing TTS_EJECT_AFTER_FAILURES lines in a row, or a health check,
+    are ejected until a later health check finds them up again.
+    """
+
+    def __init__(self, endpoints: List[str]):
+        self._lock = Lock()
+        self._available = Condition(self._lock)
+        self._backends = [_Backend(endpoint) for endpoint in endpoints]
+        self._tickets = itertools.count()
+        # Waiting requests per lane, by ticket, to let higher lanes go first
+        self._waiting: Dict[str, Set[int]] = {lane: set() for lane in TTS_LANES}
+        self._lane_stats = {lane: {"requests": 0, "total_wait": 0.0, "max_wait": 0.0} for lane in TTS_LANES}
+        if len(self._backends) > 1:
+            Thread(target=self._health_check_loop, name="tts-health-check", daemon=True).start()
+
+    def __len__(self) -> int:
+        return len(self._backends)
+
+    def _get_slots(self, lane: str) -> int:
+        if lane == "interactive":
+            return TTS_BACKEND_SLOTS
+        return max(1, TTS_BACKEND_SLOTS - TTS_INTERACTIVE_RESERVED_SLOTS)
+
+    def _pick(self, exclude: List[str], lane: str) -> Tuple[bool, Optional[_Backend]]:
+        """
+        Get the least loaded backend with a free slot for the lane. Must hold self._lock.
+
+        Returns:
+            Tuple[bool, Optional[_Backend]]: Whether any backend is not excluded, and the backend if one is free
+        """
+        now = time.monotonic()
+        candidates = [backend for backend in self._backends if backend.endpoint not in exclude]
+        if not candidates:
+            return False, None
+        # Ejected backends are only used when no other is left, so a fully ejected pool still makes progress
+        healthy = [backend for backend in candidates if not backend.is_ejected(now)]
+        free = [backend for backend in healthy or candidates if backend.outstanding < self._get_slots(lane)]
+        if not free:
+            return True, None
+        return True, min(free, key=lambda b: (b.outstanding, b.ejected_until))
+
+    def _has_priority(self, lane: str) -> bool:
+        """Whether no request of a higher lane is waiting. Must hold self._lock."""
+        return not any(self._waiting[higher] for higher in TTS_LANES[:TTS_LANES.index(lane)])
+
+    def acquire(self, exclude: List[str] = None, lane: str = "bulk") -> Optional[_Backend]:
+        """
+        Reserve the least loaded backend not in exclude, waiting for a free slot if they are all busy.
+
+        Args:
+            exclude (List[str]): Endpoints already tried for this request
+            lane (str): Priority lane of the request, one of TTS_LANES
+
+        Returns:
+            Optional[_Backend]: The reserved backend, or None if every backend is excluded
+        """
+        exclude = exclude or []
+        started_at = time.monotonic()
+        with self._available:
+            ticket = next(self._tickets)
+            self._waiting[lane].add(ticket)
+            try:
+                while True:
+                    any_candidate, backend = self._pick(exclude, lane)
+                    if not any_candidate:
+                        return None
+                    if backend and self._has_priority(lane):
+                        break
+                    # Also woken up periodically, as ejections expire without a release
+                    self._available.wait(timeout=1.0)
+            finally:
+                self._waiting[lane].discard(ticket)
+                # Lower lanes may now go ahead
+                self._available.notify_all()
+            backend.outstanding += 1
+            wait = time.monotonic() - started_at
+            stats = self._lane_stats[lane]
+            stats["requests"] += 1
+            stats["total_wait"] += wait
+            stats["max_wait"] = max(stats["max_wait"], wait)
+            return backend
+
+    def release(self, backend: _Backend, success: bool, seconds: float) -> None:
+        """Return a backend reserved by acquire with the outcome of its request"""
+        with self._lock:
+            backend.outstanding -= 1
+            backend.total_seconds += seconds
+            self._available.notify_all()
+            if success:
+                backend.completed += 1
+                backend.consecutive_failures = 0
+                return
+            backend.failed += 1
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= TTS_EJECT_AFTER_FAILURES and len(self._backends) > 1:
+                backend.ejected_until = time.monotonic() + TTS_EJECT_SECONDS
+                logger.warning(f"TTS backend {backend.endpoint} ejected after {backend.consecutive_failures} failures")
+
+    def _probe(self, backend: _Backend) -> bool:
+        """Any HTTP response means the server is up; CosyVoice has no dedicated health route"""
+        try:
+            requests.get(backend.base_url, timeout=TTS_HEALTH_CHECK_TIMEOUT)
+            return True
+        except requests.RequestException:
+            return False
+
+    def check_health(self) -> None:
+        """Probe every backend due for a check: eject the ones down, readmit ejected ones back up"""
+        now = time.monotonic()
+        with self._lock:
+            due = [backend for backend in self._backends if backend.ejected_until <= now]
+        for backend in due:
+            is_up = self._probe(backend)
+            with self._lock:
+                if is_up and backend.ejected_until:
+                    logger.info(f"TTS backend {backend.endpoint} is back")
+                    backend.ejected_until = 0.0
+                    backend.consecutive_failures = 0
+                elif not is_up and not backend.is_ejected(time.monotonic()):
+                    logger.warning(f"TTS backend {backend.endpoint} failed its health check; ejected")
+                    backend.ejected_until = time.monotonic() + TTS_EJECT_SECONDS
+
+    def _health_check_loop(self) -> None:
+        while True:
+            time.sleep(TTS_HEALTH_CHECK_INTERVAL)
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.error(f"TTS health check failed: {e}")
+
+    def lane_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Requests waiting now, requests served and their wait for a backend slot, per lane"""
+        with self._lock:
+            return {
+                lane: {
+                    "waiting": len(self._waiting[lane]),
+                    "requests": stats["requests"],
+                    "avg_wait": round(stats["total_wait"] / stats["requests"], 3) if stats["requests"] else None,
+                    "max_wait": round(stats["max_wait"], 3),
+                }
+                for lane, stats in self._lane_stats.items()
+            }
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Outstanding requests, outcomes and average latency of every backend"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                backend.endpoint: {
+                    "healthy": not backend.is_ejected(now),
+                    "outstanding": backend.outstanding,
+                    "completed": backend.completed,
+                    "failed": backend.failed,
+                    "avg_latency": round(backend.total_seconds / (backend.completed + backend.failed), 2)
+                    if backend.completed + backend.failed else None,
+                }
+                for backend in self._backends
+            }
+
+
+_pools: Dict[Tuple[str, ...], BackendPool] = {}
+_pools_lock = Lock()
+
+
+def get_backend_pool(endpoints: List[str]) -> BackendPool:
+    """Get the process-wide pool for a set of endpoints, so concurrent jobs balance across the same backends"""
+    key = tuple(endpoints)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = BackendPool(endpoints)
+            logger.info(f"TTS backend pool: {', '.join(endpoints)}")
+        return _pools[key]
+
+
+def get_tts_stats() -> Dict[str, Dict[str, Any]]:
+    """Backend and lane stats of every pool, keyed by its comma-joined endpoints"""
+    with _pools_lock:
+        pools = dict(_pools)
+    return {",".join(key): {"backends": pool.stats(), "lanes": pool.lane_stats()} for key, pool in pools.items()}
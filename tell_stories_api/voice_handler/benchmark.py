@@ -0,0 +1,142 @@
+"""
+Benchmarks of the voice pipeline's local processing, without a CosyVoice server.
+
+    python -m tell_stories_api.voice_handler.benchmark response --seconds 30 120 600
+    python -m tell_stories_api.voice_handler.benchmark mp4 --minutes 60
+"""
+import argparse
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List
+import numpy as np
+import soundfile as sf
+from .assembler import render_mp4
+from .utils import TTS_SAMPLE_RATE, get_audio_duration, stream_audio_to_wav
+
+
+class FakeResponse:
+    """Stands in for a streamed CosyVoice response: raw 16-bit PCM served in chunks"""
+
+    def __init__(self, pcm: bytes):
+        self.pcm = pcm
+
+    def iter_content(self, chunk_size: int) -> Iterator[bytes]:
+        for start in range(0, len(self.pcm), chunk_size):
+            yield self.pcm[start:start + chunk_size]
+
+
+def save_response_legacy(response: FakeResponse, output_path: str) -> int:
+    """The previous handling: concatenate every chunk, copy into a tensor and save with torchaudio"""
+    tts_audio = b''
+    for r in response.iter_content(chunk_size=16000):
+        tts_audio += r
+    samples = np.array(np.frombuffer(tts_audio, dtype=np.int16))
+    try:
+        import torch
+        import torchaudio
+        torchaudio.save(output_path, torch.from_numpy(samples).unsqueeze(dim=0), TTS_SAMPLE_RATE)
+    except ImportError:
+        # torch is no longer a dependency; keep the copies but save with soundfile
+        sf.write(output_path, samples, TTS_SAMPLE_RATE, subtype='PCM_16')
+    return len(samples)
+
+
+def _measure(fn: Callable[[], int]) -> Dict[str, float]:
+    tracemalloc.start()
+    started_at = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - started_at
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": seconds, "peak_mb": peak / 1024 / 1024}
+
+
+def benchmark_response_handling(durations: List[float]) -> None:
+    """Compare time and peak memory of saving TTS responses of the given audio durations"""
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{'audio (s)':>10} {'method':>10} {'time (s)':>10} {'peak (MB)':>10}")
+        for duration in durations:
+            pcm = rng.integers(-8000, 8000, int(duration * TTS_SAMPLE_RATE), dtype=np.int16).tobytes()
+            for name, fn in (("legacy", save_response_legacy), ("streaming", stream_audio_to_wav)):
+                output_path = str(Path(tmp_dir) / f"{name}.wav")
+                result = _measure(lambda: fn(FakeResponse(pcm), output_path))
+                print(f"{duration:>10.0f} {name:>10} {result['seconds']:>10.3f} {result['peak_mb']:>10.1f}")
+
+
+def render_mp4_legacy(audio_path: Path, subtitles_path: Path, output_path: Path) -> None:
+    """The previous rendering: ffprobe, a full 1080p black video, then a second encode burning the subtitles"""
+    duration = get_audio_duration(audio_path)
+    temp_video = output_path.with_name("temp_video.mp4")
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", f"color=c=black:s=1920x1080:d={duration}",
+        "-c:v", "libx264", "-tune", "stillimage", "-pix_fmt", "yuv420p",
+        str(temp_video)
+    ], check=True)
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error", "-i", str(temp_video),
+        "-i", str(audio_path),
+        "-vf", f"subtitles={subtitles_path}",
+        "-c:a", "copy",
+        "-c:v", "libx264", "-crf", "23",
+        str(output_path)
+    ], check=True)
+    temp_video.unlink()
+
+
+def _write_test_subtitles(subtitles_path: Path, duration: float, line_seconds: float = 5.0) -> None:
+    def timestamp(seconds: float) -> str:
+        return f"{int(seconds // 3600):02d}:{int(seconds % 3600 // 60):02d}:{int(seconds % 60):02d},{int(seconds * 1000 % 1000):03d}"
+
+    with open(subtitles_path, "w", encoding='utf-8') as f:
+        for index, start in enumerate(np.arange(0, duration, line_seconds), start=1):
+            f.write(f"{index}\n{timestamp(start)} --> {timestamp(min(start + line_seconds, duration))}\n")
+            f.write(f"Narrator: Line {index} of the benchmark narration.\n\n")
+
+
+def benchmark_mp4_rendering(minutes: float) -> None:
+    """Compare the render time of the MP4 for an audio input of the given length"""
+    duration = minutes * 60
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audio_path = Path(tmp_dir) / "final_output.m4a"
+        subtitles_path = Path(tmp_dir) / "subtitles.srt"
+        subprocess.run([
+            "ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate={TTS_SAMPLE_RATE}:duration={duration}",
+            "-c:a", "aac", "-b:a", "256k", str(audio_path)
+        ], check=True)
+        _write_test_subtitles(subtitles_path, duration)
+
+        print(f"{'method':>16} {'time (s)':>10} {'size (MB)':>10}")
+        for name, fn in (
+            ("legacy", lambda output_path: render_mp4_legacy(audio_path, subtitles_path, output_path)),
+            ("single-pass soft", lambda output_path: render_mp4(audio_path, subtitles_path, output_path)),
+            ("single-pass burn", lambda output_path: render_mp4(audio_path, subtitles_path, output_path, burn_subtitles=True)),
+        ):
+            output_path = Path(tmp_dir) / f"{name.replace(' ', '_')}.mp4"
+            started_at = time.perf_counter()
+            fn(output_path)
+            seconds = time.perf_counter() - started_at
+            print(f"{name:>16} {seconds:>10.1f} {output_path.stat().st_size / 1024 / 1024:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    response_parser = subparsers.add_parser("response", help="Saving a streamed TTS response to WAV")
+    response_parser.add_argument("--seconds", type=float, nargs="+", default=[30, 120, 600],
+                                 help="Audio durations of the simulated narration lines")
+    mp4_parser = subparsers.add_parser("mp4", help="Rendering the MP4 with subtitles (needs ffmpeg)")
+    mp4_parser.add_argument("--minutes", type=float, default=60, help="Length of the audio input")
+    args = parser.parse_args()
+
+    if args.benchmark == "response":
+        benchmark_response_handling(args.seconds)
+    elif args.benchmark == "mp4":
+        benchmark_mp4_rendering(args.minutes)
+
+
+if __name__ == "__main__":
+    main()
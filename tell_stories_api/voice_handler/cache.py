@@ -0,0 +1,147 @@
+import hashlib
+import os
+import shutil
+import uuid
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional, Tuple
+from tell_stories_api.logs import logger
+from .utils import to_absolute_path
+
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", "data/cache/tts"))
+# Size cap of the cache; least recently used segments are evicted beyond it
+TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", 2048))
+# Evict down to this fraction of the cap so eviction does not run on every write
+TTS_CACHE_EVICT_TO = 0.9
+
+_file_hashes: Dict[Tuple[str, int, int], str] = {}
+_file_hashes_lock = Lock()
+
+
+def get_file_hash(path: str) -> str:
+    """Get the sha256 of a file's content, memoized by path, size and mtime"""
+    abs_path = Path(to_absolute_path(path))
+    stat = abs_path.stat()
+    key = (str(abs_path), stat.st_size, stat.st_mtime_ns)
+    with _file_hashes_lock:
+        if key in _file_hashes:
+            return _file_hashes[key]
+    digest = hashlib.sha256(abs_path.read_bytes()).hexdigest()
+    with _file_hashes_lock:
+        _file_hashes[key] = digest
+    return digest
+
+
+def get_segment_key(text: str, mode: str, instruct_or_prompt_text: str, prompt_wav: str, sample_rate: int) -> str:
+    """
+    Get the cache key of a synthesized segment.
+
+    Args:
+        text (str): The line text
+        mode (str): The CosyVoice endpoint mode (instruct2 or zero_shot)
+        instruct_or_prompt_text (str): The instruct text in instruct2 mode, the prompt text in zero_shot mode
+        prompt_wav (str): Path of the VA's prompt audio, keyed by content so renames keep their hits
+        sample_rate (int): The sample rate of the saved audio
+    """
+    digest = hashlib.sha256()
+    for part in (text, mode, instruct_or_prompt_text, get_file_hash(prompt_wav), str(sample_rate)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SegmentCache:
+    """
+    Content-addressed store of synthesized segments shared across runs and processes.
+    Hits are hard-linked (or copied across file systems) into the output directory.
+    """
+
+    def __init__(self, cache_dir: Path = TTS_CACHE_DIR, max_mb: float = TTS_CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = Lock()
+        self._size: Optional[int] = None
+
+    def _get_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.wav"
+
+    def get(self, key: str, output_path: Path) -> bool:
+        """Place the cached segment at output_path. Returns False on a miss."""
+        cached_path = self._get_path(key)
+        try:
+            output_path.unlink(missing_ok=True)
+            try:
+                os.link(cached_path, output_path)
+            except OSError:
+                shutil.copyfile(cached_path, output_path)
+            # Mark as recently used for the LRU eviction
+            os.utime(cached_path)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"Failed to read TTS cache entry {cached_path}: {e}")
+            return False
+
+    def lookup(self, key: str) -> Optional[Path]:
+        """Get the path of a cached segment to read in place, marked as recently used. Returns None on a miss."""
+        cached_path = self._get_path(key)
+        try:
+            os.utime(cached_path)
+            return cached_path
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, source_path: Path) -> None:
+        """Store a synthesized segment, copied so later writes to source_path cannot alter it"""
+        cached_path = self._get_path(key)
+        if cached_path.exists():
+            return
+        try:
+            cached_path.parent.mkdir(parents=True, exist_ok=True)
+            # Copy then rename, so concurrent readers never see a partial file
+            tmp_path = cached_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, cached_path)
+        except OSError as e:
+            logger.warning(f"Failed to store TTS cache entry {cached_path}: {e}")
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += cached_path.stat().st_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _scan_size(self) -> int:
+        return sum(path.stat().st_size for path in self.cache_dir.glob("*/*.wav"))
+
+    def _evict(self) -> None:
+        """Delete the least recently used segments until below the cap. Must hold self._lock."""
+        entries = []
+        for path in self.cache_dir.glob("*/*.wav"):
+            try:
+                stat = path.stat()
+                entries.append((stat.st_mtime, stat.st_size, path))
+            except OSError:
+                continue
+        entries.sort()
+        size = sum(entry_size for _, entry_size, _ in entries)
+        target = self.max_bytes * TTS_CACHE_EVICT_TO
+        evicted = 0
+        for _, entry_size, path in entries:
+            if size <= target:
+                break
+            try:
+                path.unlink()
+                size -= entry_size
+                evicted += 1
+            except OSError:
+                continue
+        self._size = size
+        logger.info(f"TTS cache: evicted {evicted} segments, {size / 1024 / 1024:.1f} MB left")
+
+
+segment_cache = SegmentCache()
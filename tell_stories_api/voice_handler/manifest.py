@@ -0,0 +1,78 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional
+import soundfile as sf
+from tell_stories_api.logs import logger
+
+MANIFEST_FILE = "manifest.jsonl"
+# Allowed difference between the recorded and the actual duration of a segment
+DURATION_TOLERANCE_SECONDS = 0.01
+
+
+def get_line_key(line: dict, cast_info: dict) -> str:
+    """Hash of everything that determines a line's audio, to tell whether a stored segment is still valid"""
+    digest = hashlib.sha256()
+    for part in (line["line"], line["instruct"], cast_info.get("va_name"), cast_info.get("prompt_wav"), cast_info.get("prompt_text")):
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SegmentManifest:
+    """
+    Append-only record of the segments completed in an output directory (index, line key, duration),
+    so an interrupted job can resume with only the missing or failed lines.
+    """
+
+    def __init__(self, output_dir: Path, resume: bool):
+        self.output_dir = output_dir
+        self.path = output_dir / MANIFEST_FILE
+        self.segments: Dict[int, Dict[str, Any]] = {}
+        if resume:
+            self._load()
+        else:
+            self.path.write_text("", encoding='utf-8')
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for row in f:
+                try:
+                    entry = json.loads(row)
+                except json.JSONDecodeError:
+                    # A line cut short by the interruption
+                    continue
+                self.segments[entry["index"]] = entry
+        logger.info(f"Loaded {len(self.segments)} completed segments from {self.path}")
+
+    def get_valid(self, index: int, key: str) -> Optional[Dict[str, Any]]:
+        """Get the manifest entry of a segment if it was made from the same line and its WAV is intact"""
+        entry = self.segments.get(index)
+        if not entry or entry["key"] != key:
+            return None
+        wav_path = self.output_dir / entry["file"]
+        try:
+            if wav_path.stat().st_size != entry["size"]:
+                return None
+            if abs(sf.info(wav_path).duration - entry["duration"]) > DURATION_TOLERANCE_SECONDS:
+                return None
+        except Exception:
+            return None
+        return entry
+
+    def record(self, index: int, key: str, wav_path: Path, duration: float, character: str, is_fallback: bool) -> None:
+        """Record a completed segment. Callers serialize calls."""
+        entry = {
+            "index": index,
+            "key": key,
+            "file": wav_path.name,
+            "size": wav_path.stat().st_size,
+            "duration": duration,
+            "character": character,
+            "is_fallback": is_fallback,
+        }
+        self.segments[index] = entry
+        with open(self.path, "a", encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
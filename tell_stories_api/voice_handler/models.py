@@ -1,13 +1,48 @@
-from pydantic import BaseModel
-from typing import Dict, Optional, Any
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional, Any
 import os
 from dotenv import load_dotenv
 load_dotenv()
+from .backends import get_env_endpoints
 
 class VoiceRequest(BaseModel):
     host: str = os.getenv("COSYVOICE2_HOST")
     port: int = os.getenv("COSYVOICE2_PORT")
     save_mp4_with_subtitles: bool = False
+    burn_subtitles: bool = False  # Burn the subtitles into the MP4 video instead of a soft subtitle track
+    concurrency: int = int(os.getenv("COSYVOICE2_CONCURRENCY", 4))  # Lines synthesized at once
+    endpoints: Optional[List[str]] = None  # CosyVoice backends (host:port or URL) to balance lines across
+    use_cache: bool = True  # Reuse segments synthesized before with the same text, instruct and voice
+    resume: bool = False  # Keep the valid segments of a previous run in output/<process_id>, synthesize the rest
+    # Order lines are sent to TTS: in script order, or grouped by voice actor so backends keep reusing
+    # the same speaker prompt. The output is in script order either way.
+    schedule: Literal["interleaved", "group_by_voice"] = "interleaved"
+    # Long lines are synthesized as concurrent sentence-sized requests joined by a short silence
+    split_long_lines: bool = True
+    sentence_max_chars: int = Field(int(os.getenv("TTS_SENTENCE_MAX_CHARS", 120)), ge=20, validate_default=True)
+    sentence_gap_ms: int = Field(int(os.getenv("TTS_SENTENCE_GAP_MS", 150)), ge=0, validate_default=True)
+    distributed: bool = False  # Synthesize batches of lines as units on the shared work board, with other nodes
+
+    def get_endpoints(self) -> List[str]:
+        """Backends to use: endpoints, else an explicit host/port, else COSYVOICE2_ENDPOINTS, else the default host/port"""
+        if self.endpoints:
+            return self.endpoints
+        if not {"host", "port"} & self.model_fields_set:
+            env_endpoints = get_env_endpoints()
+            if env_endpoints:
+                return env_endpoints
+        return [f"{self.host}:{self.port}"]
+
+class StreamRequest(VoiceRequest):
+    """Voice generation fed by the lines generation as each story part completes"""
+    story_path: Optional[str] = None  # Runs the script pipeline first when a story is given
+    text_input: Optional[str] = None
+    book_id: Optional[str] = None
+    split_dialogue: bool = True
+    all_caps_to_proper: bool = True
+    throughput_mode: bool = False
+    max_tokens_budget: Optional[int] = None
+    normalize_instructs: bool = True  # Map instructs onto the canonical vocabulary for more TTS cache reuse
 
 class VoiceResponse(BaseModel):
     status: str
@@ -23,9 +58,19 @@ class ProgressData(BaseModel):
     failed_count: int
     narrator_success_count: int
     narrator_failed_count: int
-    status: str  # 'processing', 'completed', 'failed'
+    status: str  # 'queued', 'processing', 'completed', 'budget_exceeded', 'failed', 'interrupted'
     output_path: Optional[str] = None
     error: Optional[str] = None
+    # Timing: time_to_first_audio, wall_clock_seconds, tts_seconds; streaming jobs add script_seconds
+    # and sequential_estimate_seconds, the time the same job takes when lines.json must be done first.
+    # Segment cache: cache_hits, cache_misses and cache_hit_rate
+    # Scheduling: schedule, lines_per_minute, voice_switches (voice changes in the order sent to TTS)
+    # and split_lines (long lines synthesized sentence by sentence)
+    metrics: Optional[Dict[str, Any]] = None
+    # Per CosyVoice backend: lines, failed, seconds and lines_per_minute of this job
+    backends: Optional[Dict[str, Dict[str, Any]]] = None
+    # State of the job in the queue: id, kind, state, attempts, worker_id, error
+    job: Optional[Dict[str, Any]] = None
 
 class VoiceCastResponse(BaseModel):
     status: str
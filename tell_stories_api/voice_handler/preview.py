@@ -0,0 +1,106 @@
+import os
+import uuid
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Dict, Optional, Tuple
+from tell_stories_api.logs import logger
+from .cache import SegmentCache, get_segment_key
+from .processor import VoiceProcessor
+from .utils import TTS_SAMPLE_RATE, load_va_database
+
+PREVIEW_CACHE_DIR = Path(os.getenv("PREVIEW_CACHE_DIR", "data/cache/preview"))
+# Size cap of the preview cache; least recently played previews are evicted beyond it
+PREVIEW_CACHE_MAX_MB = float(os.getenv("PREVIEW_CACHE_MAX_MB", 256))
+# Render DEFAULT_PREVIEW_TEXT for every VA in the background when the app starts
+PREVIEW_PREWARM = os.getenv("PREVIEW_PREWARM", "false").lower() == "true"
+# Default text of the voice tab's preview box: without a {character} placeholder, so it is the same
+# for every character and pre-warmed previews are hits
+DEFAULT_PREVIEW_TEXT = "Hello there. This is how I sound when I tell your story, generated by tell stories dot AI."
+PREVIEW_INSTRUCT = "normal"
+
+preview_cache = SegmentCache(PREVIEW_CACHE_DIR, PREVIEW_CACHE_MAX_MB)
+# At most one pre-warm runs at a time: a second one would render the same previews concurrently
+_prewarm_lock = Lock()
+_prewarm_running = False
+
+
+def get_preview(va_meta: Dict, text: str, instruct_text: str = PREVIEW_INSTRUCT,
+                lane: str = "interactive") -> Tuple[Optional[Path], bool]:
+    """
+    Get the preview of a VA saying a text, synthesized once per VA prompt audio, text and instruct.
+
+    Args:
+        va_meta (Dict): The VA's meta.json
+        text (str): The preview text
+        instruct_text (str): The instruct of the preview
+        lane (str): The TTS priority lane on a miss
+
+    Returns:
+        Tuple[Optional[Path], bool]: The cached preview, None if synthesis failed, and whether it was a cache hit
+    """
+    key = get_segment_key(text, "instruct2", instruct_text, va_meta["prompt_wav"], TTS_SAMPLE_RATE)
+    cached_path = preview_cache.lookup(key)
+    if cached_path:
+        return cached_path, True
+
+    # Synthesized under a unique name: concurrent previews of the same content never share a file
+    PREVIEW_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = PREVIEW_CACHE_DIR / f"{key}.{uuid.uuid4().hex}.tmp.wav"
+    try:
+        if not VoiceProcessor().synthesize_preview(text, va_meta["prompt_wav"], tmp_path, instruct_text, lane=lane):
+            return None, False
+        preview_cache.put(key, tmp_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return preview_cache.lookup(key), False
+
+
+def prewarm_previews(text: str = DEFAULT_PREVIEW_TEXT) -> int:
+    """
+    Render the preview of every VA in the bulk lane, so it never delays an interactive preview.
+
+    Returns:
+        int: The number of previews synthesized, cached ones excluded
+    """
+    synthesized = 0
+    for va_meta in load_va_database():
+        if not va_meta.get("prompt_wav"):
+            continue
+        try:
+            path, cache_hit = get_preview(va_meta, text, lane="bulk")
+        except Exception as e:
+            logger.warning(f"Failed to pre-warm the preview of {va_meta.get('va_name')}: {e}")
+            continue
+        synthesized += int(path is not None and not cache_hit)
+    logger.info(f"Pre-warmed voice previews: {synthesized} synthesized")
+    return synthesized
+
+
+def _run_prewarm() -> None:
+    global _prewarm_running
+    try:
+        prewarm_previews()
+    finally:
+        with _prewarm_lock:
+            _prewarm_running = False
+
+
+def start_prewarm_previews() -> bool:
+    """
+    Start pre-warming the previews in a background thread, unless a pre-warm is already running.
+
+    Returns:
+        bool: Whether a pre-warm was started
+    """
+    global _prewarm_running
+    with _prewarm_lock:
+        if _prewarm_running:
+            return False
+        _prewarm_running = True
+    try:
+        Thread(target=_run_prewarm, name="preview-prewarm", daemon=True).start()
+    except Exception:
+        with _prewarm_lock:
+            _prewarm_running = False
+        raise
+    return True
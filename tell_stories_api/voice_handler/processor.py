@@ -1,15 +1,31 @@
 from pathlib import Path
-import torch
-import torchaudio
 import soundfile as sf
-from .models import VoiceRequest, ProgressData
-from .utils import generate_audio, generate_audio_instruct, get_audio_duration, load_va_database
+from .models import VoiceRequest, StreamRequest, ProgressData
+from .assembler import render_mp4, start_assembler, stitch_segments
+from .backends import BackendPool, TTS_MAX_ATTEMPTS, get_backend_pool
+from .cache import get_segment_key, segment_cache
+from .manifest import SegmentManifest, get_line_key
+from .sentences import split_for_tts
+from .utils import TTS_SAMPLE_RATE, generate_audio, generate_audio_instruct, load_va_database
+from tell_stories_api.jobs.job_queue import JobCancelledError
 from tell_stories_api.logs import logger
 import json
+import os
+import shutil
 import subprocess
-from datetime import datetime
+import time
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from queue import Queue
+from threading import Condition, Event, Lock, Thread
+from typing import Dict, List, NamedTuple, Optional, Tuple
 from tqdm import tqdm
 
+def get_output_dir(process_id: str) -> Path:
+    """Get the output directory of a process's voice generation"""
+    return Path("output") / process_id
+
 class VoiceProcessor:
     def process_cast_file(self, process_dir: Path) -> dict:
         with open(process_dir / "cast.json", encoding='utf-8') as f:
@@ -38,7 +54,7 @@ class VoiceProcessor:
         
         return cast_dict
 
-    def process_voice_generation(self, request: VoiceRequest, process_dir: Path):
+    def process_voice_generation(self, request: VoiceRequest, process_dir: Path, cancel: Optional[Event] = None) -> ProgressData:
         progress_file = process_dir / "voice_progress.json"
         try:
             # Initialize progress data
@@ -49,7 +65,8 @@ class VoiceProcessor:
                 failed_count=0,
                 narrator_success_count=0,
                 narrator_failed_count=0,
-                status="processing"
+                status="processing",
+                metrics={"mode": "sequential"}
             )
             
             # Load required files
@@ -69,9 +86,8 @@ class VoiceProcessor:
             with open(progress_file, 'w', encoding='utf-8') as f:
                 json.dump(progress_data.model_dump(), f)
 
-            # Setup output directory
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_dir = Path("output") / timestamp
+            # Setup output directory, stable per process so an interrupted job can resume
+            output_dir = get_output_dir(process_dir.name)
             output_dir.mkdir(parents=True, exist_ok=True)
             progress_data.output_path = str(output_dir)
             
@@ -82,12 +98,16 @@ class VoiceProcessor:
                 cast_dict=cast_dict,
                 output_dir=output_dir,
                 progress_data=progress_data,
-                progress_file=progress_file
+                progress_file=progress_file,
+                cancel=cancel
             )
             
             # On successful completion
             progress_data.status = "completed"
             
+        except JobCancelledError:
+            # Another attempt of the job owns the progress now
+            raise
         except Exception as e:
             progress_data.status = "failed"
             progress_data.error = str(e)
@@ -96,189 +116,275 @@ class VoiceProcessor:
         # Save final progress
         with open(progress_file, 'w', encoding='utf-8') as f:
             json.dump(progress_data.model_dump(), f)
+        return progress_data
 
     def _generate_audio_files(self, request: VoiceRequest, lines_data: dict, cast_dict: dict, 
-                            output_dir: Path, progress_data: ProgressData, progress_file: Path):
-        file_list = []
-        subtitle_data = []
-        current_time = 0.0
-        
-        for i, line in tqdm(enumerate(lines_data["lines"]), total=len(lines_data["lines"])):
-            character = line["character"]
-            if character in cast_dict:
-                cast_info = cast_dict[character]
-                output_path = output_dir / f"{i:05d}.wav"
-                file_list.append(output_path)
-                
-                instruct_text = line["instruct"]
-                if instruct_text != "normal":
-                    url = f"http://{request.host}:{request.port}/inference_instruct2"
-                    success_flag = generate_audio_instruct(
-                        url=url,
-                        text=line["line"],
-                        instruct_text=instruct_text,
-                        prompt_wav=cast_info["prompt_wav"],
-                        output_path=output_path
-                    )
-                else:
-                    url = f"http://{request.host}:{request.port}/inference_zero_shot"
-                    success_flag = generate_audio(
-                        url=url,
-                        text=line["line"],
-                        prompt_text=cast_info["prompt_text"],
-                        prompt_wav=cast_info["prompt_wav"],
-                        output_path=output_path
-                    )
-
-                current_time = self._update_progress_and_subtitles(
-                    success_flag=success_flag,
-                    output_path=output_path,
-                    character=character,
-                    line=line,
-                    current_time=current_time,
-                    progress_data=progress_data,
-                    subtitle_data=subtitle_data,
-                    progress_file=progress_file
-                )
-            else:
-                current_time = self._handle_narrator_fallback(
-                    request=request,
-                    cast_dict=cast_dict,
-                    line=line,
-                    i=i,
-                    output_dir=output_dir,
-                    file_list=file_list,
-                    current_time=current_time,
-                    subtitle_data=subtitle_data,
-                    progress_data=progress_data,
-                    progress_file=progress_file
-                )
+                            output_dir: Path, progress_data: ProgressData, progress_file: Path, cancel: Optional[Event] = None):
+        started_at = time.monotonic()
+        synthesis = OrderedSynthesis(self, request, cast_dict, output_dir, progress_data, progress_file, started_at, cancel)
+        synthesis.submit(lines_data["lines"])
+        file_list, subtitle_data, assembled = synthesis.close()
 
         self._create_final_output(
             output_dir=output_dir,
             file_list=file_list,
             subtitle_data=subtitle_data,
-            request=request
+            request=request,
+            assembled=assembled
         )
+        progress_data.metrics["wall_clock_seconds"] = round(time.monotonic() - started_at, 2)
 
-    def _update_progress_and_subtitles(
-        self, 
-        success_flag: bool,
-        output_path: Path,
-        character: str,
-        line: dict,
-        current_time: float,
-        progress_data: ProgressData,
-        subtitle_data: list,
-        progress_file: Path
-    ) -> float:
-        """Update progress data and subtitle information after generating an audio file"""
-        if success_flag:
-            progress_data.success_count += 1
-            audio_info = sf.info(output_path)
-            duration = audio_info.duration
-            subtitle_data.append({
-                'index': len(subtitle_data) + 1,
-                'start': current_time,
-                'end': current_time + duration,
-                'character': character,
-                'text': line["line"]
-            })
-            current_time += duration
-        else:
-            progress_data.failed_count += 1
-        
-        # Update progress
-        progress_data.processed_lines += 1
-        with open(progress_file, 'w', encoding='utf-8') as f:
-            json.dump(progress_data.model_dump(), f)
-            
-        return current_time
-
-    def _handle_narrator_fallback(
-        self,
-        request: VoiceRequest,
-        cast_dict: dict,
-        line: dict,
-        i: int,
-        output_dir: Path,
-        file_list: list,
-        current_time: float,
-        subtitle_data: list,
-        progress_data: ProgressData,
-        progress_file: Path
-    ) -> float:
-        """Handle cases where character is not found in cast_dict by using narrator"""
-        logger.warning(f"Character {line['character']} not found in cast_dict. Defaulting to normal instruct by the narrator.")
-        cast_info = cast_dict["Narrator"]
-        output_path = output_dir / f"{i:05d}.wav"
-        file_list.append(output_path)
+    def synthesize_line(self, request: VoiceRequest, cast_dict: dict, line: dict, output_path: Path,
+                        pool: BackendPool, lane: str = "bulk") -> "LineResult":
+        """
+        Generate the audio of one line: from the segment cache if it was synthesized before, else on
+        the least loaded backend of the pool, retrying a failed line on another backend.
+        lane is the pool's priority lane the TTS requests wait in.
+        """
+        character = line["character"]
+        is_fallback = character not in cast_dict
+        if is_fallback:
+            logger.warning(f"Character {character} not found in cast_dict. Defaulting to normal instruct by the narrator.")
+            character = "Narrator"
+        cast_info = cast_dict[character]
         instruct_text = line["instruct"]
-        
-        success_flag = False
-        if instruct_text != "normal":
-            url = f"http://{request.host}:{request.port}/inference_instruct2"
-            success_flag = generate_audio_instruct(
-                url=url,
-                text=line["line"],
-                instruct_text=instruct_text,
-                prompt_wav=cast_info["prompt_wav"],
-                output_path=output_path
+        is_instruct = instruct_text != "normal"
+
+        # Never write into a file hard-linked from the cache by a previous run
+        output_path.unlink(missing_ok=True)
+        cache_key = None
+        if request.use_cache:
+            try:
+                cache_key = get_segment_key(
+                    line["line"],
+                    "instruct2" if is_instruct else "zero_shot",
+                    instruct_text if is_instruct else cast_info["prompt_text"],
+                    cast_info["prompt_wav"],
+                    TTS_SAMPLE_RATE
+                )
+            except OSError as e:
+                logger.warning(f"Cannot cache line: {e}")
+            if cache_key and segment_cache.get(cache_key, output_path):
+                return LineResult(True, character, is_fallback, cache_hit=True)
+
+        tried = []
+        samples = 0
+        while not samples and len(tried) < TTS_MAX_ATTEMPTS:
+            backend = pool.acquire(exclude=tried, lane=lane)
+            if backend is None:
+                break
+            tried.append(backend.endpoint)
+            started_at = time.monotonic()
+            if is_instruct:
+                samples = generate_audio_instruct(
+                    url=f"{backend.base_url}/inference_instruct2",
+                    text=line["line"],
+                    instruct_text=instruct_text,
+                    prompt_wav=cast_info["prompt_wav"],
+                    output_path=output_path
+                )
+            else:
+                samples = generate_audio(
+                    url=f"{backend.base_url}/inference_zero_shot",
+                    text=line["line"],
+                    prompt_text=cast_info["prompt_text"],
+                    prompt_wav=cast_info["prompt_wav"],
+                    output_path=output_path
+                )
+            pool.release(backend, bool(samples), time.monotonic() - started_at)
+            if not samples:
+                logger.warning(f"Line failed on TTS backend {backend.endpoint}")
+
+        if samples and cache_key:
+            segment_cache.put(cache_key, output_path)
+        return LineResult(
+            bool(samples), character, is_fallback,
+            endpoint=tried[-1] if tried else None,
+            duration=samples / TTS_SAMPLE_RATE if samples else None
+        )
+
+    def synthesize_preview(self, text: str, prompt_wav: str, output_path: Path, instruct_text: str = "normal",
+                           lane: str = "interactive") -> bool:
+        """Synthesize a voice preview, by default in the interactive lane, ahead of the lines of running jobs"""
+        pool = get_backend_pool(VoiceRequest().get_endpoints())
+        backend = pool.acquire(lane=lane)
+        started_at = time.monotonic()
+        samples = generate_audio_instruct(
+            url=f"{backend.base_url}/inference_instruct2",
+            text=text,
+            instruct_text=instruct_text,
+            prompt_wav=prompt_wav,
+            output_path=output_path
+        )
+        pool.release(backend, bool(samples), time.monotonic() - started_at)
+        return bool(samples)
+
+    def regenerate_line(self, request: VoiceRequest, process_dir: Path, index: int) -> dict:
+        """
+        Synthesize a new take of one line in the regen lane, ahead of bulk synthesis. The segment is
+        recorded in the manifest, so a voice generation run with resume keeps it and rebuilds the final audio.
+        """
+        with open(process_dir / "voice_cast.json", encoding='utf-8') as f:
+            cast_dict = json.load(f)
+        with open(process_dir / "lines.json", encoding='utf-8') as f:
+            lines = json.load(f)["lines"]
+        if not 0 <= index < len(lines):
+            raise IndexError(f"Line {index} not found, the script has {len(lines)} lines")
+        line = lines[index]
+        output_dir = get_output_dir(process_dir.name)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        output_path = output_dir / f"{index:05d}.wav"
+
+        # A new take: never served from the segment cache
+        request = request.model_copy(update={"use_cache": False})
+        result = self.synthesize_line(request, cast_dict, line, output_path, get_backend_pool(request.get_endpoints()), lane="regen")
+        if not result.success:
+            raise Exception(f"Failed to regenerate line {index}")
+        duration = result.duration if result.duration is not None else sf.info(output_path).duration
+        SegmentManifest(output_dir, resume=True).record(
+            index, get_line_key(line, cast_dict[result.character]), output_path, duration, result.character, result.is_fallback
+        )
+        return {"index": index, "output_path": str(output_path), "duration": duration, "character": result.character}
+
+    def process_streaming_generation(self, request: StreamRequest, process_id: str, process_dir: Path,
+                                     cancel: Optional[Event] = None, start_tokens: Optional[int] = None) -> ProgressData:
+        """
+        Generate the lines and voice them in the same job: each story part is voiced, in story order,
+        as soon as it and all the parts before it are done, while later parts are still with the LLM.
+        Once cancel is set, stops with JobCancelledError. start_tokens is the baseline of the token budget.
+        """
+        # Imported here as the script service lazily imports the voice handler
+        from tell_stories_api.script_handler.service import ScriptService
+
+        progress_file = process_dir / "voice_progress.json"
+        started_at = time.monotonic()
+        progress_data = ProgressData(
+            total_lines=0,
+            processed_lines=0,
+            success_count=0,
+            failed_count=0,
+            narrator_success_count=0,
+            narrator_failed_count=0,
+            status="processing",
+            metrics={"mode": "streaming"}
+        )
+        part_queue = Queue()
+
+        def produce_lines():
+            try:
+                ScriptService.process_lines_background(
+                    process_id,
+                    request.split_dialogue,
+                    request.all_caps_to_proper,
+                    request.throughput_mode,
+                    request.max_tokens_budget,
+                    on_part=lambda index, lines: part_queue.put((index, lines)),
+                    normalize_instructs=request.normalize_instructs,
+                    cancel=cancel,
+                    start_tokens=start_tokens
+                )
+            except Exception as e:
+                part_queue.put((None, e))
+                return
+            part_queue.put((None, None))
+
+        try:
+            with open(process_dir / "voice_cast.json", encoding='utf-8') as f:
+                cast_dict = json.load(f)
+
+            with open(progress_file, 'w', encoding='utf-8') as f:
+                json.dump(progress_data.model_dump(), f)
+
+            output_dir = get_output_dir(process_id)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            progress_data.output_path = str(output_dir)
+
+            Thread(target=produce_lines, daemon=True).start()
+
+            synthesis = OrderedSynthesis(self, request, cast_dict, output_dir, progress_data, progress_file, started_at, cancel)
+            pending_parts = {}
+            next_part = 0
+
+            try:
+                while True:
+                    index, payload = part_queue.get()
+                    if index is None:
+                        if isinstance(payload, Exception):
+                            raise payload
+                        break
+                    pending_parts[index] = payload
+                    while next_part in pending_parts:
+                        synthesis.submit(pending_parts.pop(next_part))
+                        next_part += 1
+
+                progress_data.metrics["script_seconds"] = round(time.monotonic() - started_at, 2)
+            except Exception:
+                synthesis.close(abort=True)
+                raise
+            file_list, subtitle_data, assembled = synthesis.close()
+
+            assembly_started_at = time.monotonic()
+            self._create_final_output(
+                output_dir=output_dir,
+                file_list=file_list,
+                subtitle_data=subtitle_data,
+                request=request,
+                assembled=assembled
             )
-        else:
-            url = f"http://{request.host}:{request.port}/inference_zero_shot"
-            success_flag = generate_audio(
-                url=url,
-                text=line["line"],
-                prompt_text=cast_info["prompt_text"],
-                prompt_wav=cast_info["prompt_wav"],
-                output_path=output_path
+
+            # The sequential flow voices nothing until every line is generated. Its voice phase is estimated
+            # by the wall-clock time this job had lines in synthesis, on the same concurrency
+            metrics = progress_data.metrics
+            metrics["wall_clock_seconds"] = round(time.monotonic() - started_at, 2)
+            metrics["voice_seconds"] = round(synthesis.busy_seconds, 2)
+            metrics["sequential_estimate_seconds"] = round(
+                metrics["script_seconds"] + synthesis.busy_seconds + time.monotonic() - assembly_started_at, 2
             )
-        
-        if success_flag:
-            progress_data.narrator_success_count += 1
-            audio_info = sf.info(output_path)
-            duration = audio_info.duration
-            subtitle_data.append({
-                'index': len(subtitle_data) + 1,
-                'start': current_time,
-                'end': current_time + duration,
-                'character': "Narrator",
-                'text': line["line"]
-            })
-            current_time += duration
-        else:
-            progress_data.narrator_failed_count += 1
-        
-        # Update progress
-        progress_data.processed_lines += 1
-        with open(progress_file, 'w', encoding='utf-8') as f:
+            metrics["saved_seconds_estimate"] = round(metrics["sequential_estimate_seconds"] - metrics["wall_clock_seconds"], 2)
+            with open(process_dir / "script_progress.json", encoding='utf-8') as f:
+                lines_state = json.load(f).get("state")
+            if lines_state == "budget_exceeded":
+                # The token budget skipped story part next_part: the audio stops at the last part before it
+                progress_data.status = "budget_exceeded"
+                progress_data.error = (f"Token budget exceeded: story part {next_part} was not generated, so the audio "
+                                       f"stops before it and {len(pending_parts)} later generated parts were not voiced.")
+            else:
+                progress_data.status = "completed"
+
+        except JobCancelledError:
+            raise
+        except Exception as e:
+            progress_data.status = "failed"
+            progress_data.error = str(e)
+            logger.error(f"Error in streaming voice generation: {str(e)}")
 
+        with open(progress_file, 'w', encoding='utf-8') as f:
             json.dump(progress_data.model_dump(), f)
-            
-        return current_time
+        return progress_data
 
     def _create_final_output(
         self,
         output_dir: Path,
         file_list: list,
         subtitle_data: list,
-        request: VoiceRequest
+        request: VoiceRequest,
+        assembled: bool = False
     ):
-        """Create final output files including audio and subtitles"""
-        # Create file list for ffmpeg
-        with open(output_dir / "files.txt", "w", encoding='utf-8') as f:
-            for file_path in file_list:
-                if file_path.exists():  # Only include successfully generated files
-                    f.write(f"file '{file_path.name}'\n")
-        
-        # Generate M4A file
-        subprocess.run([
-            "ffmpeg", "-f", "concat", "-safe", "0",
-            "-i", str(output_dir / "files.txt"),
-            "-c:a", "aac", "-b:a", "256k",
-            str(output_dir / "final_output.m4a")
-        ])
+        """Create final output files including audio and subtitles. The M4A is only built here if it was not assembled during synthesis."""
+        if not assembled:
+            # Create file list for ffmpeg
+            with open(output_dir / "files.txt", "w", encoding='utf-8') as f:
+                for file_path in file_list:
+                    if file_path.exists():  # Only include successfully generated files
+                        f.write(f"file '{file_path.name}'\n")
+            
+            # Generate M4A file
+            subprocess.run([
+                "ffmpeg", "-y", "-f", "concat", "-safe", "0",
+                "-i", str(output_dir / "files.txt"),
+                "-c:a", "aac", "-b:a", "256k",
+                str(output_dir / "final_output.m4a")
+            ])
         
         # Generate SRT subtitle file
         with open(output_dir / "subtitles.srt", "w", encoding='utf-8') as f:
@@ -302,30 +408,371 @@ class VoiceProcessor:
         
         # Create MP4 with subtitles if requested
         if request.save_mp4_with_subtitles:
-            logger.info("Creating MP4 with embedded subtitles...")
+            logger.info("Creating MP4 with subtitles...")
             try:
-                duration = get_audio_duration(output_dir / "final_output.m4a")
-                
-                # Create black video
-                subprocess.run([
-                    "ffmpeg", "-f", "lavfi", "-i", f"color=c=black:s=1920x1080:d={duration}",
-                    "-c:v", "libx264", "-tune", "stillimage", "-pix_fmt", "yuv420p",
-                    str(output_dir / "temp_video.mp4")
-                ])
-                
-                # Add audio and subtitles
-                subprocess.run([
-                    "ffmpeg", "-i", str(output_dir / "temp_video.mp4"),
-                    "-i", str(output_dir / "final_output.m4a"),
-                    "-vf", f"subtitles={output_dir / 'subtitles.srt'}",
-                    "-c:a", "copy",
-                    "-c:v", "libx264", "-crf", "23",
-                    str(output_dir / "final_output.mp4")
-                ])
-                
-                # Clean up temporary video file
-                (output_dir / "temp_video.mp4").unlink()
-                
+                render_mp4(
+                    audio_path=output_dir / "final_output.m4a",
+                    subtitles_path=output_dir / "subtitles.srt",
+                    output_path=output_dir / "final_output.mp4",
+                    burn_subtitles=request.burn_subtitles
+                )
             except Exception as e:
                 logger.error(f"Error creating MP4 with subtitles: {e}")
 
+
+class LineResult(NamedTuple):
+    """Outcome of synthesizing one line"""
+    success: bool
+    character: str  # The character voicing the line, Narrator when standing in
+    is_fallback: bool = False  # Whether the narrator stood in for a character missing from the cast
+    endpoint: Optional[str] = None  # Backend of the last attempt, None on a cache hit
+    cache_hit: bool = False
+    seconds: float = 0.0
+    resumed: bool = False  # Kept from an interrupted run of the job
+    deduplicated: bool = False  # Copied from an identical line of the job
+    duration: Optional[float] = None  # Audio duration, counted while writing; read from the file for cache hits
+
+
+class OrderedSynthesis:
+    """
+    Synthesize lines on a bounded thread pool (VoiceRequest.concurrency) while keeping the story order:
+    progress is updated as lines complete, and file_list and subtitles are extended only once
+    every earlier line is done. Once cancel is set, lines not yet sent to TTS fail and close() raises
+    JobCancelledError.
+    """
+
+    def __init__(self, processor: VoiceProcessor, request: VoiceRequest, cast_dict: dict, output_dir: Path,
+                 progress_data: ProgressData, progress_file: Path, started_at: float, cancel: Optional[Event] = None):
+        self.processor = processor
+        self.request = request
+        self.cast_dict = cast_dict
+        self.output_dir = output_dir
+        self.progress_data = progress_data
+        self.progress_file = progress_file
+        self.started_at = started_at
+        self.cancel = cancel
+        self.pool = ThreadPoolExecutor(max_workers=max(1, request.concurrency), thread_name_prefix="tts")
+        self.backend_pool = get_backend_pool(request.get_endpoints())
+        self.manifest = SegmentManifest(output_dir, request.resume)
+        # Final audio encoded as lines are flushed in order; None falls back to ffmpeg concat at the end.
+        # Lines are handed, in story order, to a thread feeding the encoder, so completions never wait on it.
+        self.assembler = start_assembler(output_dir / "final_output.m4a")
+        self.assemble_queue: Queue = Queue()
+        self.assembler_thread = None
+        if self.assembler:
+            self.assembler_thread = Thread(target=self._run_assembler, name="assembler", daemon=True)
+            self.assembler_thread.start()
+        self.lock = Lock()
+        self.all_done = Condition(self.lock)
+        self.submitted = 0
+        self.completed = 0
+        # Wall-clock time with lines in synthesis, waits for more lines to be submitted excluded
+        self.busy_seconds = 0.0
+        self.busy_since = None
+        # Lines of this job with the same voice, instruct and text are synthesized once:
+        # dedup key -> {"path": the first occurrence's output, "result": its result once done, "followers": [...]}
+        self.duplicates: Dict[Tuple[str, str, str], dict] = {}
+        self.next_flush = 0
+        self.results: Dict[int, Tuple[dict, Path, bool, str, Optional[float]]] = {}
+        self.file_list = []
+        self.subtitle_data = []
+        self.current_time = 0.0
+        self.pbar = tqdm(total=0, desc="Generating audio")
+        self.last_voice = None
+        progress_data.metrics["schedule"] = request.schedule
+
+    def submit(self, lines: List[dict]) -> None:
+        """Queue lines for synthesis, after every line submitted before"""
+        with self.lock:
+            first_index = self.submitted
+            if lines and self.completed >= self.submitted:
+                self.busy_since = time.monotonic()
+            self.submitted += len(lines)
+            self.progress_data.total_lines = max(self.progress_data.total_lines, self.submitted)
+            self.pbar.total += len(lines)
+            self.pbar.refresh()
+        to_synthesize = []
+        for index, line in enumerate(lines, start=first_index):
+            output_path = self.output_dir / f"{index:05d}.wav"
+            entry = self.manifest.get_valid(index, self._get_line_key(line)) if self.request.resume else None
+            if entry:
+                result = LineResult(True, entry["character"], entry["is_fallback"], resumed=True, duration=entry["duration"])
+                with self.lock:
+                    self.duplicates.setdefault(self._get_dedup_key(line), {"path": output_path, "result": result, "followers": []})
+                self._complete(index, line, output_path, result)
+                continue
+            to_synthesize.append((index, line, output_path))
+
+        if self.request.schedule == "group_by_voice":
+            # Send each voice's lines back to back, voices in order of first appearance,
+            # so backends keep reusing the same speaker prompt
+            voice_order = {}
+            for _, line, _ in to_synthesize:
+                voice_order.setdefault(self._get_voice(line), len(voice_order))
+            to_synthesize.sort(key=lambda item: voice_order[self._get_voice(item[1])])
+
+        for index, line, output_path in to_synthesize:
+            dedup_key = self._get_dedup_key(line)
+            with self.lock:
+                duplicate = self.duplicates.get(dedup_key)
+                if duplicate is None:
+                    self.duplicates[dedup_key] = {"path": output_path, "result": None, "followers": []}
+                elif duplicate["result"] is None:
+                    # Reused once the first occurrence is done
+                    duplicate["followers"].append((index, line, output_path))
+                    continue
+            if duplicate is not None:
+                self._reuse_duplicate(duplicate, index, line, output_path)
+                continue
+            self._submit_line(index, line, output_path)
+
+    def _submit_line(self, index: int, line: dict, output_path: Path) -> None:
+        """Send a line to the TTS pool, as sentence-sized pieces if it is long"""
+        with self.lock:
+            voice = self._get_voice(line)
+            if voice != self.last_voice:
+                self.progress_data.metrics["voice_switches"] = self.progress_data.metrics.get("voice_switches", 0) + 1
+                self.last_voice = voice
+        pieces = split_for_tts(line["line"], self.request.sentence_max_chars) if self.request.split_long_lines else [line["line"]]
+        if len(pieces) <= 1:
+            future = self.pool.submit(self._synthesize, line, output_path)
+            future.add_done_callback(partial(self._on_done, index, line, output_path))
+            return
+
+        # A long line is synthesized as concurrent sentence-sized requests, stitched back once all are done
+        with self.lock:
+            self.progress_data.metrics["split_lines"] = self.progress_data.metrics.get("split_lines", 0) + 1
+        split_line = {"results": [None] * len(pieces), "remaining": len(pieces)}
+        for piece, piece_text in enumerate(pieces):
+            piece_path = self.output_dir / f"{index:05d}.{piece:02d}.part.wav"
+            future = self.pool.submit(self._synthesize, {**line, "line": piece_text}, piece_path)
+            future.add_done_callback(partial(self._on_piece_done, index, line, output_path, split_line, piece, piece_path))
+
+    def _get_dedup_key(self, line: dict) -> Tuple[str, str, str]:
+        """Lines with the same voice, instruct and text (up to whitespace and Unicode width) sound the same"""
+        text = " ".join(unicodedata.normalize("NFKC", line["line"]).split())
+        return self._get_voice(line), line["instruct"].strip(), text
+
+    def _get_character(self, line: dict) -> Tuple[str, bool]:
+        """The character voicing a line and whether the narrator stands in for it"""
+        if line["character"] in self.cast_dict:
+            return line["character"], False
+        return "Narrator", True
+
+    def _reuse_duplicate(self, duplicate: dict, index: int, line: dict, output_path: Path) -> None:
+        """Give a line the audio of an identical line synthesized earlier in the job"""
+        character, is_fallback = self._get_character(line)
+        try:
+            output_path.unlink(missing_ok=True)
+            try:
+                os.link(duplicate["path"], output_path)
+            except OSError:
+                shutil.copyfile(duplicate["path"], output_path)
+            result = LineResult(True, character, is_fallback, deduplicated=True, duration=duplicate["result"].duration)
+        except Exception as e:
+            logger.error(f"Error reusing the audio of {duplicate['path']} for line {index}: {e}")
+            result = LineResult(False, character, is_fallback)
+        self._finish_line(index, line, output_path, result)
+
+    def _get_voice(self, line: dict) -> str:
+        """The prompt audio a line is voiced with"""
+        cast_info = self.cast_dict.get(line["character"]) or self.cast_dict["Narrator"]
+        return cast_info["prompt_wav"]
+
+    def _get_line_key(self, line: dict) -> str:
+        cast_info = self.cast_dict.get(line["character"]) or self.cast_dict["Narrator"]
+        return get_line_key(line, cast_info)
+
+    def _synthesize(self, line: dict, output_path: Path) -> LineResult:
+        if self.cancel is not None and self.cancel.is_set():
+            raise JobCancelledError("Voice generation cancelled")
+        line_started_at = time.monotonic()
+        result = self.processor.synthesize_line(self.request, self.cast_dict, line, output_path, self.backend_pool)
+        return result._replace(seconds=time.monotonic() - line_started_at)
+
+    def _on_done(self, index: int, line: dict, output_path: Path, future: Future) -> None:
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error(f"Error generating audio for line {index}: {e}")
+            result = LineResult(False, line["character"])
+        self._finish_line(index, line, output_path, result)
+
+    def _on_piece_done(self, index: int, line: dict, output_path: Path, split_line: dict, piece: int,
+                       piece_path: Path, future: Future) -> None:
+        try:
+            result = future.result()
+        except Exception as e:
+            logger.error(f"Error generating audio for line {index}, piece {piece}: {e}")
+            result = LineResult(False, line["character"])
+        with self.lock:
+            split_line["results"][piece] = (result, piece_path)
+            split_line["remaining"] -= 1
+            if split_line["remaining"]:
+                return
+
+        results = [piece_result for piece_result, _ in split_line["results"]]
+        piece_paths = [path for _, path in split_line["results"]]
+        success_flag = all(piece_result.success for piece_result in results)
+        duration = None
+        if success_flag:
+            try:
+                samples = stitch_segments(piece_paths, output_path, self.request.sentence_gap_ms / 1000)
+                duration = samples / TTS_SAMPLE_RATE
+            except Exception as e:
+                logger.error(f"Error stitching line {index}: {e}")
+                success_flag = False
+        for path in piece_paths:
+            path.unlink(missing_ok=True)
+
+        self._finish_line(index, line, output_path, LineResult(
+            success_flag,
+            results[0].character,
+            results[0].is_fallback,
+            endpoint=next((piece_result.endpoint for piece_result in reversed(results) if piece_result.endpoint), None),
+            cache_hit=all(piece_result.cache_hit for piece_result in results),
+            seconds=sum(piece_result.seconds for piece_result in results),
+            duration=duration
+        ))
+
+    def _finish_line(self, index: int, line: dict, output_path: Path, result: LineResult) -> None:
+        """Record a synthesized line in the manifest, then account it"""
+        if result.success:
+            try:
+                duration = result.duration if result.duration is not None else sf.info(output_path).duration
+                with self.lock:
+                    self.manifest.record(index, self._get_line_key(line), output_path, duration,
+                                         result.character, result.is_fallback)
+                result = result._replace(duration=duration)
+            except Exception as e:
+                logger.error(f"Error recording line {index}: {e}")
+                result = result._replace(success=False)
+        self._complete(index, line, output_path, result)
+
+        # Hand the audio to the identical lines waiting for this one
+        dedup_key = self._get_dedup_key(line)
+        next_line = None
+        with self.lock:
+            duplicate = self.duplicates.get(dedup_key)
+            if not duplicate or duplicate["path"] != output_path:
+                return
+            followers, duplicate["followers"] = duplicate["followers"], []
+            if result.success:
+                duplicate["result"] = result
+            elif followers:
+                # The next occurrence is synthesized on its own and the others wait for it instead
+                next_line, followers = followers[0], followers[1:]
+                self.duplicates[dedup_key] = {"path": next_line[2], "result": None, "followers": followers}
+            else:
+                del self.duplicates[dedup_key]
+        if next_line:
+            self._submit_line(*next_line)
+        elif result.success:
+            for follower in followers:
+                self._reuse_duplicate(duplicate, *follower)
+
+    def _complete(self, index: int, line: dict, output_path: Path, result: LineResult) -> None:
+        """Account a finished line in the progress and flush the lines now in order"""
+        with self.lock:
+            progress_data = self.progress_data
+            metrics = progress_data.metrics
+            if result.is_fallback:
+                progress_data.narrator_success_count += int(result.success)
+                progress_data.narrator_failed_count += int(not result.success)
+            else:
+                progress_data.success_count += int(result.success)
+                progress_data.failed_count += int(not result.success)
+            progress_data.processed_lines += 1
+            elapsed_minutes = (time.monotonic() - self.started_at) / 60
+            metrics["lines_per_minute"] = round(progress_data.processed_lines / elapsed_minutes, 2) if elapsed_minutes else None
+            metrics["tts_seconds"] = round(metrics.get("tts_seconds", 0.0) + result.seconds, 2)
+            if result.endpoint:
+                self._record_backend(result.endpoint, result.success, result.seconds)
+            if result.resumed:
+                metrics["resumed_lines"] = metrics.get("resumed_lines", 0) + 1
+            elif result.deduplicated:
+                # TTS calls saved by reusing an identical line of this job
+                metrics["deduplicated_lines"] = metrics.get("deduplicated_lines", 0) + 1
+            elif self.request.use_cache:
+                metrics["cache_hits"] = metrics.get("cache_hits", 0) + int(result.cache_hit)
+                metrics["cache_misses"] = metrics.get("cache_misses", 0) + int(not result.cache_hit)
+                metrics["cache_hit_rate"] = round(metrics["cache_hits"] / (metrics["cache_hits"] + metrics["cache_misses"]), 3)
+            self.results[index] = (line, output_path, result.success, result.character, result.duration)
+            self._flush()
+            self.pbar.update(1)
+            self.completed += 1
+            if self.completed >= self.submitted and self.busy_since is not None:
+                self.busy_seconds += time.monotonic() - self.busy_since
+                self.busy_since = None
+            self.all_done.notify_all()
+            with open(self.progress_file, 'w', encoding='utf-8') as f:
+                json.dump(progress_data.model_dump(), f)
+
+    def _record_backend(self, endpoint: str, success_flag: bool, seconds: float) -> None:
+        """Update this job's throughput of a backend. Must hold self.lock."""
+        if self.progress_data.backends is None:
+            self.progress_data.backends = {}
+        stats = self.progress_data.backends.setdefault(endpoint, {"lines": 0, "failed": 0, "seconds": 0.0})
+        stats["lines"] += int(success_flag)
+        stats["failed"] += int(not success_flag)
+        stats["seconds"] = round(stats["seconds"] + seconds, 2)
+        elapsed_minutes = (time.monotonic() - self.started_at) / 60
+        stats["lines_per_minute"] = round(stats["lines"] / elapsed_minutes, 2) if elapsed_minutes else None
+
+    def _flush(self) -> None:
+        """Append the contiguous run of finished lines to file_list and subtitles. Must hold self.lock."""
+        while self.next_flush in self.results:
+            line, output_path, success_flag, character, duration = self.results.pop(self.next_flush)
+            self.next_flush += 1
+            self.file_list.append(output_path)
+            if not success_flag:
+                continue
+            if self.assembler:
+                self.assemble_queue.put(output_path)
+            self.subtitle_data.append({
+                'index': len(self.subtitle_data) + 1,
+                'start': self.current_time,
+                'end': self.current_time + duration,
+                'character': character,
+                'text': line["line"]
+            })
+            self.current_time += duration
+            if self.progress_data.metrics.get("time_to_first_audio") is None:
+                self.progress_data.metrics["time_to_first_audio"] = round(time.monotonic() - self.started_at, 2)
+
+    def _run_assembler(self) -> None:
+        """Feed the flushed lines to the encoder until close() queues None"""
+        while True:
+            output_path = self.assemble_queue.get()
+            if output_path is None:
+                return
+            self.assembler.append(output_path)
+
+    def close(self, abort: bool = False) -> Tuple[list, list, bool]:
+        """
+        Wait for every submitted line.
+
+        Args:
+            abort (bool): Whether the job failed, in which case the final audio is dropped
+
+        Returns:
+            Tuple[list, list, bool]: The ordered file_list and subtitles, and whether final_output.m4a was assembled
+        """
+        with self.all_done:
+            self.all_done.wait_for(lambda: self.completed >= self.submitted)
+        self.pool.shutdown(wait=True)
+        self.pbar.close()
+        cancelled = self.cancel is not None and self.cancel.is_set()
+        abort = abort or cancelled
+        assembled = False
+        if self.assembler:
+            if abort:
+                # Appends still queued return at once once the assembler failed
+                self.assembler.abort()
+            self.assemble_queue.put(None)
+            self.assembler_thread.join()
+            if not abort:
+                assembled = self.assembler.close()
+        if cancelled:
+            raise JobCancelledError("Voice generation cancelled")
+        return self.file_list, self.subtitle_data, assembled
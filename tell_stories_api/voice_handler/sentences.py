@@ -0,0 +1,90 @@
+import re
+from typing import List
+
+# CJK punctuation ends a sentence anywhere; Latin punctuation only before whitespace (not in 3.14 or a.m.)
+CJK_TERMINATORS = "。！？；…"
+LATIN_TERMINATORS = ".!?;"
+CLOSERS = "\"'”’」』）】)"
+CLAUSE_BREAK = re.compile(r"(?<=[，、：,:])")
+ABBREVIATIONS = {"mr", "mrs", "ms", "dr", "st", "jr", "sr", "vs", "etc", "prof", "mt"}
+
+
+def _is_abbreviation(text: str, dot_index: int) -> bool:
+    word = re.search(r"(\w+)$", text[:dot_index])
+    return bool(word) and word.group(1).lower() in ABBREVIATIONS
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Split text into sentences, keeping each sentence's punctuation, closing quotes and trailing
+    whitespace so that joining the result gives back the text.
+    """
+    sentences = []
+    start = 0
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char not in CJK_TERMINATORS and char not in LATIN_TERMINATORS:
+            i += 1
+            continue
+        end = i + 1
+        while end < len(text) and (text[end] in CJK_TERMINATORS or text[end] in LATIN_TERMINATORS or text[end] in CLOSERS):
+            end += 1
+        is_cjk = any(c in CJK_TERMINATORS for c in text[i:end])
+        if is_cjk or end == len(text) or (text[end].isspace() and not (char == "." and _is_abbreviation(text, i))):
+            while end < len(text) and text[end].isspace():
+                end += 1
+            sentences.append(text[start:end])
+            start = end
+        i = end
+    if start < len(text):
+        sentences.append(text[start:])
+    return sentences
+
+
+def _split_long_sentence(sentence: str, max_chars: int) -> List[str]:
+    """Split a sentence longer than max_chars at clause breaks (commas, colons), then hard at max_chars"""
+    pieces = []
+    for clause in CLAUSE_BREAK.split(sentence):
+        while clause and len(clause) > max_chars:
+            # Prefer cutting at a space for Latin text
+            cut = clause.rfind(" ", 0, max_chars)
+            # Always at least one character, so the clause shrinks whatever max_chars is
+            cut = cut + 1 if cut > 0 else max(1, max_chars)
+            pieces.append(clause[:cut])
+            clause = clause[cut:]
+        if clause:
+            pieces.append(clause)
+    return pieces
+
+
+def split_for_tts(text: str, max_chars: int) -> List[str]:
+    """
+    Split a long line into TTS requests of whole sentences, each at most max_chars long where possible.
+    Short consecutive sentences are merged so requests are not needlessly small.
+
+    Args:
+        text (str): The line text, Latin or CJK
+        max_chars (int): The length above which a line is split
+
+    Returns:
+        List[str]: The pieces, in order; just the text if it is not longer than max_chars or has nothing to split
+    """
+    if len(text) <= max_chars:
+        return [text]
+
+    units = []
+    for sentence in split_sentences(text):
+        units.extend([sentence] if len(sentence) <= max_chars else _split_long_sentence(sentence, max_chars))
+
+    pieces = []
+    current = ""
+    for unit in units:
+        if current and len(current) + len(unit) > max_chars:
+            pieces.append(current)
+            current = ""
+        current += unit
+    if current:
+        pieces.append(current)
+    # Never empty, e.g. for whitespace-only text, so the line is still sent as one request
+    return [piece.strip() for piece in pieces if piece.strip()] or [text]
@@ -1,9 +1,13 @@
 from pathlib import Path
-from .models import VoiceRequest, VoiceResponse, VoiceCastResponse, ProgressData
+from typing import List
+from .models import VoiceRequest, StreamRequest, VoiceResponse, VoiceCastResponse, ProgressData
 from .processor import VoiceProcessor
+from tell_stories_api.jobs.job_queue import get_job_queue, get_job_summary
 from tell_stories_api.logs import logger
+from tell_stories_api.provider.usage import get_job_total_tokens
+import asyncio
 import json
-from threading import Thread
+import os
 
 class VoiceProcessError(Exception):
     """Base exception for voice processing errors"""
@@ -17,6 +21,15 @@ class ProcessingError(VoiceProcessError):
     """Raised when processing fails"""
     pass
 
+class JobConflictError(VoiceProcessError):
+    """Raised when a request would write the files of a running voice job"""
+    pass
+
+VOICE_REQUEST_FILE = "voice_request.json"
+VOICE_JOB_KINDS = ["voice", "voice_stream"]
+# Resume voice jobs interrupted by a restart when the app starts
+VOICE_AUTO_RESUME = os.getenv("VOICE_AUTO_RESUME", "true").lower() == "true"
+
 class VoiceService:
     def __init__(self):
         self.processor = VoiceProcessor()
@@ -45,6 +58,9 @@ class VoiceService:
         request: VoiceRequest,
     ) -> VoiceResponse:
         process_dir = Path("data/process") / process_id
+        active_job = get_job_queue().get_active(process_id, VOICE_JOB_KINDS)
+        if active_job:
+            return self._get_active_job_response(process_id, active_job)
         
         # Validate required files
         required_files = ["plot.json", "cast.json", "lines.json"]
@@ -55,32 +71,150 @@ class VoiceService:
         if not (process_dir / "voice_cast.json").exists():
             raise FileNotFoundError("voice_cast.json not found. Please run voice casting first.")
         
-        # Start processing in background using Thread
-        # BUG: 这里使用threading有一个开发时的运行时bug：就是如果我reload了程序，那么这个线程就会消失，这样生成就会断掉
-        # TODO: 不过这个后续可以通过断点续传来做
-        Thread(
-            target=self.processor.process_voice_generation,
-            args=(request, process_dir),
-            daemon=True
-        ).start()
+        # Queue the job for a worker. The request is also saved with the process so that a job
+        # started before the queue existed can still be resumed (see resume_interrupted_jobs)
+        with open(process_dir / VOICE_REQUEST_FILE, 'w', encoding='utf-8') as f:
+            json.dump(request.model_dump(), f)
+        job_id = get_job_queue().enqueue("voice", process_id, request.model_dump())
         
         return VoiceResponse(
-            status="processing",
+            status="queued",
             process_id=process_id,
-            message="Voice generation started. Use /voice/{process_id}/progress to check voice generation status."
+            message=f"Voice generation queued as job {job_id}. Use /voice/{{process_id}}/progress to check voice generation status."
+        )
+
+    async def start_streaming_generation(
+        self,
+        process_id: str,
+        request: StreamRequest,
+    ) -> VoiceResponse:
+        """Start a job that generates the lines and voices each story part as soon as it is ready"""
+        # Imported here as the script service lazily imports the voice handler
+        from tell_stories_api.script_handler.service import ScriptService
+
+        process_dir = Path("data/process") / process_id
+        # Checked before the script pipeline, which would spend LLM tokens for a job that never runs
+        active_job = get_job_queue().get_active(process_id, VOICE_JOB_KINDS)
+        if active_job:
+            return self._get_active_job_response(process_id, active_job)
+
+        if request.story_path or request.text_input:
+            await ScriptService.generate_complete_script(
+                process_id,
+                request.story_path,
+                request.split_dialogue,
+                request.all_caps_to_proper,
+                request.text_input,
+                request.book_id
+            )
+
+        for file in ["plot.json", "story.txt", "cast.json"]:
+            if not (process_dir / file).exists():
+                raise FileNotFoundError(f"Required file {file} not found. Please provide a story or run the script pipeline first.")
+
+        if not (process_dir / "voice_cast.json").exists():
+            await self.perform_voice_casting(process_id)
+
+        # Baseline of max_tokens_budget across the job's attempts
+        payload = {**request.model_dump(), "start_tokens": get_job_total_tokens(process_id)}
+        job_id = get_job_queue().enqueue("voice_stream", process_id, payload)
+
+        return VoiceResponse(
+            status="queued",
+            process_id=process_id,
+            message=f"Streaming generation queued as job {job_id}. Use /voice/{{process_id}}/progress to check voice generation status."
         )
 
+    @staticmethod
+    def _get_active_job_response(process_id: str, job: dict) -> VoiceResponse:
+        """Response to a repeated request while the process already has a voice job, which is left untouched"""
+        return VoiceResponse(
+            status=job["state"],
+            process_id=process_id,
+            message=f"Voice generation is already {job['state']} as {job['kind']} job {job['id']}. Use /voice/{{process_id}}/progress to check voice generation status."
+        )
+
+    def resume_interrupted_jobs(self) -> List[str]:
+        """
+        Restart the voice generation jobs still marked as processing but unknown to the job queue, i.e.
+        started by a version without it, in resume mode so only their missing lines are synthesized.
+        Streaming jobs are marked interrupted instead, as their lines were being generated too.
+        Jobs in the queue need none of this: their expired leases are retried by the workers.
+        """
+        resumed = []
+        for progress_file in Path("data/process").glob("*/voice_progress.json"):
+            process_dir = progress_file.parent
+            try:
+                with open(progress_file, encoding='utf-8') as f:
+                    progress_data = ProgressData(**json.load(f))
+                if progress_data.status != "processing":
+                    continue
+                if get_job_queue().get_latest(process_dir.name, VOICE_JOB_KINDS):
+                    continue
+                request_file = process_dir / VOICE_REQUEST_FILE
+                if (progress_data.metrics or {}).get("mode") == "streaming" or not request_file.exists():
+                    progress_data.status = "interrupted"
+                    progress_data.error = "Interrupted by a restart. Start it again with resume enabled."
+                    with open(progress_file, 'w', encoding='utf-8') as f:
+                        json.dump(progress_data.model_dump(), f)
+                    continue
+                with open(request_file, encoding='utf-8') as f:
+                    request = VoiceRequest(**{**json.load(f), "resume": True})
+                self.start_voice_generation(process_dir.name, request)
+                resumed.append(process_dir.name)
+            except Exception as e:
+                logger.error(f"Failed to resume voice generation of {process_dir.name}: {e}")
+        if resumed:
+            logger.info(f"Resumed interrupted voice generation: {', '.join(resumed)}")
+        return resumed
+
+    async def regenerate_line(self, process_id: str, index: int, request: VoiceRequest) -> dict:
+        process_dir = Path("data/process") / process_id
+        for file in ["lines.json", "voice_cast.json"]:
+            if not (process_dir / file).exists():
+                raise FileNotFoundError(f"Required file {file} not found. Please run script generation and voice casting first.")
+        # The job would be writing the same segments and manifest
+        active_job = get_job_queue().get_active(process_id, VOICE_JOB_KINDS)
+        if active_job:
+            raise JobConflictError(f"Voice generation is {active_job['state']} as {active_job['kind']} job {active_job['id']}. Regenerate lines once it is done.")
+        # Runs on a worker thread: the request may wait for a free TTS slot
+        return await asyncio.to_thread(self.processor.regenerate_line, request, process_dir, index)
+
     async def get_progress(self, process_id: str) -> ProgressData:
+        """Get the progress of the voice generation, with the state of its job in the queue"""
         process_dir = Path("data/process") / process_id
         progress_file = process_dir / "voice_progress.json"
+        job = get_job_queue().get_latest(process_id, VOICE_JOB_KINDS)
         
         if not progress_file.exists():
-            raise FileNotFoundError("Progress file not found. Voice generation may not have started.")
-        
-        with open(progress_file, 'r') as f:
-            progress_data = json.load(f)
+            if job is None:
+                raise FileNotFoundError("Progress file not found. Voice generation may not have started.")
+            progress_data = ProgressData(
+                total_lines=0,
+                processed_lines=0,
+                success_count=0,
+                failed_count=0,
+                narrator_success_count=0,
+                narrator_failed_count=0,
+                status="processing"
+            )
+        else:
+            with open(progress_file, 'r') as f:
+                progress_data = ProgressData(**json.load(f))
+
+        if job is not None:
+            progress_data.job = get_job_summary(job)
+            # The progress file is from a previous attempt or job until a worker picks the job up,
+            # and stays "processing" when the worker died on the last attempt
+            if job["state"] == "queued":
+                progress_data.status = "queued"
+            elif job["state"] == "running" and (not progress_file.exists() or progress_file.stat().st_mtime < job["started_at"]):
+                progress_data.status = "processing"
+            elif job["state"] == "failed" and progress_data.status == "processing":
+                progress_data.status = "failed"
+                progress_data.error = job["error"]
             
-        return ProgressData(**progress_data)
+        return progress_data
 
     async def process_voice(
         self,
@@ -1,14 +1,17 @@
 import requests
-import torch
-import torchaudio
 import numpy as np
+import soundfile as sf
 import subprocess
 from tell_stories_api.logs import logger
 from pathlib import Path
 import json
-from typing import List, Dict
+from threading import Lock
+from typing import List, Dict, Tuple
 from tell_stories_api.const import VA_DATABASE_PATHS
 
+# Sample rate of the audio returned by CosyVoice 2
+TTS_SAMPLE_RATE = 22050
+
 def to_absolute_path(relative_path: str) -> str:
     """Convert a relative path to absolute path."""
     workspace_root = Path(__file__).parent.parent.parent
@@ -19,57 +22,83 @@ def to_relative_path(absolute_path: str) -> str:
     workspace_root = Path(__file__).parent.parent.parent
     return str(Path(absolute_path).relative_to(workspace_root))
 
-def generate_audio(url: str, text: str, prompt_text: str, prompt_wav: str, output_path: str) -> bool:
-    payload = {
-        'tts_text': text,
-        'prompt_text': prompt_text
-    }
+def stream_audio_to_wav(response: requests.Response, output_path: str) -> int:
+    """
+    Write the raw 16-bit PCM of a streamed TTS response straight into a WAV file, chunk by chunk,
+    without holding the whole response in memory.
+
+    Returns:
+        int: The number of samples written
+    """
+    samples = 0
+    leftover = b''
+    with sf.SoundFile(output_path, mode='w', samplerate=TTS_SAMPLE_RATE, channels=1, subtype='PCM_16') as wav:
+        for chunk in response.iter_content(chunk_size=16000):
+            if leftover:
+                chunk = leftover + chunk
+            # A chunk may end in the middle of a sample; keep the odd byte for the next one
+            usable = len(chunk) - len(chunk) % 2
+            leftover = chunk[usable:]
+            if usable:
+                pcm = np.frombuffer(chunk, dtype=np.int16, count=usable // 2)
+                wav.write(pcm)
+                samples += len(pcm)
+    return samples
+
+# Path -> (mtime, bytes): only the current version of each prompt audio is kept
+_prompt_wav_cache: Dict[str, Tuple[int, bytes]] = {}
+_prompt_wav_lock = Lock()
+
+def load_prompt_wav(prompt_wav: str) -> bytes:
+    """Get the bytes of a VA's prompt audio, read once per file version and shared by every request"""
+    # Convert relative path to absolute path for file operations
+    abs_prompt_wav = Path(to_absolute_path(prompt_wav))
+    mtime = abs_prompt_wav.stat().st_mtime_ns
+    with _prompt_wav_lock:
+        cached = _prompt_wav_cache.get(str(abs_prompt_wav))
+        if cached is None or cached[0] != mtime:
+            # A new version replaces the previous one
+            cached = _prompt_wav_cache[str(abs_prompt_wav)] = (mtime, abs_prompt_wav.read_bytes())
+        return cached[1]
+
+def _request_audio(url: str, payload: dict, prompt_wav: str, output_path: str) -> int:
+    """Call a CosyVoice inference endpoint and save the audio. Returns the number of samples, 0 on failure."""
     try:
-        # Convert relative path to absolute path for file operations
-        abs_prompt_wav = to_absolute_path(prompt_wav)
-        files = [('prompt_wav', ('prompt_wav', open(abs_prompt_wav, 'rb'), 'application/octet-stream'))]
+        files = [('prompt_wav', ('prompt_wav', load_prompt_wav(prompt_wav), 'application/octet-stream'))]
         response = requests.request("GET", url, data=payload, files=files, stream=True)
+        response.raise_for_status()
     except Exception as e:
         logger.error(e)
-        return False
+        return 0
     
     try:
-        tts_audio = b''
-        for r in response.iter_content(chunk_size=16000):
-            tts_audio += r
-        tts_speech = torch.from_numpy(np.array(np.frombuffer(tts_audio, dtype=np.int16))).unsqueeze(dim=0)
-        torchaudio.save(output_path, tts_speech, 22050)  # target_sr = 22050
+        with response:
+            samples = stream_audio_to_wav(response, output_path)
+        if not samples:
+            raise ValueError(f"Empty audio from {url}")
         logger.info(f'Saved audio to {output_path}')
-        return True
+        return samples
     except Exception as e:
         logger.error(e)
-        return False
+        # Never leave a partial segment behind
+        Path(output_path).unlink(missing_ok=True)
+        return 0
+
+def generate_audio(url: str, text: str, prompt_text: str, prompt_wav: str, output_path: str) -> int:
+    """Generate speech in zero-shot mode. Returns the number of samples written (duration = samples / TTS_SAMPLE_RATE), 0 on failure."""
+    payload = {
+        'tts_text': text,
+        'prompt_text': prompt_text
+    }
+    return _request_audio(url, payload, prompt_wav, output_path)
 
-def generate_audio_instruct(url: str, text: str, instruct_text: str, prompt_wav: str, output_path: str) -> bool:
+def generate_audio_instruct(url: str, text: str, instruct_text: str, prompt_wav: str, output_path: str) -> int:
+    """Generate speech in instruct mode. Returns the number of samples written (duration = samples / TTS_SAMPLE_RATE), 0 on failure."""
     payload = {
         'tts_text': text,
         'instruct_text': instruct_text
     }
-    try:
-        # Convert relative path to absolute path for file operations
-        abs_prompt_wav = to_absolute_path(prompt_wav)
-        files = [('prompt_wav', ('prompt_wav', open(abs_prompt_wav, 'rb'), 'application/octet-stream'))]
-        response = requests.request("GET", url, data=payload, files=files, stream=True)
-    except Exception as e:
-        logger.error(e)
-        return False
-    
-    try:
-        tts_audio = b''
-        for r in response.iter_content(chunk_size=16000):
-            tts_audio += r
-        tts_speech = torch.from_numpy(np.array(np.frombuffer(tts_audio, dtype=np.int16))).unsqueeze(dim=0)
-        torchaudio.save(output_path, tts_speech, 22050)
-        logger.info(f'(instruct mode) Saved audio to {output_path}')
-        return True
-    except Exception as e:
-        logger.error(e)
-        return False
+    return _request_audio(url, payload, prompt_wav, output_path)
 
 def get_audio_duration(file_path: str) -> float:
     """Get duration of audio file using ffprobe"""
@@ -111,4 +140,31 @@ def load_va_database() -> List[Dict]:
         except Exception as e:
             logger.error(f"Error accessing VA directory {va_base_path}: {e}")
     
-    return va_database 
\ No newline at end of file
+    return va_database
+
+_va_database_cache = {"signature": None, "database": []}
+_va_database_lock = Lock()
+
+def get_va_database_signature() -> Tuple:
+    """Get a cheap signature of all meta.json files (path and mtime) to detect VA changes."""
+    signature = []
+    for va_base_path in VA_DATABASE_PATHS:
+        base_path = Path(va_base_path)
+        if not base_path.is_dir():
+            continue
+        for meta_path in sorted(base_path.glob("*/meta.json")):
+            try:
+                signature.append((str(meta_path), meta_path.stat().st_mtime_ns))
+            except OSError:
+                continue
+    return tuple(signature)
+
+def load_va_database_cached() -> List[Dict]:
+    """Load the VA database, reusing the last result until a meta.json is added, removed or changed."""
+    signature = get_va_database_signature()
+    with _va_database_lock:
+        if _va_database_cache["signature"] != signature:
+            _va_database_cache["database"] = load_va_database()
+            _va_database_cache["signature"] = signature
+        return _va_database_cache["database"]
+
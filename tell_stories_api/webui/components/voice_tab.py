@@ -5,7 +5,8 @@ import os
 import json
 from pathlib import Path
 from typing import List, Dict, Tuple
-from tell_stories_api.voice_handler.utils import load_va_database, generate_audio_instruct
+from tell_stories_api.voice_handler.preview import DEFAULT_PREVIEW_TEXT, get_preview
+from tell_stories_api.voice_handler.utils import load_va_database
 from tell_stories_api.logs import logger
 from dotenv import load_dotenv
 load_dotenv()
@@ -171,25 +172,12 @@ def create_voice_tab(api_base_url, process_id):
             if not va_meta:
                 return None, f"❌ Error: Voice actor metadata not found for {va_name}"
             
-            url = f"http://{os.getenv('COSYVOICE2_HOST')}:{os.getenv('COSYVOICE2_PORT')}/inference_instruct2"
+            # Cached by VA, text and instruct; a miss is synthesized in the interactive TTS lane
+            output_path, cache_hit = get_preview(va_meta, preview_text)
             
-            # Create preview directory if not exists
-            preview_dir = Path("data/preview")
-            preview_dir.mkdir(parents=True, exist_ok=True)
-            output_path = preview_dir / f"{character}_{va_name}_preview.wav"
-            
-            # Use the existing generate_audio function
-            success = generate_audio_instruct(
-                url=url,
-                text=preview_text,
-                instruct_text="normal",
-                prompt_wav=va_meta['prompt_wav'],
-                output_path=str(output_path)
-            )
-            
-            if success:
-                logger.info(f"Generated preview audio: {output_path}")
-                return str(output_path), f"✅ Preview generated for {character}"
+            if output_path:
+                logger.info(f"{'Cached' if cache_hit else 'Generated'} preview audio: {output_path}")
+                return str(output_path), f"✅ Preview {'loaded' if cache_hit else 'generated'} for {character}"
             else:
                 return None, f"❌ Failed to generate preview for {character}"
                 
@@ -246,7 +234,7 @@ def create_voice_tab(api_base_url, process_id):
                             preview_btn = gr.Button("🔊 Generate Sample Voice", variant="huggingface")
                             preview_text = gr.Textbox(
                                 label="Preview Text (Use {character} as placeholder for character name)",
-                                value="My name is {character}. This is generated by tell stories dot AI.",
+                                value=DEFAULT_PREVIEW_TEXT,
                                 lines=2,
                                 show_label=True
                             )